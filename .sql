@@ -1,4 +1,6 @@
-CREATE OR REPLACE VIEW smart_buildings.energy_consumption_monthly_metrics AS
+-- Vista en vivo: recalcula todo raw.energy_consumption en cada consulta. Se mantiene como
+-- referencia y para el benchmark; el agente consulta la tabla materializada de más abajo.
+CREATE OR REPLACE VIEW smart_buildings.energy_consumption_monthly_metrics_live AS
 WITH base_data AS (
     SELECT
         cups,
@@ -106,3 +108,262 @@ final AS (
     FROM with_ytd_prev_year
 )
 SELECT * FROM final;
+
+
+-- ---------------------------------------------------------------------------
+-- Versión materializada de energy_consumption_monthly_metrics
+-- ---------------------------------------------------------------------------
+
+-- Estado de los rollups: última actualización y hasta qué dato de raw se ha procesado.
+CREATE TABLE IF NOT EXISTS smart_buildings.rollup_state (
+    rollup_name TEXT PRIMARY KEY,
+    watermark TIMESTAMP,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- La vista original se sustituye por la tabla; solo se borra mientras siga siendo una vista,
+-- para que el script pueda ejecutarse de nuevo.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'smart_buildings'
+          AND c.relname = 'energy_consumption_monthly_metrics'
+          AND c.relkind = 'v'
+    ) THEN
+        DROP VIEW smart_buildings.energy_consumption_monthly_metrics;
+    END IF;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS smart_buildings.energy_consumption_monthly_metrics (
+    cups TEXT NOT NULL,
+    year_month DATE NOT NULL,
+    total_consumption_kwh NUMERIC,
+    daily_consumption_kwh NUMERIC,
+    total_consumption_prev_month_kwh NUMERIC,
+    diff_pct_consumption_prev_month NUMERIC,
+    std_daily_consumption_kwh NUMERIC,
+    ytd_consumption_kwh NUMERIC,
+    ytd_prev_year_consumption_kwh NUMERIC,
+    total_consumption_prev_year_same_month_kwh NUMERIC,
+    date_insert TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    is_partial_month BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (cups, year_month)
+);
+
+CREATE INDEX IF NOT EXISTS energy_consumption_monthly_metrics_year_month_idx
+    ON smart_buildings.energy_consumption_monthly_metrics (year_month);
+
+-- El refresco incremental filtra raw por fecha.
+CREATE INDEX IF NOT EXISTS energy_consumption_date_idx
+    ON raw.energy_consumption (date);
+
+-- ---------------------------------------------------------------------------
+-- Rollup diario: consumo total por cups y día
+-- ---------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS smart_buildings.daily_consumption (
+    cups TEXT NOT NULL,
+    day DATE NOT NULL,
+    consumption_kwh NUMERIC NOT NULL,
+    readings INTEGER NOT NULL,
+    date_insert TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (cups, day)
+);
+
+CREATE INDEX IF NOT EXISTS daily_consumption_day_idx
+    ON smart_buildings.daily_consumption (day);
+
+-- Agrega las lecturas de raw desde el día del watermark (ese día puede estar incompleto)
+-- hasta la lectura más reciente, y avanza el watermark. p_from fuerza un recálculo desde
+-- esa fecha (datos que llegan tarde). Devuelve el número de días escritos.
+CREATE OR REPLACE FUNCTION smart_buildings.refresh_daily_consumption(
+    p_from TIMESTAMP DEFAULT NULL
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_from TIMESTAMP;
+    v_to TIMESTAMP;
+    v_rows INTEGER;
+BEGIN
+    -- Evita dos refrescos simultáneos sobre el mismo watermark.
+    PERFORM pg_advisory_xact_lock(hashtext('smart_buildings.daily_consumption'));
+
+    v_from := DATE_TRUNC('day', COALESCE(
+        p_from,
+        (SELECT watermark FROM smart_buildings.rollup_state WHERE rollup_name = 'daily_consumption'),
+        '-infinity'::timestamp
+    ));
+
+    SELECT MAX(date) INTO v_to FROM raw.energy_consumption;
+    IF v_to IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO smart_buildings.daily_consumption (cups, day, consumption_kwh, readings, date_insert)
+    SELECT cups, DATE(date), SUM(consumption_kwh), COUNT(*), NOW()
+    FROM raw.energy_consumption
+    WHERE date >= v_from AND date <= v_to
+    GROUP BY cups, DATE(date)
+    ON CONFLICT (cups, day) DO UPDATE
+        SET consumption_kwh = EXCLUDED.consumption_kwh,
+            readings = EXCLUDED.readings,
+            date_insert = EXCLUDED.date_insert;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    INSERT INTO smart_buildings.rollup_state (rollup_name, watermark, refreshed_at)
+    VALUES ('daily_consumption', v_to, NOW())
+    ON CONFLICT (rollup_name) DO UPDATE
+        SET watermark = GREATEST(smart_buildings.rollup_state.watermark, EXCLUDED.watermark),
+            refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN v_rows;
+END;
+$$;
+
+-- Recalcula los meses desde p_from_month (por defecto, el mes anterior y el actual) a partir
+-- de daily_consumption, que debe refrescarse antes. Los LAG y el YTD del año anterior
+-- necesitan los meses desde enero del año previo, así que solo se leen días desde esa
+-- fecha. Devuelve el número de filas escritas.
+CREATE OR REPLACE FUNCTION smart_buildings.refresh_energy_consumption_monthly_metrics(
+    p_from_month DATE DEFAULT (DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 month')::date
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_from_month DATE := DATE_TRUNC('month', p_from_month)::date;
+    v_window_start DATE := (DATE_TRUNC('year', p_from_month) - INTERVAL '1 year')::date;
+    v_rows INTEGER;
+BEGIN
+    DELETE FROM smart_buildings.energy_consumption_monthly_metrics
+    WHERE year_month >= v_from_month;
+
+    INSERT INTO smart_buildings.energy_consumption_monthly_metrics (
+        cups, year_month, total_consumption_kwh, daily_consumption_kwh,
+        total_consumption_prev_month_kwh, diff_pct_consumption_prev_month,
+        std_daily_consumption_kwh, ytd_consumption_kwh, ytd_prev_year_consumption_kwh,
+        total_consumption_prev_year_same_month_kwh, date_insert, is_partial_month
+    )
+    WITH daily_agg AS (
+        -- Mes actual hasta hoy y meses anteriores completos, como la vista en vivo.
+        SELECT cups, DATE_TRUNC('month', day) AS year_month, day AS full_date, consumption_kwh AS daily_consumption_kwh
+        FROM smart_buildings.daily_consumption
+        WHERE day >= v_window_start AND day <= CURRENT_DATE
+    ),
+    monthly_agg AS (
+        SELECT
+            cups,
+            year_month,
+            SUM(daily_consumption_kwh) AS total_consumption_kwh,
+            AVG(daily_consumption_kwh) AS daily_consumption_kwh,
+            STDDEV(daily_consumption_kwh) AS std_daily_consumption_kwh,
+            SUM(SUM(daily_consumption_kwh)) OVER (
+                PARTITION BY cups, EXTRACT(YEAR FROM year_month)
+                ORDER BY year_month
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ) AS ytd_consumption_kwh
+        FROM daily_agg
+        GROUP BY cups, year_month
+    ),
+    with_lags AS (
+        SELECT
+            m.*,
+            LAG(total_consumption_kwh) OVER (PARTITION BY cups ORDER BY year_month) AS total_consumption_prev_month_kwh,
+            LAG(total_consumption_kwh, 12) OVER (PARTITION BY cups ORDER BY year_month) AS total_consumption_prev_year_same_month_kwh
+        FROM monthly_agg m
+    )
+    SELECT
+        w.cups,
+        w.year_month::date,
+        w.total_consumption_kwh,
+        w.daily_consumption_kwh,
+        w.total_consumption_prev_month_kwh,
+        CASE
+            WHEN w.total_consumption_prev_month_kwh IS NOT NULL AND w.total_consumption_prev_month_kwh != 0 THEN
+                100.0 * (w.total_consumption_kwh - w.total_consumption_prev_month_kwh) / w.total_consumption_prev_month_kwh
+            ELSE NULL
+        END,
+        w.std_daily_consumption_kwh,
+        w.ytd_consumption_kwh,
+        prev.ytd_consumption_kwh,
+        w.total_consumption_prev_year_same_month_kwh,
+        NOW(),
+        w.year_month = DATE_TRUNC('month', CURRENT_DATE)
+    FROM with_lags w
+    LEFT JOIN monthly_agg prev
+      ON prev.cups = w.cups
+      AND prev.year_month = w.year_month - INTERVAL '1 year'
+    WHERE w.year_month >= v_from_month;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    INSERT INTO smart_buildings.rollup_state (rollup_name, watermark, refreshed_at)
+    VALUES ('energy_consumption_monthly_metrics',
+            (SELECT watermark FROM smart_buildings.rollup_state WHERE rollup_name = 'daily_consumption'),
+            NOW())
+    ON CONFLICT (rollup_name) DO UPDATE
+        SET watermark = EXCLUDED.watermark, refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN v_rows;
+END;
+$$;
+
+-- Carga inicial:
+--   SELECT smart_buildings.refresh_daily_consumption();
+--   SELECT smart_buildings.refresh_energy_consumption_monthly_metrics('1900-01-01');
+-- Tras cada carga en raw: python -m agent.rollups (refresca el rollup diario y después el mensual).
+
+-- ---------------------------------------------------------------------------
+-- Registro de cambios de valores de building para el vectorstore de nombres
+-- ---------------------------------------------------------------------------
+
+-- Cada alta, cambio o baja de name o type deja una fila. agent.vectorstore_updates lee
+-- las filas posteriores a su watermark (el último id aplicado) y actualiza solo esos
+-- valores en el índice, en lugar de repetir SELECT DISTINCT sobre toda la tabla.
+CREATE TABLE IF NOT EXISTS smart_buildings.building_value_changes (
+    id BIGSERIAL PRIMARY KEY,
+    column_name TEXT NOT NULL,
+    old_value TEXT,
+    new_value TEXT,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION smart_buildings.log_building_value_changes()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_old smart_buildings.building;
+    v_new smart_buildings.building;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        v_old := OLD;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        v_new := NEW;
+    END IF;
+
+    INSERT INTO smart_buildings.building_value_changes (column_name, old_value, new_value)
+    SELECT c.column_name, c.old_value, c.new_value
+    FROM (VALUES ('name', v_old.name, v_new.name), ('type', v_old.type, v_new.type))
+        AS c (column_name, old_value, new_value)
+    WHERE c.old_value IS DISTINCT FROM c.new_value;
+
+    -- Despierta a los procesos en LISTEN; las notificaciones iguales de una transacción
+    -- se entregan una sola vez al hacer commit.
+    IF FOUND THEN
+        PERFORM pg_notify('building_value_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS building_value_changes ON smart_buildings.building;
+CREATE TRIGGER building_value_changes
+    AFTER INSERT OR UPDATE OF name, type OR DELETE ON smart_buildings.building
+    FOR EACH ROW EXECUTE FUNCTION smart_buildings.log_building_value_changes();
+
+-- Actualización del vectorstore: python -m agent.vectorstore_updates (--listen para
+-- aplicar los cambios según llegan las notificaciones).
@@ -0,0 +1,135 @@
+"""Compare the recall and latency of the vectorstore index types against exact search.
+
+The base vectors are the embeddings stored in ``src/name_vectorstore`` and
+``src/sql_vectorstore`` (or a ``.npy`` matrix given with ``--embeddings``), grown to
+``--size`` rows with noisy copies so the comparison runs at the registry sizes we expect.
+Queries are further noisy copies of random base rows. For every index type of
+``agent.ann_index`` and every search setting (``--ef-search`` for HNSW, ``--nprobe`` for
+IVF-PQ) the benchmark reports build time, index size, recall@k against ``flat`` and
+single-query latency percentiles.
+
+Usage:
+    python benchmarks/ann_recall.py --size 50000 --output ann_recall.json
+    python benchmarks/ann_recall.py --embeddings names.npy --k 5 --ef-search 16,64,256 --nprobe 4,16,64
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from agent import ann_index, vectorstore_io
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def stored_embeddings() -> np.ndarray:
+    """Reconstruct the embeddings of every entry of the native vectorstores."""
+    rows = []
+    for name in ("name_vectorstore", "sql_vectorstore"):
+        path = ROOT / "src" / name
+        if not vectorstore_io.is_native_vectorstore(path):
+            continue
+        store = vectorstore_io.load_vectorstore(path, mmap=False)
+        for entry in ([store] if "index" in store else store.values()):
+            rows.append(entry["index"].reconstruct_n(0, entry["index"].ntotal))
+    if not rows:
+        raise SystemExit("No hay vectorstores nativos en src/; usa --embeddings.")
+    return np.vstack(rows)
+
+
+def grow(base: np.ndarray, size: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """Return ``size`` rows: ``base`` followed by noisy copies of random base rows."""
+    base = ann_index.normalize(base)
+    if size <= len(base):
+        return base[:size]
+    picks = rng.integers(0, len(base), size - len(base))
+    copies = base[picks] + rng.normal(scale=noise / np.sqrt(base.shape[1]), size=(len(picks), base.shape[1]))
+    return np.vstack([base, ann_index.normalize(copies)])
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def time_queries(index, queries: np.ndarray, k: int) -> list:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", type=Path, help="Base vectors as a .npy matrix instead of the vectorstores.")
+    parser.add_argument("--size", type=int, default=20000, help="Number of indexed vectors.")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.3, help="Norm of the noise added to synthetic rows and queries.")
+    parser.add_argument("--k", type=int, default=2, help="Neighbours per query (retrieval uses 2).")
+    parser.add_argument("--ef-search", default="16,64,128", help="Comma-separated HNSW ef_search values.")
+    parser.add_argument("--nprobe", default="4,16,64", help="Comma-separated IVF-PQ nprobe values.")
+    parser.add_argument("--hnsw-m", type=int, default=ann_index.HNSW_DEFAULTS["m"])
+    parser.add_argument("--pq-m", type=int, default=ann_index.IVFPQ_DEFAULTS["m"])
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads (1 matches a request searching alone).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON.")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    base = np.load(args.embeddings) if args.embeddings else stored_embeddings()
+    vectors = grow(base, args.size, args.noise, rng)
+    picks = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = ann_index.normalize(picks + rng.normal(scale=args.noise / np.sqrt(vectors.shape[1]), size=picks.shape))
+
+    configurations = [("flat", {}, {})]
+    configurations += [("hnsw", {"m": args.hnsw_m}, {"ef_search": int(ef)}) for ef in args.ef_search.split(",")]
+    configurations += [("ivfpq", {"m": args.pq_m}, {"nprobe": int(n)}) for n in args.nprobe.split(",")]
+
+    built, results, truth = {}, [], None
+    print(f"{len(vectors)} vectores de dimensión {vectors.shape[1]}, {len(queries)} consultas, k={args.k}")
+    print(f"{'index':<8} {'search':<14} {'build':>8} {'size':>9} {'recall':>7} {'p50':>9} {'p95':>9}")
+    for index_type, build_settings, search_settings in configurations:
+        if index_type not in built:
+            start = time.perf_counter()
+            index, build_params = ann_index.build_index(vectors, index_type, **build_settings)
+            built[index_type] = (index, build_params, time.perf_counter() - start,
+                                 int(faiss.serialize_index(index).nbytes))
+        index, build_params, build_seconds, size_bytes = built[index_type]
+        params = {**build_params, **search_settings}
+        ann_index.apply_search_params(index, params)
+
+        _, found = index.search(queries, args.k)
+        if truth is None:
+            truth = found
+        samples = time_queries(index, queries, args.k)
+        result = {
+            "index_type": index_type, "build_params": params, "build_seconds": build_seconds,
+            "size_bytes": size_bytes, "recall": recall(found, truth),
+            "latency_p50": statistics.median(samples), "latency_p95": percentile(samples, 0.95),
+            "latency_p99": percentile(samples, 0.99),
+        }
+        results.append(result)
+        label = ", ".join(f"{k}={v}" for k, v in search_settings.items()) or "-"
+        print(f"{index_type:<8} {label:<14} {build_seconds:7.2f}s {size_bytes / 2**20:7.1f}MB {result['recall']:7.3f} "
+              f"{result['latency_p50'] * 1e6:7.0f}us {result['latency_p95'] * 1e6:7.0f}us")
+
+    if args.output:
+        args.output.write_text(json.dumps({"size": len(vectors), "dimension": int(vectors.shape[1]),
+                                           "queries": len(queries), "k": args.k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Cold-start benchmark for the agent.
+
+Each sample runs in a fresh interpreter and measures:
+
+    import_graph     time to ``import agent.graph`` (graph compiled, nothing loaded)
+    configuration    time to build ``Configuration.from_runnable_config({})``
+    warmup           time for ``agent.warmup.warmup()`` (model, vectorstores, DB ping)
+    first_retrieval  time of the first ``retrieve_relevant_values`` call after warm-up
+
+Usage:
+    python benchmarks/cold_start.py --runs 5 --output cold_start.json
+    python benchmarks/cold_start.py --skip-warmup   # import-time only, no model or DB needed
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+SAMPLE = """
+import asyncio, json, time
+timings = {}
+start = time.perf_counter()
+import agent.graph as graph_module
+timings["import_graph"] = time.perf_counter() - start
+
+from langchain_core.messages import HumanMessage
+from agent.configuration import Configuration
+from agent.state import State
+
+start = time.perf_counter()
+Configuration.from_runnable_config({})
+timings["configuration"] = time.perf_counter() - start
+
+if WARMUP:
+    from agent.warmup import warmup
+
+    start = time.perf_counter()
+    warmup()
+    timings["warmup"] = time.perf_counter() - start
+
+    state = State(messages=[HumanMessage(content="Consumo total de Torre Norte en abril")])
+    start = time.perf_counter()
+    asyncio.run(graph_module.retrieve_relevant_values(state, config={}))
+    timings["first_retrieval"] = time.perf_counter() - start
+
+print(json.dumps(timings))
+"""
+
+
+def run_sample(warmup: bool) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT / "src"), os.environ.get("PYTHONPATH")])))
+    code = SAMPLE.replace("WARMUP", repr(warmup))
+    completed = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--skip-warmup", action="store_true", help="Only measure imports and configuration.")
+    parser.add_argument("--output", type=Path, help="Write the raw samples and medians as JSON.")
+    args = parser.parse_args()
+
+    samples = [run_sample(not args.skip_warmup) for _ in range(args.runs)]
+    medians = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+    for key, value in medians.items():
+        print(f"{key:<16} {value * 1000:9.1f} ms")
+    if args.output:
+        args.output.write_text(json.dumps({"median": medians, "samples": samples}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
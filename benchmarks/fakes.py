@@ -0,0 +1,452 @@
+"""Deterministic stand-ins for the model, the embeddings and the database used by the benchmarks.
+
+* ``FakeChatModel`` answers with the known SQL of a question when it gets the SQL
+  generation prompt, and with a fixed explanation otherwise, after a configurable latency.
+* ``FakeStructuredModel`` routes every question to the database.
+* ``LatencyLimiter`` lets fake models share a limited number of concurrent calls, like an
+  Ollama server with ``OLLAMA_NUM_PARALLEL`` slots, and records how long calls queue.
+* ``HashEmbeddingModel`` embeds texts by hashing their words and character trigrams, so
+  similar questions get similar vectors without downloading a model.
+  ``build_hash_vectorstores`` re-embeds the values of the real vectorstores with it, so
+  that queries and indexes share one embedding space.
+* ``create_standin_database`` builds a SQLite file with the tables of ``schema.sql``
+  attached as ``smart_buildings`` and synthetic data, and ``to_sqlite`` rewrites the
+  PostgreSQL constructs of the dataset queries (``DATE_TRUNC``, ``INTERVAL``, casts).
+  ``add_query_latency`` makes every statement hold its connection for longer.
+
+``patch_agent`` swaps them into ``agent.graph``.
+"""
+
+import asyncio
+import hashlib
+import random
+import re
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from sqlalchemy import event
+
+STANDIN_SCHEMA = "smart_buildings"
+FALLBACK_SQL = 'SELECT COUNT(*) AS buildings FROM smart_buildings."building"'
+FAKE_EXPLANATION = "Según los datos consultados, el consumo se mantiene dentro de lo habitual para este edificio."
+
+
+class LatencyLimiter:
+    """Run at most ``concurrency`` simulated calls at a time and record queue waits."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.waits: List[float] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def wait(self, seconds: float) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        queued = time.perf_counter()
+        async with self._semaphore:
+            self.waits.append(time.perf_counter() - queued)
+            await asyncio.sleep(seconds)
+
+
+async def _sleep(seconds: float, limiter: Optional[LatencyLimiter]) -> None:
+    if limiter is not None:
+        await limiter.wait(seconds)
+    else:
+        await asyncio.sleep(seconds)
+
+
+def _approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that returns the dataset SQL for known questions after ``latency`` seconds.
+
+    A call is treated as SQL generation when its system prompt starts like
+    ``sql_prompt``; the SQL of the last known question among the messages is returned,
+    which also covers the repair loop. Any other call gets ``explanation``.
+    """
+
+    sql_by_question: Dict[str, str] = {}
+    sql_prompt: str = ""
+    explanation: str = FAKE_EXPLANATION
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+    limiter: Optional[Any] = None
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-replay"
+
+    def _delay(self) -> float:
+        self.calls += 1
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + random.Random(self.seed + self.calls).uniform(-self.jitter, self.jitter))
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        content = self.explanation
+        prefix = self.sql_prompt.split("{", 1)[0][:200]
+        if messages and isinstance(messages[0], SystemMessage) and prefix and messages[0].content.startswith(prefix):
+            content = next(
+                (self.sql_by_question[m.content] for m in reversed(messages)
+                 if isinstance(m, HumanMessage) and m.content in self.sql_by_question),
+                FALLBACK_SQL,
+            )
+        input_tokens = sum(_approximate_tokens(str(m.content)) for m in messages)
+        output_tokens = _approximate_tokens(content)
+        return AIMessage(content=content, usage_metadata={"input_tokens": input_tokens,
+                                                          "output_tokens": output_tokens,
+                                                          "total_tokens": input_tokens + output_tokens})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await _sleep(self._delay(), self.limiter)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+
+def FakeStructuredModel(schema: Any, latency: float = 0.0, limiter: Optional[LatencyLimiter] = None) -> RunnableLambda:
+    """Return a runnable that answers every structured call with a database route."""
+
+    async def route(messages: List[BaseMessage]) -> Any:
+        await _sleep(latency, limiter)
+        return schema(type="database", logic="Pregunta sobre datos de consumo (benchmark).")
+
+    return RunnableLambda(route, name="FakeStructuredModel")
+
+
+class HashEmbeddingModel:
+    """Drop-in for ``SentenceTransformer.encode`` based on feature hashing.
+
+    Args:
+        dimension (int): Embedding size; 384 matches all-MiniLM-L6-v2 and the vectorstores.
+        latency (float): Seconds slept per ``encode`` call, to mimic the model.
+    """
+
+    def __init__(self, dimension: int = 384, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _features(self, text: str) -> Iterable[str]:
+        words = re.findall(r"\w+", text.lower())
+        yield from words
+        for word in words:
+            padded = f"#{word}#"
+            yield from (padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def encode(self, texts, batch_size: Optional[int] = None, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        if self.latency:
+            time.sleep(self.latency)
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.md5(feature.encode("utf-8")).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dimension
+                embeddings[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+
+def build_hash_vectorstores(directory: Path, embedding_model: HashEmbeddingModel, source_path: str,
+                            rewrite_sql: Optional[Callable[[str], str]] = None) -> Path:
+    """Write copies of the vectorstores at ``source_path`` embedded with ``embedding_model``.
+
+    The real indexes hold all-MiniLM-L6-v2 embeddings; searching them with hashed query
+    embeddings gives meaningless scores, so neither the name matches nor the SQL fast path
+    would behave as in production. The questions of the SQL vectorstore are re-embedded and
+    its SQL passed through ``rewrite_sql`` (e.g. ``to_sqlite`` for the stand-in database).
+
+    Returns:
+        Path: Directory to use as ``vectorstore_path``.
+    """
+    from agent import ann_index, vectorstore_io
+    from agent.configuration import VectorStoreHandler
+
+    source = VectorStoreHandler(source_path)
+    directory = Path(directory) / "vectorstores"
+    model_name = f"hash-{embedding_model.dimension}"
+
+    name_vectorstore = {}
+    for column, entry in source.name_vectorstore.items():
+        values = [str(value) for value in entry["values"] if value is not None]
+        index, build_params = ann_index.build_index(embedding_model.encode(values), "flat")
+        name_vectorstore[column] = {"index": index, "values": values, "build_params": build_params}
+    vectorstore_io.save_vectorstore(name_vectorstore, directory / "name_vectorstore", model_name)
+
+    pairs = [(question, rewrite_sql(sql) if rewrite_sql else sql)
+             for question, sql in (value for value in source.sql_vectorstore["values"] if value is not None)]
+    index, build_params = ann_index.build_index(embedding_model.encode([question for question, _ in pairs]), "flat")
+    vectorstore_io.save_vectorstore({"index": index, "values": pairs, "build_params": build_params},
+                                    directory / "sql_vectorstore", model_name)
+    return directory
+
+
+# --- SQLite stand-in ---------------------------------------------------------------
+
+def _date_trunc(unit: str, value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    day = datetime.fromisoformat(str(value)[:19]).date()
+    unit = unit.lower()
+    if unit == "year":
+        day = day.replace(month=1, day=1)
+    elif unit == "month":
+        day = day.replace(day=1)
+    elif unit == "week":
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def _extract(part: str, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(str(value)[:19])
+    part = part.lower()
+    if part == "week":
+        return moment.isocalendar()[1]
+    if part == "dow":
+        return moment.isoweekday() % 7
+    return getattr(moment, part)
+
+
+class _StdDev:
+    def __init__(self):
+        self.values: List[float] = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(float(value))
+
+    def finalize(self):
+        return float(np.std(self.values, ddof=1)) if len(self.values) > 1 else None
+
+
+def register_functions(connection: sqlite3.Connection) -> None:
+    """Register the PostgreSQL functions the dataset queries use."""
+    connection.create_function("date_trunc", 2, _date_trunc, deterministic=True)
+    connection.create_function("extract_part", 2, _extract, deterministic=True)
+    connection.create_function("greatest", -1, lambda *values: max(v for v in values if v is not None), deterministic=True)
+    connection.create_function("least", -1, lambda *values: min(v for v in values if v is not None), deterministic=True)
+    connection.create_aggregate("stddev", 1, _StdDev)
+    connection.create_aggregate("stddev_samp", 1, _StdDev)
+
+
+def _left_operand_start(sql: str, end: int) -> int:
+    """Index where the operand ending just before ``end`` starts (a call, a name or a literal)."""
+    i = end
+    while i > 0 and sql[i - 1].isspace():
+        i -= 1
+    if i > 0 and sql[i - 1] == ")":
+        depth = 0
+        while i > 0:
+            i -= 1
+            depth += {")": 1, "(": -1}.get(sql[i], 0)
+            if depth == 0:
+                break
+    elif i > 0 and sql[i - 1] == "'":
+        return sql.rfind("'", 0, i - 1)
+    while i > 0 and (sql[i - 1].isalnum() or sql[i - 1] in '_."'):
+        i -= 1
+    return i
+
+
+_INTERVAL = re.compile(r"([+-])\s*INTERVAL\s+'(\d+)\s+(\w+?)s?'", re.IGNORECASE)
+
+
+def to_sqlite(sql: str) -> str:
+    """Rewrite the PostgreSQL-only syntax of a dataset query for the SQLite stand-in."""
+    sql = re.sub(r"::\s*(?:date|numeric(?:\(\d+,\s*\d+\))?|int(?:eger)?|float8?|text|timestamp)\b", "", sql,
+                 flags=re.IGNORECASE)
+    sql = re.sub(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\s+", r"extract_part('\1', ", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bILIKE\b", "LIKE", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bDATE\s+'(\d{4}-\d{2}-\d{2})'", r"'\1'", sql, flags=re.IGNORECASE)
+    while (match := _INTERVAL.search(sql)) is not None:
+        amount, unit = int(match.group(2)), match.group(3).lower()
+        if unit == "week":
+            amount, unit = amount * 7, "day"
+        start = _left_operand_start(sql, match.start())
+        operand = sql[start:match.start()].strip()
+        sign = "-" if match.group(1) == "-" else "+"
+        sql = f"{sql[:start]}date({operand}, '{sign}{amount} {unit}s'){sql[match.end():]}"
+    return sql
+
+
+def _month_starts(months: int, today: date) -> List[date]:
+    first = today.replace(day=1)
+    starts = []
+    for back in range(months - 1, -1, -1):
+        year, month = divmod(first.year * 12 + first.month - 1 - back, 12)
+        starts.append(date(year, month + 1, 1))
+    return starts
+
+
+def _monthly_rows(cups: str, rng: random.Random, today: date) -> List[dict]:
+    rows, history = [], {}
+    base = rng.uniform(2_000, 80_000)
+    ytd = {}
+    for month in _month_starts(36, today):
+        total = round(base * rng.uniform(0.7, 1.3), 2)
+        previous = history.get((month - timedelta(days=1)).replace(day=1))
+        last_year = history.get(month.replace(year=month.year - 1))
+        ytd[month.year] = ytd.get(month.year, 0.0) + total
+        days = ((month.replace(day=28) + timedelta(days=4)).replace(day=1) - month).days
+        rows.append({
+            "cups": cups, "year_month": month.isoformat(), "total_consumption_kwh": total,
+            "avg_daily_consumption_kwh": total / days, "daily_consumption_kwh": total / days,
+            "std_daily_consumption_kwh": total / days * rng.uniform(0.05, 0.3),
+            "total_consumption_prev_month_kwh": previous,
+            "total_consumption_prev_year_same_month_kwh": last_year,
+            "diff_pct_consumption_prev_month": (total - previous) / previous * 100 if previous else None,
+            "diff_pct_consumption_prev_year_same_month": (total - last_year) / last_year * 100 if last_year else None,
+            "ytd_consumption_kwh": ytd[month.year],
+            "ytd_prev_year_consumption_kwh": ytd.get(month.year - 1),
+        })
+        history[month] = total
+    return rows
+
+
+def _weekly_rows(cups: str, rng: random.Random, today: date) -> List[dict]:
+    rows, previous = [], None
+    monday = today - timedelta(days=today.weekday())
+    base = rng.uniform(500, 20_000)
+    for back in range(103, -1, -1):
+        total = round(base * rng.uniform(0.7, 1.3), 2)
+        rows.append({
+            "cups": cups, "week_start": (monday - timedelta(weeks=back)).isoformat(),
+            "total_consumption_kwh": total, "daily_consumption_kwh": total / 7,
+            "total_consumption_prev_week_kwh": previous,
+            "diff_pct_consumption_prev_week": (total - previous) / previous * 100 if previous else None,
+            "std_daily_consumption_kwh": total / 7 * rng.uniform(0.05, 0.3),
+        })
+        previous = total
+    return rows
+
+
+def _daily_rows(cups: str, rng: random.Random, today: date) -> List[dict]:
+    base = rng.uniform(70, 3_000)
+    return [{"cups": cups, "day": (today - timedelta(days=back)).isoformat(),
+             "consumption_kwh": round(base * rng.uniform(0.6, 1.4), 2), "readings": 96}
+            for back in range(730, -1, -1)]
+
+
+def create_standin_database(directory: Path, tables: Dict[str, Any], buildings: List[str],
+                            building_types: List[str], seed: int = 0) -> str:
+    """Create the SQLite stand-in and return the path of its main database file.
+
+    Args:
+        directory (Path): Where to write the database files.
+        tables (Dict[str, TableSchema]): Tables parsed from ``schema.sql``; every column is
+            created untyped, columns without generated data stay NULL.
+        buildings (List[str]): Building names, so names in the questions match rows.
+        building_types (List[str]): Building types to assign round-robin.
+        seed (int): Seed of the synthetic data.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    main_path, data_path = directory / "main.db", directory / f"{STANDIN_SCHEMA}.db"
+    for path in (main_path, data_path):
+        path.unlink(missing_ok=True)
+
+    rng, today = random.Random(seed), date.today()
+    generators = {"daily_consumption": _daily_rows,
+                  "energy_consumption_monthly_metrics": _monthly_rows,
+                  "energy_consumption_weekly_metrics": _weekly_rows}
+    cups_codes = [f"ES{index:04d}BENCH" for index in range(len(buildings))]
+
+    connection = sqlite3.connect(data_path)
+    try:
+        for name, table in tables.items():
+            columns = ", ".join(f'"{column}"' for column in table.columns)
+            connection.execute(f'CREATE TABLE "{name}" ({columns})')
+            if name == "building":
+                rows = [{"cups": cups, "name": building, "address": f"Calle {index + 1}",
+                         "type": building_types[index % len(building_types)] if building_types else None}
+                        for index, (cups, building) in enumerate(zip(cups_codes, buildings))]
+            elif name in generators:
+                rows = [row for cups in cups_codes for row in generators[name](cups, rng, today)]
+            else:
+                continue
+            placeholders = ", ".join("?" for _ in table.columns)
+            connection.executemany(
+                f'INSERT INTO "{name}" VALUES ({placeholders})',
+                [tuple(row.get(column) for column in table.columns) for row in rows],
+            )
+            if "cups" in table.columns:
+                connection.execute(f'CREATE INDEX "{name}_cups" ON "{name}" ("cups")')
+        connection.commit()
+    finally:
+        connection.close()
+    sqlite3.connect(main_path).close()
+    return str(main_path)
+
+
+def attach_standin(engine, main_path: str) -> None:
+    """Attach the data file as ``smart_buildings`` and register functions on every new connection."""
+    data_path = str(Path(main_path).with_name(f"{STANDIN_SCHEMA}.db"))
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{data_path}' AS {STANDIN_SCHEMA}")
+        register_functions(dbapi_connection)
+
+
+def add_query_latency(engine, seconds: float) -> None:
+    """Hold the connection ``seconds`` longer on every statement, like a slower database."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _delay(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(seconds)
+
+
+def patch_agent(chat_model: FakeChatModel, structured_latency: float = 0.0,
+                embedding_model: Optional[HashEmbeddingModel] = None) -> None:
+    """Point ``agent.graph`` at the fakes.
+
+    With ``embedding_model`` the per-loop embedding batchers and the schema index use
+    it instead of the sentence-transformers model.
+    """
+    import weakref
+
+    import yaml
+
+    import agent.graph as graph_module
+    from agent.configuration import SCHEMA_PATH
+    from agent.embeddings import EmbeddingBatcher
+    from agent.schema_pruning import build_schema_index
+
+    graph_module.get_chat_model = lambda *args, **kwargs: chat_model
+    graph_module.get_structured_chat_model = (
+        lambda model_name, schema, **kwargs: FakeStructuredModel(schema, structured_latency, chat_model.limiter)
+    )
+    if embedding_model is None:
+        return
+
+    batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EmbeddingBatcher]" = weakref.WeakKeyDictionary()
+
+    def get_embedding_batcher() -> EmbeddingBatcher:
+        loop = asyncio.get_running_loop()
+        if loop not in batchers:
+            batchers[loop] = EmbeddingBatcher(model=embedding_model)
+        return batchers[loop]
+
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        schema_index = build_schema_index(yaml.safe_load(f), embedding_model.encode)
+    graph_module.get_embedding_batcher = get_embedding_batcher
+    graph_module.get_schema_index = lambda *args, **kwargs: schema_index
@@ -0,0 +1,224 @@
+"""Simulate many concurrent multi-turn conversations against the compiled graph.
+
+``--sessions`` conversations start evenly over ``--ramp-up`` seconds; each one asks
+``--turns`` random dataset questions, keeping its message history between turns and
+waiting a random think time (mean ``--think-time``) before the next one. Everything runs
+on one event loop, as in the server. The fakes of ``benchmarks/fakes.py`` stand in for
+the model (``--llm-latency`` per call, at most ``--llm-concurrency`` calls at once, like
+the slots of an Ollama server) and the database (SQLite with ``--db-latency`` added to
+every statement), unless ``--database-url`` is given.
+
+Reported, besides turn latency percentiles and throughput:
+
+    pool_checkout      wait for a connection from the SQLAlchemy pool of the DatabaseHandler
+    executor_queue     wait for a free thread of ``DatabaseHandler.query_executor``
+    llm_queue          wait for a free fake LLM slot
+    event_loop_lag     delay of a timer that should fire every ``--lag-interval`` seconds
+
+Usage:
+    python benchmarks/load.py --sessions 50 --ramp-up 30 --turns 4 --output load.json
+    python benchmarks/load.py --sessions 200 --llm-concurrency 4 --db-latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import List
+
+from langchain_core.messages import HumanMessage
+
+from fakes import FakeChatModel, HashEmbeddingModel, LatencyLimiter, add_query_latency, patch_agent
+from replay import ROOT, NodeTimer, load_questions, parse_setting, prepare_database, summarize, use_hash_vectorstores
+
+
+def time_pool_checkout(engine, waits: List[float]) -> None:
+    """Record how long each checkout from ``engine``'s pool takes."""
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        finally:
+            waits.append(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+def time_executor_queue(executor, waits: List[float]) -> None:
+    """Record how long work submitted to ``executor`` waits for a thread."""
+    submit = executor.submit
+
+    def timed_submit(fn, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def run():
+            waits.append(time.perf_counter() - queued)
+            return fn(*args, **kwargs)
+
+        return submit(run)
+
+    executor.submit = timed_submit
+
+
+async def monitor_loop_lag(interval: float, lags: List[float], stop: asyncio.Event) -> None:
+    """Sleep ``interval`` seconds repeatedly and record how late each wake-up is."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def conversation(session: int, graph, questions: List[dict], config: dict, args, start_at: float,
+                       turns: List[dict]) -> None:
+    rng = random.Random(args.seed * 100_003 + session)
+    await asyncio.sleep(max(0.0, start_at - time.perf_counter()))
+    history = []
+    for turn in range(args.turns):
+        question = rng.choice(questions)
+        timer = NodeTimer()
+        started = time.perf_counter()
+        record = {"session": session, "turn": turn, "question": question["question"], "start": started}
+        try:
+            result = await graph.ainvoke({"messages": history + [HumanMessage(content=question["question"])]},
+                                         {**config, "callbacks": [timer]})
+            history = result["messages"]
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["end"] = time.perf_counter()
+        record["latency"] = record["end"] - started
+        record["nodes"] = dict(timer.durations)
+        turns.append(record)
+        if args.think_time and turn + 1 < args.turns:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def run_load(graph, questions: List[dict], config: dict, args, handler, limiter) -> dict:
+    pool_waits, executor_waits, lags, turns = [], [], [], []
+    time_pool_checkout(handler.engine, pool_waits)
+    time_executor_queue(handler.query_executor, executor_waits)
+    peak_checked_out = 0
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(args.lag_interval, lags, stop))
+
+    async def watch_pool():
+        nonlocal peak_checked_out
+        while not stop.is_set():
+            peak_checked_out = max(peak_checked_out, handler.engine.pool.checkedout())
+            await asyncio.sleep(0.05)
+
+    pool_task = asyncio.create_task(watch_pool())
+    begin = time.perf_counter()
+    spacing = args.ramp_up / max(1, args.sessions - 1) if args.sessions > 1 else 0.0
+    await asyncio.gather(*(
+        conversation(session, graph, questions, config, args, begin + session * spacing, turns)
+        for session in range(args.sessions)
+    ))
+    elapsed = time.perf_counter() - begin
+    stop.set()
+    await asyncio.gather(lag_task, pool_task)
+
+    completed = [t for t in turns if "error" not in t]
+    node_samples = defaultdict(list)
+    for turn in completed:
+        for node, seconds in turn["nodes"].items():
+            node_samples[node].append(seconds)
+
+    timeline = defaultdict(int)
+    for turn in completed:
+        timeline[int((turn["end"] - begin) // args.window)] += 1
+    for turn in turns:
+        turn["start"] -= begin
+        turn["end"] -= begin
+
+    return {
+        "seconds": elapsed,
+        "turns": len(turns),
+        "failed": len(turns) - len(completed),
+        "throughput": len(completed) / elapsed if elapsed else 0.0,
+        "throughput_timeline": {f"{w * args.window:g}s": count / args.window for w, count in sorted(timeline.items())},
+        "latency": summarize([t["latency"] for t in completed]) if completed else None,
+        "nodes": {node: summarize(values) for node, values in sorted(node_samples.items())},
+        "pool_checkout": summarize(pool_waits) if pool_waits else None,
+        "pool_peak_checked_out": peak_checked_out,
+        "executor_queue": summarize(executor_waits) if executor_waits else None,
+        "llm_queue": summarize(limiter.waits) if limiter is not None and limiter.waits else None,
+        "event_loop_lag": summarize(lags) if lags else None,
+        "samples": turns,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", type=Path, default=ROOT / "rephrased_questions.csv")
+    parser.add_argument("--xlsx", type=Path, default=ROOT / "consultas_edificio.xlsx")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent conversations.")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per conversation.")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which the sessions start.")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between turns of a session.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake chat model call.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Uniform jitter, in seconds, around --llm-latency.")
+    parser.add_argument("--llm-concurrency", type=int, help="Fake LLM calls served at once; unlimited by default.")
+    parser.add_argument("--embedding-latency", type=float, default=0.005, help="Seconds per fake encode call.")
+    parser.add_argument("--real-embeddings", action="store_true", help="Use the sentence-transformers model.")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Seconds added to every SQL statement.")
+    parser.add_argument("--database-url", help="Run the queries on this database instead of the SQLite stand-in.")
+    parser.add_argument("--workdir", type=Path,
+                        help="Directory for the SQLite stand-in and the hashed vectorstores (a temporary one by default).")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="Event-loop lag probe interval in seconds.")
+    parser.add_argument("--window", type=float, default=5.0, help="Seconds per bucket of the throughput timeline.")
+    parser.add_argument("--set", dest="settings", action="append", default=[], type=parse_setting,
+                        metavar="KEY=VALUE", help="Configuration field for the graph; VALUE is parsed as JSON.")
+    parser.add_argument("--output", type=Path, help="Write the report and the per-turn samples as JSON.")
+    args = parser.parse_args()
+    args.workdir = args.workdir or Path(tempfile.mkdtemp(prefix="load_"))
+
+    from agent.configuration import RESOURCES, Configuration
+    from agent.graph import graph
+
+    questions = load_questions(args.csv, args.xlsx)
+    configurable = prepare_database(args, questions)
+    configurable.update(dict(args.settings))
+    handler = RESOURCES.get_db_handler(configurable["database_url"])
+    if args.db_latency:
+        add_query_latency(handler.engine, args.db_latency)
+
+    limiter = LatencyLimiter(args.llm_concurrency) if args.llm_concurrency else None
+    chat_model = FakeChatModel(
+        sql_by_question={q["question"]: q["sql"] for q in questions},
+        sql_prompt=configurable.get("generate_sql_prompt", Configuration.generate_sql_prompt),
+        latency=args.llm_latency, jitter=args.llm_jitter, seed=args.seed, limiter=limiter,
+    )
+    embedding_model = None if args.real_embeddings else HashEmbeddingModel(latency=args.embedding_latency)
+    if embedding_model is not None:
+        use_hash_vectorstores(args, configurable, embedding_model)
+    patch_agent(chat_model, structured_latency=args.llm_latency, embedding_model=embedding_model)
+
+    report = asyncio.run(run_load(graph, questions, {"configurable": configurable}, args, handler, limiter))
+    report["settings"] = {key: value for key, value in vars(args).items()
+                          if key not in ("csv", "xlsx", "workdir", "output", "database_url", "settings")}
+    report["settings"]["configurable"] = {k: v for k, v in configurable.items() if k != "database_url"}
+
+    print(f"{report['turns']} turnos en {report['seconds']:.1f}s ({report['throughput']:.2f} turnos/s), "
+          f"fallidos: {report['failed']}, pico de conexiones: {report['pool_peak_checked_out']}")
+    print(f"{'':<18} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name in ("latency", "pool_checkout", "executor_queue", "llm_queue", "event_loop_lag"):
+        summary = report[name]
+        if summary:
+            print(f"{name:<18} {summary['p50'] * 1000:7.1f}ms {summary['p95'] * 1000:7.1f}ms "
+                  f"{summary['p99'] * 1000:7.1f}ms {summary['max'] * 1000:7.1f}ms")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compare query latency on the materialized monthly metrics against the live view.
+
+Runs queries shaped like the ones ``sql_generation`` produces against
+``smart_buildings.energy_consumption_monthly_metrics`` (table refreshed by
+``agent.rollups``) and ``smart_buildings.energy_consumption_monthly_metrics_live`` (the
+original view), and optionally times one incremental refresh.
+
+Usage:
+    python benchmarks/monthly_metrics.py --runs 20 --output monthly_metrics.json
+    python benchmarks/monthly_metrics.py --refresh    # also time the daily and monthly refresh
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from agent.configuration import DATABASE_URL
+from agent.rollups import refresh_daily_consumption, refresh_monthly_metrics
+
+MATERIALIZED = "smart_buildings.energy_consumption_monthly_metrics"
+LIVE = "smart_buildings.energy_consumption_monthly_metrics_live"
+
+QUERIES = {
+    "one_building_month": """
+        SELECT b.name, m.year_month, m.total_consumption_kwh
+        FROM smart_buildings.building b
+        JOIN {table} m ON b.cups = m.cups
+        WHERE b.cups = (SELECT MIN(cups) FROM smart_buildings.building)
+          AND m.year_month = DATE_TRUNC('month', CURRENT_DATE - INTERVAL '1 month')::date
+    """,
+    "one_building_ytd": """
+        SELECT m.year_month, m.ytd_consumption_kwh, m.ytd_prev_year_consumption_kwh
+        FROM {table} m
+        WHERE m.cups = (SELECT MIN(cups) FROM smart_buildings.building)
+        ORDER BY m.year_month DESC
+        LIMIT 1
+    """,
+    "ranking_by_type": """
+        SELECT b.type, SUM(m.total_consumption_kwh) AS total
+        FROM smart_buildings.building b
+        JOIN {table} m ON b.cups = m.cups
+        WHERE m.year_month = DATE_TRUNC('month', CURRENT_DATE - INTERVAL '1 month')::date
+        GROUP BY b.type
+        ORDER BY total DESC
+    """,
+    "year_series": """
+        SELECT m.cups, m.year_month, m.total_consumption_kwh, m.diff_pct_consumption_prev_month
+        FROM {table} m
+        WHERE m.year_month >= DATE_TRUNC('year', CURRENT_DATE)::date
+        ORDER BY m.cups, m.year_month
+    """,
+}
+
+
+def time_query(connection, sql: str, runs: int) -> list:
+    connection.execute(text(sql)).fetchall()  # warm the cache
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        connection.execute(text(sql)).fetchall()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--refresh", action="store_true", help="Also time an incremental refresh of the table.")
+    parser.add_argument("--output", type=Path, help="Write the raw samples and summary as JSON.")
+    args = parser.parse_args()
+
+    if DATABASE_URL is None:
+        raise ValueError("DB_USER environment variable is required.")
+    engine = create_engine(DATABASE_URL)
+
+    report = {"queries": {}}
+    if args.refresh:
+        report["refresh"] = {}
+        for name, refresh in (("daily", refresh_daily_consumption), ("monthly", refresh_monthly_metrics)):
+            start = time.perf_counter()
+            rows = refresh(engine)
+            report["refresh"][name] = {"seconds": time.perf_counter() - start, "rows": rows}
+            print(f"refresh {name}: {rows} filas en {report['refresh'][name]['seconds'] * 1000:.1f} ms")
+
+    with engine.connect() as connection:
+        print(f"{'query':<20} {'live p50':>10} {'mat p50':>10} {'live p95':>10} {'mat p95':>10} {'speedup':>8}")
+        for name, template in QUERIES.items():
+            live = time_query(connection, template.format(table=LIVE), args.runs)
+            materialized = time_query(connection, template.format(table=MATERIALIZED), args.runs)
+            summary = {
+                "live_p50": statistics.median(live),
+                "materialized_p50": statistics.median(materialized),
+                "live_p95": percentile(live, 0.95),
+                "materialized_p95": percentile(materialized, 0.95),
+            }
+            summary["speedup"] = summary["live_p50"] / summary["materialized_p50"]
+            report["queries"][name] = {**summary, "live": live, "materialized": materialized}
+            print(
+                f"{name:<20} {summary['live_p50'] * 1000:9.1f}ms {summary['materialized_p50'] * 1000:9.1f}ms "
+                f"{summary['live_p95'] * 1000:9.1f}ms {summary['materialized_p95'] * 1000:9.1f}ms "
+                f"{summary['speedup']:7.1f}x"
+            )
+    engine.dispose()
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,21 @@
 This module defines a custom graph.
 """
 
-from agent.graph import graph
+__all__ = ["graph", "warmup"]
 
-__all__ = ["graph"]
+
+def __getattr__(name):
+    # Imported on first access so that ``import agent.<module>`` stays cheap. The
+    # result is stored in the module globals because importing ``agent.graph`` binds
+    # the submodule to the same name.
+    if name == "graph":
+        from agent.graph import graph
+
+        globals()["graph"] = graph
+        return graph
+    if name == "warmup":
+        from agent.warmup import warmup
+
+        globals()["warmup"] = warmup
+        return warmup
+    raise AttributeError(f"module 'agent' has no attribute {name!r}")
@@ -0,0 +1,256 @@
+"""FAISS index types for the name and SQL vectorstores.
+
+Indexes are built on unit-length embeddings and searched by inner product, so the
+scores they return are cosine similarities. Three types are available:
+
+    flat    exact search (``IndexFlatIP``); the right choice up to a few thousand values
+    hnsw    graph index (``IndexHNSWFlat``); ``m``, ``ef_construction``, ``ef_search``
+    ivfpq   inverted lists over product-quantized codes (``IndexIVFPQ``); ``nlist``,
+            ``m`` (sub-quantizers, must divide the dimension), ``nbits``, ``nprobe``
+
+The parameters used are returned as ``build_params`` and saved with the vectorstore
+(``vectorstore_io`` writes them to the manifest), so search-time settings can be
+restored on load and scores interpreted with the right metric. Vectorstores without
+``build_params`` are the legacy ``IndexFlatL2`` ones.
+
+Incremental updates (``agent.vectorstore_updates``) work on a ``writable_copy`` whose ids
+are value positions: flat and HNSW indexes are wrapped in ``IndexIDMap2``, IVF indexes
+keep ids themselves. HNSW cannot remove vectors, so removed values stay in the index as
+tombstones (``None`` values, counted in the entry's ``tombstones``) that ``search`` skips.
+
+Functions:
+    create_index: Create an empty (trained) index of the given type, to add embeddings in parts.
+    build_index: Build an index of the given type over normalized embeddings.
+    apply_search_params: Set the search-time parameters stored in build_params.
+    similarity_from_distances: Convert FAISS L2 distances of unit vectors to cosine similarity.
+    similarities: Convert search scores to cosine similarity according to the metric.
+    writable_copy: Copy an index into memory so that vectors can be added and removed by id.
+    add_vectors: Add embeddings to a writable copy under the given ids.
+    remove_vectors: Remove ids from a writable copy, if the index type allows it.
+    search_batch: Search a vectorstore entry for several queries at once.
+    search: Search a vectorstore entry and return cosine similarities and positions.
+"""
+
+import math
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+# faiss and numpy are imported where they are used so that importing the graph stays cheap.
+if TYPE_CHECKING:
+    import faiss
+    import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+INNER_PRODUCT = "inner_product"
+
+HNSW_DEFAULTS = {"m": 32, "ef_construction": 200, "ef_search": 64}
+IVFPQ_DEFAULTS = {"m": 48, "nbits": 8, "nprobe": 16}
+
+
+def normalize(embeddings) -> "np.ndarray":
+    """Return ``embeddings`` as a contiguous float32 matrix with unit-length rows."""
+    import numpy as np
+
+    embeddings = np.array(embeddings, dtype=np.float32, copy=True, ndmin=2, order="C")
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def _sub_quantizers(dimension: int, requested: int) -> int:
+    if dimension % requested == 0:
+        return requested
+    return next(m for m in range(min(requested, dimension), 0, -1) if dimension % m == 0)
+
+
+def create_index(dimension: int, index_type: str = "flat", training_embeddings=None, count: Optional[int] = None,
+                 **params: Any) -> Tuple["faiss.Index", Dict[str, Any]]:
+    """Create an empty inner-product index of ``index_type``, trained if the type needs it.
+
+    Normalized embeddings can then be added in as many ``index.add`` calls as needed,
+    so large stores do not have to be held in memory at once.
+
+    Args:
+        dimension (int): Embedding dimension.
+        index_type (str): One of ``INDEX_TYPES``.
+        training_embeddings: Embeddings IVF-PQ is trained on (a sample of the data).
+        count (Optional[int]): Number of vectors that will be added, for the default
+            ``nlist``; the number of training embeddings if None.
+        **params: Type-specific parameters; see the module docstring. Missing ones take
+            defaults, and IVF-PQ values too large for the training data are lowered.
+
+    Returns:
+        Tuple[faiss.Index, Dict[str, Any]]: The empty index and the build parameters used.
+
+    Raises:
+        ValueError: If ``index_type`` is unknown, or is ``ivfpq`` without training embeddings.
+    """
+    import faiss
+
+    build_params: Dict[str, Any] = {"index_type": index_type, "metric": INNER_PRODUCT, "normalized": True}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "hnsw":
+        settings = {**HNSW_DEFAULTS, **params}
+        index = faiss.IndexHNSWFlat(dimension, settings["m"], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings["ef_construction"]
+        build_params.update(settings)
+    elif index_type == "ivfpq":
+        if training_embeddings is None:
+            raise ValueError("IVF-PQ indexes need training embeddings")
+        vectors = normalize(training_embeddings)
+        training = len(vectors)
+        settings = {**IVFPQ_DEFAULTS, **params}
+        # k-means needs more training points than centroids, for the lists and the codes.
+        nlist = settings.get("nlist") or int(4 * math.sqrt(count or training))
+        settings["nlist"] = max(1, min(nlist, training // 39 or 1))
+        settings["nbits"] = max(1, min(settings["nbits"], int(math.log2(max(training, 2)))))
+        settings["m"] = _sub_quantizers(dimension, settings["m"])
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, settings["nlist"], settings["m"], settings["nbits"],
+                                 faiss.METRIC_INNER_PRODUCT)
+        # Small stores train on fewer points than FAISS recommends; that is expected here.
+        index.cp.min_points_per_centroid = index.pq.cp.min_points_per_centroid = 1
+        index.train(vectors)
+        build_params.update(settings)
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+
+    apply_search_params(index, build_params)
+    return index, build_params
+
+
+def build_index(embeddings, index_type: str = "flat", **params: Any) -> Tuple["faiss.Index", Dict[str, Any]]:
+    """Build an inner-product index of ``index_type`` over the normalized ``embeddings``.
+
+    Args:
+        embeddings: Matrix with one embedding per row.
+        index_type (str): One of ``INDEX_TYPES``.
+        **params: Type-specific parameters; see the module docstring. Missing ones take
+            defaults, and IVF-PQ values too large for the data are lowered.
+
+    Returns:
+        Tuple[faiss.Index, Dict[str, Any]]: The index, with the embeddings added, and the
+        build parameters actually used.
+
+    Raises:
+        ValueError: If ``index_type`` is unknown.
+    """
+    vectors = normalize(embeddings)
+    index, build_params = create_index(vectors.shape[1], index_type, vectors, **params)
+    index.add(vectors)
+    return index, build_params
+
+
+def _base_index(index: "faiss.Index") -> "faiss.Index":
+    """Return the index wrapped by ``IndexIDMap``/``IndexIDMap2``, or ``index`` itself."""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    while isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def apply_search_params(index: "faiss.Index", build_params: Optional[Dict[str, Any]]) -> "faiss.Index":
+    """Set ``ef_search`` / ``nprobe`` from ``build_params`` on a (loaded) index."""
+    import faiss
+
+    build_params = build_params or {}
+    if build_params.get("index_type") == "hnsw" and "ef_search" in build_params:
+        _base_index(index).hnsw.efSearch = build_params["ef_search"]
+    elif build_params.get("index_type") == "ivfpq" and "nprobe" in build_params:
+        faiss.extract_index_ivf(index).nprobe = build_params["nprobe"]
+    return index
+
+
+def writable_copy(index: "faiss.Index", build_params: Optional[Dict[str, Any]] = None) -> "faiss.Index":
+    """Return an in-memory copy of ``index`` that supports ``add_with_ids``.
+
+    Memory-mapped indexes are read-only, so the copy goes through serialization. Flat and
+    HNSW indexes without an id map are rebuilt inside an ``IndexIDMap2`` with their value
+    positions as ids; IVF indexes already store the positions as ids.
+    """
+    import faiss
+    import numpy as np
+
+    copy = faiss.deserialize_index(faiss.serialize_index(index))
+    if isinstance(copy, faiss.IndexIDMap) or faiss.try_extract_index_ivf(copy) is not None:
+        return apply_search_params(copy, build_params)
+    vectors = copy.reconstruct_n(0, copy.ntotal)
+    copy.reset()
+    mapped = faiss.IndexIDMap2(copy)
+    mapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    return apply_search_params(mapped, build_params)
+
+
+def add_vectors(index: "faiss.Index", embeddings, ids: Iterable[int],
+                build_params: Optional[Dict[str, Any]] = None) -> None:
+    """Add ``embeddings`` to a ``writable_copy`` under ``ids``, normalized like the index."""
+    import numpy as np
+
+    if (build_params or {}).get("normalized"):
+        vectors = normalize(embeddings)
+    else:
+        vectors = np.array(embeddings, dtype=np.float32, ndmin=2, order="C")
+    index.add_with_ids(vectors, np.fromiter(ids, dtype=np.int64, count=len(vectors)))
+
+
+def remove_vectors(index: "faiss.Index", ids: Iterable[int]) -> bool:
+    """Remove ``ids`` from a ``writable_copy``.
+
+    Returns:
+        bool: False if the index type cannot remove vectors (HNSW); the caller keeps
+        them as tombstones.
+    """
+    import faiss
+    import numpy as np
+
+    if isinstance(_base_index(index), faiss.IndexHNSW):
+        return False
+    index.remove_ids(np.fromiter(ids, dtype=np.int64))
+    return True
+
+
+def similarity_from_distances(distances: Iterable[float]) -> List[float]:
+    """Convert squared L2 distances between unit-length embeddings to cosine similarity."""
+    return [1.0 - float(d) / 2.0 for d in distances]
+
+
+def similarities(scores: Iterable[float], build_params: Optional[Dict[str, Any]] = None) -> List[float]:
+    """Convert the scores of ``index.search`` to cosine similarity.
+
+    Inner-product indexes already return it; legacy L2 indexes return squared distances.
+    """
+    if (build_params or {}).get("metric") == INNER_PRODUCT:
+        return [float(score) for score in scores]
+    return similarity_from_distances(scores)
+
+
+def search_batch(entry: Dict[str, Any], query_embeddings, k: int) -> List[Tuple[List[float], List[int]]]:
+    """Search the vectorstore ``entry`` (``{"index", "values", "build_params"}``) for each query row.
+
+    Returns:
+        List[Tuple[List[float], List[int]]]: Per query, the cosine similarities and value
+        positions of the ``k`` nearest values, best first. Missing results (fewer than
+        ``k`` values) and tombstones are dropped.
+    """
+    import numpy as np
+
+    build_params = entry.get("build_params") or {}
+    tombstones = entry.get("tombstones", 0)
+    if build_params.get("normalized"):
+        queries = normalize(query_embeddings)
+    else:
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2, order="C")
+    scores, ids = entry["index"].search(queries, k + tombstones)
+    results = []
+    for row_scores, row_ids in zip(scores, ids):
+        found = [(score, int(i)) for score, i in zip(row_scores, row_ids)
+                 if i >= 0 and not (tombstones and entry["values"][i] is None)][:k]
+        results.append((similarities([s for s, _ in found], build_params), [i for _, i in found]))
+    return results
+
+
+def search(entry: Dict[str, Any], query_embedding, k: int) -> Tuple[List[float], List[int]]:
+    """Search ``entry`` for a single query; see ``search_batch``."""
+    return search_batch(entry, query_embedding, k)[0]
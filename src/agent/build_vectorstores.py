@@ -0,0 +1,305 @@
+"""Build the name vectorstore from the database in bounded memory, resumably.
+
+For each column the distinct values are streamed with a server-side cursor, stripped
+and deduplicated, and split into shards of ``shard_size`` values. Each shard is encoded
+in batches of ``batch_size`` by a pool of ``workers`` threads and written to a work
+directory (``<vectorstore_path>/.name_vectorstore.build``) as an ``.npy`` embedding matrix
+and a JSON value list, so at most one shard of values and embeddings is held at a time.
+An interrupted build is resumed by running the same command again: shards already
+written are reused as long as the database still returns the same values for them.
+Finally the index of every column is built shard by shard (IVF-PQ is trained on a
+sample) and written with ``vectorstore_io``, together with the change log watermark
+that ``agent.vectorstore_updates`` continues from.
+
+    python -m agent.build_vectorstores
+    python -m agent.build_vectorstores --columns name type address --index-type hnsw --workers 8
+    python -m agent.build_vectorstores --restart     # ignore the shards of a previous run
+
+Functions:
+    stream_distinct_values: Yield the distinct values of a column, as stored, through a server-side cursor.
+    encode_batches: Encode batches in a thread pool, yielding them in order.
+    build_column_shards: Encode the values of a column into shards, reusing finished ones.
+    assemble_column: Build the vectorstore entry of a column from its shards.
+
+Classes:
+    ShardStore: Shard files of one column in the work directory.
+"""
+
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from agent import ann_index
+from agent.utils import FETCH_CHUNK_SIZE
+from agent.vectorstore_updates import BUILDING_TABLE, NAME_VECTORSTORE, VALUE_CHANGES_TABLE, WATERMARK_KEY
+
+if TYPE_CHECKING:
+    import numpy as np
+
+BATCH_SIZE = 256
+SHARD_SIZE = 50_000
+ENCODE_WORKERS = 4
+TRAIN_SIZE = 100_000
+STATE_FILE = "state.json"
+
+
+def stream_distinct_values(engine: Engine, table: str, column: str,
+                           chunk_size: int = FETCH_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the distinct non-blank values of ``column``, as stored, in a stable order.
+
+    Values are kept exactly as the database returns them, since they are later used as
+    SQL literals; only the embedded text is stripped (see ``build_column_shards``). The
+    database deduplicates and sorts the values (``ORDER BY``), so that a resumed build
+    sees the same shards, and rows are fetched ``chunk_size`` at a time through a
+    server-side cursor.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            text(f"SELECT DISTINCT CAST({column} AS TEXT) FROM {table} "
+                 f"WHERE {column} IS NOT NULL ORDER BY 1")
+        )
+        for partition in result.partitions(chunk_size):
+            for (value,) in partition:
+                if value.strip():
+                    yield value
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def encode_batches(batches: Iterable[List[str]], encode: Callable[[List[str]], "np.ndarray"],
+                   workers: int = ENCODE_WORKERS) -> Iterator[Tuple[List[str], "np.ndarray"]]:
+    """Encode ``batches`` on ``workers`` threads and yield ``(batch, embeddings)`` in order.
+
+    At most two batches per worker are in flight, so memory stays bounded however many
+    batches there are.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode") as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(encode, batch)))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+class ShardStore:
+    """Shard files of one column: ``shard-NNNNN.npy`` embeddings and ``shard-NNNNN.json`` values.
+
+    The value file is written last, so a shard counts as finished only when it exists.
+    ``signature`` describes what produced the shards (table, column, model, shard size);
+    shards written with another signature are discarded.
+    """
+
+    def __init__(self, directory: Path, signature: Dict[str, Any]):
+        self.directory = Path(directory)
+        state_path = self.directory / STATE_FILE
+        if state_path.is_file() and json.loads(state_path.read_text(encoding="utf-8")) != signature:
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps(signature), encoding="utf-8")
+
+    def embeddings_path(self, shard: int) -> Path:
+        return self.directory / f"shard-{shard:05d}.npy"
+
+    def values_path(self, shard: int) -> Path:
+        return self.directory / f"shard-{shard:05d}.json"
+
+    def completed(self) -> int:
+        """Number of consecutive finished shards from the first one."""
+        shard = 0
+        while self.values_path(shard).is_file() and self.embeddings_path(shard).is_file():
+            shard += 1
+        return shard
+
+    def read_values(self, shard: int) -> List[str]:
+        return json.loads(self.values_path(shard).read_text(encoding="utf-8"))
+
+    def read_embeddings(self, shard: int) -> "np.ndarray":
+        import numpy as np
+
+        return np.load(self.embeddings_path(shard), mmap_mode="r")
+
+    def write(self, shard: int, values: List[str], embeddings: "np.ndarray") -> None:
+        import numpy as np
+
+        # Temporary files are renamed into place so a crash never leaves a partial shard.
+        embeddings_tmp = self.embeddings_path(shard).with_suffix(".npy.tmp")
+        with open(embeddings_tmp, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(embeddings_tmp, self.embeddings_path(shard))
+        values_tmp = self.values_path(shard).with_suffix(".json.tmp")
+        values_tmp.write_text(json.dumps(values, ensure_ascii=False), encoding="utf-8")
+        os.replace(values_tmp, self.values_path(shard))
+
+    def truncate(self, shard: int) -> None:
+        """Delete shard ``shard`` and every shard after it."""
+        for path in self.directory.glob("shard-*"):
+            if int(path.name[6:11]) >= shard:
+                path.unlink()
+
+
+def build_column_shards(engine: Engine, table: str, column: str, store: ShardStore,
+                        encode: Callable[[List[str]], "np.ndarray"], batch_size: int = BATCH_SIZE,
+                        shard_size: int = SHARD_SIZE, workers: int = ENCODE_WORKERS) -> int:
+    """Encode the distinct values of ``column`` into the shards of ``store``.
+
+    Finished shards whose values the database still returns unchanged are not encoded
+    again; from the first shard that differs on, shards are rewritten. Shards keep the
+    values as stored, while their embeddings are computed on the stripped text.
+
+    Returns:
+        int: Number of values in the column.
+    """
+    import numpy as np
+
+    completed = store.completed()
+    shard = count = encoded = 0
+    start = time.perf_counter()
+    for values in _batched(stream_distinct_values(engine, table, column), shard_size):
+        count += len(values)
+        if shard < completed and store.read_values(shard) == values:
+            print(f"{column}: fragmento {shard} reutilizado ({count} valores)")
+            shard += 1
+            continue
+        if shard < completed:
+            store.truncate(shard)
+            completed = shard
+        embeddings = np.vstack([embeddings for _, embeddings in
+                                encode_batches(_batched([value.strip() for value in values], batch_size),
+                                               encode, workers)]).astype(np.float32)
+        store.write(shard, values, embeddings)
+        encoded += len(values)
+        print(f"{column}: fragmento {shard} escrito ({count} valores, "
+              f"{encoded / (time.perf_counter() - start):.0f} valores/s)")
+        shard += 1
+    # Shards past the end belong to a run that saw more values.
+    store.truncate(shard)
+    return count
+
+
+def assemble_column(store: ShardStore, index_type: str, train_size: int = TRAIN_SIZE, seed: int = 0,
+                    **index_params: Any) -> dict:
+    """Build the ``{"index", "values", "build_params"}`` entry of a column from its shards.
+
+    Embeddings are added one shard at a time. IVF-PQ is trained on a random sample of at
+    most ``train_size`` embeddings taken across the shards.
+    """
+    import numpy as np
+
+    shards = range(store.completed())
+    embeddings = [store.read_embeddings(shard) for shard in shards]
+    count = sum(len(e) for e in embeddings)
+    training = None
+    if index_type == "ivfpq":
+        rng = np.random.default_rng(seed)
+        fraction = min(1.0, train_size / count)
+        training = np.vstack([e[np.sort(rng.choice(len(e), max(1, round(len(e) * fraction)), replace=False))]
+                              for e in embeddings])
+    index, build_params = ann_index.create_index(embeddings[0].shape[1], index_type, training, count=count,
+                                                 **index_params)
+    values = []
+    for shard, shard_embeddings in zip(shards, embeddings):
+        index.add(ann_index.normalize(shard_embeddings))
+        values.extend(store.read_values(shard))
+    return {"index": index, "values": values, "build_params": build_params}
+
+
+def _change_log_watermark(engine: Engine, changes_table: str) -> Optional[int]:
+    """Last id of the change log, or None if the table does not exist."""
+    try:
+        with engine.connect() as connection:
+            return int(connection.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {changes_table}")).scalar())
+    except SQLAlchemyError:
+        return None
+
+
+def main(argv: Optional[list] = None) -> None:
+    """Build the name vectorstore from the command line."""
+    import argparse
+
+    from agent import vectorstore_io
+    from agent.configuration import DATABASE_URL, EMBEDDING_MODEL_NAME, VECTORSTORE_INDEX_TYPE, VECTORSTORE_PATH
+    from agent.embeddings import get_embedding_model
+
+    def index_param(setting: str):
+        key, _, value = setting.partition("=")
+        return key, json.loads(value)
+
+    parser = argparse.ArgumentParser(description="Build the name vectorstore from the distinct values of the database.")
+    parser.add_argument("--vectorstore-path", default=VECTORSTORE_PATH)
+    parser.add_argument("--table", default=BUILDING_TABLE)
+    parser.add_argument("--columns", nargs="+", default=["name", "type"])
+    parser.add_argument("--index-type", choices=ann_index.INDEX_TYPES, default=VECTORSTORE_INDEX_TYPE)
+    parser.add_argument("--index-param", dest="index_params", action="append", default=[], type=index_param,
+                        metavar="KEY=VALUE", help="Index parameter (see agent.ann_index); VALUE is parsed as JSON.")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Values per encode call.")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Values per shard file.")
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS, help="Threads encoding batches.")
+    parser.add_argument("--train-size", type=int, default=TRAIN_SIZE, help="IVF-PQ training sample size.")
+    parser.add_argument("--restart", action="store_true", help="Discard the shards of a previous run.")
+    parser.add_argument("--keep-shards", action="store_true", help="Keep the work directory after the build.")
+    args = parser.parse_args(argv)
+
+    if DATABASE_URL is None:
+        raise ValueError("DB_USER environment variable is required.")
+    from sqlalchemy import create_engine
+
+    engine = create_engine(DATABASE_URL)
+    output_path = Path(args.vectorstore_path) / NAME_VECTORSTORE
+    work_dir = output_path.with_name(f".{NAME_VECTORSTORE}.build")
+    if args.restart:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    model = get_embedding_model(args.embedding_model)
+
+    def encode(batch: List[str]) -> "np.ndarray":
+        return model.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+
+    try:
+        # Changes logged from here on are applied later by agent.vectorstore_updates.
+        watermark = _change_log_watermark(engine, VALUE_CHANGES_TABLE)
+        stores = {}
+        for column in args.columns:
+            signature = {"table": args.table, "column": column, "embedding_model": args.embedding_model,
+                         "shard_size": args.shard_size}
+            stores[column] = ShardStore(work_dir / column, signature)
+            count = build_column_shards(engine, args.table, column, stores[column], encode,
+                                        args.batch_size, args.shard_size, args.workers)
+            if not count:
+                print(f"{column}: sin valores; se omite")
+                del stores[column]
+
+        start = time.perf_counter()
+        vectorstore = {column: assemble_column(store, args.index_type, args.train_size, **dict(args.index_params))
+                       for column, store in stores.items()}
+        metadata = {"built_from": args.table}
+        if watermark is not None:
+            metadata[WATERMARK_KEY] = watermark
+        manifest = vectorstore_io.save_vectorstore(vectorstore, output_path, args.embedding_model, metadata=metadata)
+        print(f"{output_path} ({args.index_type}, {manifest['build_hash'][:12]}) "
+              f"construido en {time.perf_counter() - start:.1f}s")
+        if not args.keep_shards:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Bounded in-process caches.
+
+Classes:
+    TTLCache: Thread-safe LRU cache with an optional time-to-live and hit/miss counters.
+    SqlResultCache: Cache of SQL results invalidated by TTL and by a data version probe.
+
+Functions:
+    sql_fingerprint: Normalize a SQL statement into a stable cache key.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import sqlparse
+
+from agent.utils import clean_sql
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Args:
+        maxsize (int): Maximum number of entries; the least recently used is evicted first.
+        ttl (Optional[float]): Seconds an entry stays valid, or None to keep it until evicted.
+        timer (Callable[[], float]): Clock used for expiry, monotonic by default.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key``, or ``default`` if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at >= self._timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store ``value`` under ``key``, evicting the least recently used entries if full."""
+        expires_at = self._timer() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop ``key`` if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry; the hit/miss counters are kept."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, hit rate and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+def sql_fingerprint(sql: str, schema: Optional[str] = None) -> str:
+    """Return a key shared by statements that differ only in comments, keyword case or whitespace."""
+    formatted = sqlparse.format(clean_sql(sql), strip_comments=True, keyword_case="lower")
+    normalized = re.sub(r"\s+", " ", formatted).strip().rstrip(";").strip()
+    return hashlib.sha256(f"{schema or ''}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class SqlResultCache:
+    """Cache of query results keyed by SQL fingerprint, schema and data version.
+
+    The data version comes from a probe (for example the latest reading date) that is
+    re-run at most every ``version_ttl`` seconds. When new data arrives the version
+    changes, so older results stop matching and are evicted as they age out of the LRU.
+    A None version means the probe failed: nothing is cached or served until it works.
+    Results are also keyed by ``limits`` (the row and byte limits of the fetch), so a
+    preview truncated under small limits is not reused for larger ones.
+
+    Args:
+        maxsize (int): Maximum number of cached results.
+        ttl (Optional[float]): Seconds a result stays valid even if the data version is unchanged.
+        version_ttl (float): Seconds between data version probes.
+        timer (Callable[[], float]): Clock used for expiry, monotonic by default.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: Optional[float] = 900,
+        version_ttl: float = 60,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.version_ttl = version_ttl
+        self._timer = timer
+        self._version: Hashable = None
+        self._version_checked_at = float("-inf")
+        self._version_lock = threading.Lock()
+
+    def current_version(self, probe: Callable[[], Hashable]) -> Hashable:
+        """Return the data version, calling ``probe`` if the last value is older than ``version_ttl``."""
+        with self._version_lock:
+            if self._timer() - self._version_checked_at >= self.version_ttl:
+                try:
+                    self._version = probe()
+                except Exception as e:
+                    print(f"Error al consultar la versión de los datos: {e}")
+                    self._version = None
+                self._version_checked_at = self._timer()
+            return self._version
+
+    def get(self, sql: str, schema: Optional[str], version: Hashable, limits: Hashable = None) -> Optional[Any]:
+        """Return the cached result of ``sql`` for ``version`` and ``limits``, if any."""
+        if version is None:
+            return None
+        return self._results.get((sql_fingerprint(sql, schema), version, limits))
+
+    def set(self, sql: str, schema: Optional[str], version: Hashable, result: Any, limits: Hashable = None) -> None:
+        """Cache ``result`` for ``sql`` at ``version`` and ``limits``, unless the version is unknown."""
+        if version is None:
+            return
+        self._results.set((sql_fingerprint(sql, schema), version, limits), result)
+
+    def clear(self) -> None:
+        """Drop every cached result and force a new version probe."""
+        self._results.clear()
+        with self._version_lock:
+            self._version_checked_at = float("-inf")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, hit rate, size and the last data version."""
+        return {**self._results.stats(), "data_version": self._version}
@@ -9,20 +9,24 @@ from sqlalchemy.schema import CreateTable
 from sqlalchemy.exc import OperationalError,SQLAlchemyError
 from typing import Annotated
 from agent import prompts
+from agent.cache import SqlResultCache, TTLCache
+from agent.sql_validation import TableSchema, parse_schema_sql
 import os
 from dotenv import load_dotenv
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import pickle
-import yaml
 from pathlib import Path
-from typing import Dict
-import pandas as pd
+from typing import Dict, TYPE_CHECKING
+
+# Heavy modules (faiss, sentence_transformers, pandas, yaml) are imported where they are
+# used so that importing the agent stays cheap; see ``agent.warmup``.
+if TYPE_CHECKING:
+    import pandas as pd
+    from sentence_transformers import SentenceTransformer
 # DATABASE_URL = "sqlite:///energy_consumption.db"
 
 
@@ -34,14 +38,35 @@ DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 DB_SCHEMA = os.getenv('DB_SCHEMA')
 
-if not DB_USER:
-    raise ValueError("DB_USER environment variable is required.")
-# Construct the database URL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Construct the database URL. A missing DB_USER is reported when the engine is created.
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}" if DB_USER else None
 
 VECTORSTORE_PATH = "src"
 SCHEMA_PATH = "src/agent/schema_context.yaml"
+
+# Schema where ``.sql`` creates the rollups and their ``rollup_state`` bookkeeping table.
+# It is fixed by the DDL (and ``agent.rollups``), not by ``DB_SCHEMA``.
+ROLLUP_SCHEMA = "smart_buildings"
+RAW_DATA_VERSION_QUERY = "SELECT MAX(date) FROM raw.energy_consumption"
+
+
+def rollup_data_version_query(schema: str = ROLLUP_SCHEMA) -> str:
+    """Data version query combining the last raw load with the last rollup refresh in ``schema``."""
+    return (
+        "SELECT CONCAT((SELECT MAX(date) FROM raw.energy_consumption), '|', "
+        f"(SELECT MAX(refreshed_at) FROM {schema}.rollup_state))"
+    )
+SQL_SCHEMA_PATH = "src/agent/schema.sql"
 MODEL_NAME = "ollama-nexus/gemma3:4b-finetuned"
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', 3600))
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 5))
+SQL_CACHE_SIZE = int(os.getenv('SQL_CACHE_SIZE', 256))
+SQL_CACHE_TTL = float(os.getenv('SQL_CACHE_TTL', 900))
+DATA_VERSION_TTL = float(os.getenv('DATA_VERSION_TTL', 60))
+# Index type of newly built vectorstores: flat, hnsw or ivfpq (see agent.ann_index).
+VECTORSTORE_INDEX_TYPE = os.getenv('VECTORSTORE_INDEX_TYPE', 'flat')
 
 
 
@@ -49,18 +74,48 @@ class VectorStoreHandler:
     """Handles vector store interactions."""
 
     def __init__(self, vectorstore_path: str):
-        self.name_vectorstore = self.load_vectorstore(vectorstore_path+"/name_vectorstore.pkl")
-        self.sql_vectorstore = self.load_vectorstore(vectorstore_path+"/sql_vectorstore.pkl")
+        self.name_vectorstore = self.load_vectorstore(self.resolve_path(vectorstore_path, "name_vectorstore"))
+        self.sql_vectorstore = self.load_vectorstore(self.resolve_path(vectorstore_path, "sql_vectorstore"))
+        # Query embeddings and hits for these indexes. Reloading the vectorstores creates a
+        # new handler, which starts with an empty cache.
+        self.query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
 
-    def save_vectorstore(self,vectorstore: dict, save_path: str):
-        with open(save_path, "wb") as f:
-            pickle.dump(vectorstore, f)
+    @classmethod
+    def from_vectorstores(cls, name_vectorstore: dict, sql_vectorstore: dict) -> "VectorStoreHandler":
+        """Create a handler for vectorstores already in memory, e.g. after an incremental update."""
+        handler = cls.__new__(cls)
+        handler.name_vectorstore = name_vectorstore
+        handler.sql_vectorstore = sql_vectorstore
+        handler.query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        return handler
+
+    @staticmethod
+    def resolve_path(vectorstore_path: str, name: str) -> str:
+        """Prefer the native vectorstore directory, falling back to the legacy pickle."""
+        native_path = os.path.join(vectorstore_path, name)
+        if os.path.isfile(os.path.join(native_path, "manifest.json")):
+            return native_path
+        return native_path + ".pkl"
+
+    def save_vectorstore(self,vectorstore: dict, save_path: str, embedding_model: str = EMBEDDING_MODEL_NAME):
+        """Save a vectorstore as a pickle if ``save_path`` ends in .pkl, else in the native format."""
+        if save_path.endswith(".pkl"):
+            import pickle
+
+            with open(save_path, "wb") as f:
+                pickle.dump(vectorstore, f)
+            return
+        from agent import vectorstore_io
+
+        vectorstore_io.save_vectorstore(vectorstore, save_path, embedding_model)
 
     def load_vectorstore(self,save_path: str) -> dict:
-        with open(save_path, "rb") as f:
-            vectorstore = pickle.load(f)
+        """Load a pickled vectorstore or memory-map a native one."""
+        from agent import vectorstore_io
 
-        return vectorstore
+        if not save_path.endswith(".pkl"):
+            return vectorstore_io.load_vectorstore(save_path)
+        return vectorstore_io.load_pickle_vectorstore(save_path)
 
     def fetch_unique_column_values(self,session: Session, table_name: str, columns: list[str]) -> dict[str, list[str]]:
         values_by_column = {}
@@ -71,35 +126,45 @@ class VectorStoreHandler:
             values_by_column[col] = values
         return values_by_column
 
-    def build_key_values_vectorstore(self,values_by_key: dict[str, list[str]], model: SentenceTransformer) -> dict:
+    def build_key_values_vectorstore(self,values_by_key: dict[str, list[str]], model: "SentenceTransformer",
+                                     index_type: str = VECTORSTORE_INDEX_TYPE, **index_params) -> dict:
+        """Build one index per key; see ``agent.ann_index`` for the index types and parameters."""
+        from agent.ann_index import build_index
+
         vectorstore = {}
         for key, values in values_by_key.items():
-            embeddings = model.encode(values)
-            index = faiss.IndexFlatL2(embeddings.shape[1])
-            index.add(np.array(embeddings))
+            embeddings = model.encode(values, convert_to_numpy=True)
+            index, build_params = build_index(embeddings, index_type, **index_params)
             vectorstore[key] = {
                 "index": index,
-                "values": values
+                "values": values,
+                "build_params": build_params,
             }
         return vectorstore
     
-    def build_df_values_vectorstore(self,df: pd.DataFrame, model: SentenceTransformer, key="question", col_values="sql"):
+    def build_df_values_vectorstore(self,df: "pd.DataFrame", model: "SentenceTransformer", key="question", col_values="sql",
+                                    index_type: str = VECTORSTORE_INDEX_TYPE, **index_params):
+        """Build a single index over ``df[key]`` whose values are ``{key, col_values}`` records."""
+        from agent.ann_index import build_index
+
         keys = df[key].tolist()
         values = df[col_values].tolist()
         embeddings = model.encode(keys, convert_to_numpy=True)
-        index = faiss.IndexFlatL2(embeddings.shape[1])
-        index.add(embeddings)
+        index, build_params = build_index(embeddings, index_type, **index_params)
         return {
             "index": index,
-            "values": [{key: q, col_values: s} for q, s in zip(keys, values)]
+            "values": [{key: q, col_values: s} for q, s in zip(keys, values)],
+            "build_params": build_params,
         }
         
 
 class DatabaseHandler:
     """Handles database interactions."""
 
-    def __init__(self, database_url: str = DATABASE_URL):
-     
+    def __init__(self, database_url: Optional[str] = DATABASE_URL):
+        if not database_url:
+            raise ValueError("DB_USER environment variable is required.")
+
         try:
             self.engine = create_engine(
             database_url,
@@ -115,6 +180,16 @@ class DatabaseHandler:
             print(f"Error al conectar a la base de datos: {e}")
             self.engine = None
 
+        # Blocking queries from async nodes run here instead of on the event loop. Sized
+        # like the connection pool so workers do not queue for connections.
+        self.query_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="sql")
+        self.result_cache = SqlResultCache(maxsize=SQL_CACHE_SIZE, ttl=SQL_CACHE_TTL, version_ttl=DATA_VERSION_TTL)
+
+    def close(self) -> None:
+        """Dispose of the engine and stop the query executor."""
+        if self.engine is not None:
+            self.engine.dispose()
+        self.query_executor.shutdown(wait=False)
 
     def get_table_names(self) -> List[str]:
         inspector = inspect(self.engine)
@@ -166,6 +241,8 @@ class DatabaseHandler:
     
     def load_schema_from_yaml(self, file_path: Path) -> None:
         """Load the entire schema definition from a YAML file."""
+        import yaml
+
         try:
             with open(file_path, 'r', encoding="utf-8") as f:
                 self.schema_data = yaml.safe_load(f)
@@ -195,6 +272,8 @@ class DatabaseHandler:
         return output_str
 
     def load_raw_schema_yaml(self,file_path: Path):
+        import yaml
+
         try:
             with open(file_path, 'r', encoding="utf-8") as f:
                 self.schema_data = yaml.safe_load(f)
@@ -259,7 +338,112 @@ class DatabaseHandler:
         finally:
             session.close()
             return [str(row[0]) for row in result]
-    
+
+
+class ResourceRegistry:
+    """Process-wide registry of the heavy resources shared by every node.
+
+    ``Configuration`` is rebuilt from the ``RunnableConfig`` on each node call, so the
+    database engine, the SQL schema string and the vectorstores are looked up here
+    instead of being recreated every time. Entries are keyed by ``database_url``,
+    schema path and ``vectorstore_path``. The ``reload_*`` hooks build a fresh entry
+    and swap it in, so requests already holding the old one are not interrupted.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._db_handlers: Dict[str, DatabaseHandler] = {}
+        self._schemas: Dict[str, str] = {}
+        self._schema_tables: Dict[str, Dict[str, TableSchema]] = {}
+        self._vectorstores: Dict[str, VectorStoreHandler] = {}
+
+    def get_db_handler(self, database_url: str) -> DatabaseHandler:
+        """Return the shared handler (engine and pool) for ``database_url``."""
+        handler = self._db_handlers.get(database_url)
+        if handler is None:
+            with self._lock:
+                handler = self._db_handlers.get(database_url)
+                if handler is None:
+                    handler = DatabaseHandler(database_url)
+                    self._db_handlers[database_url] = handler
+        return handler
+
+    def get_schema(self, schema_path: str = SQL_SCHEMA_PATH) -> str:
+        """Return the contents of the schema file, read once per process."""
+        schema = self._schemas.get(schema_path)
+        if schema is None:
+            with self._lock:
+                schema = self._schemas.get(schema_path)
+                if schema is None:
+                    schema = Path(schema_path).read_text(encoding="utf-8")
+                    self._schemas[schema_path] = schema
+        return schema
+
+    def get_schema_tables(self, schema_path: str = SQL_SCHEMA_PATH) -> Dict[str, TableSchema]:
+        """Return the tables parsed from the schema file, for validating generated SQL."""
+        tables = self._schema_tables.get(schema_path)
+        if tables is None:
+            schema = self.get_schema(schema_path)
+            with self._lock:
+                tables = self._schema_tables.get(schema_path)
+                if tables is None:
+                    tables = parse_schema_sql(schema)
+                    self._schema_tables[schema_path] = tables
+        return tables
+
+    def get_vectorstore_handler(self, vectorstore_path: str) -> VectorStoreHandler:
+        """Return the loaded vectorstores for ``vectorstore_path``."""
+        handler = self._vectorstores.get(vectorstore_path)
+        if handler is None:
+            with self._lock:
+                handler = self._vectorstores.get(vectorstore_path)
+                if handler is None:
+                    handler = VectorStoreHandler(vectorstore_path)
+                    self._vectorstores[vectorstore_path] = handler
+        return handler
+
+    def reload_db_handler(self, database_url: str) -> DatabaseHandler:
+        """Create a new engine for ``database_url`` and dispose of the previous one."""
+        handler = DatabaseHandler(database_url)
+        with self._lock:
+            previous = self._db_handlers.get(database_url)
+            self._db_handlers[database_url] = handler
+        if previous is not None:
+            previous.close()
+        return handler
+
+    def reload_schema(self, schema_path: str = SQL_SCHEMA_PATH) -> str:
+        """Re-read the schema file from disk."""
+        schema = Path(schema_path).read_text(encoding="utf-8")
+        with self._lock:
+            self._schemas[schema_path] = schema
+            self._schema_tables.pop(schema_path, None)
+        return schema
+
+    def reload_vectorstores(self, vectorstore_path: str) -> VectorStoreHandler:
+        """Load the vectorstores at ``vectorstore_path`` again and swap them in."""
+        return self.swap_vectorstores(vectorstore_path, VectorStoreHandler(vectorstore_path))
+
+    def swap_vectorstores(self, vectorstore_path: str, handler: VectorStoreHandler) -> VectorStoreHandler:
+        """Serve ``handler`` for ``vectorstore_path`` from now on (see ``agent.vectorstore_updates``)."""
+        with self._lock:
+            self._vectorstores[vectorstore_path] = handler
+        return handler
+
+    def clear(self) -> None:
+        """Drop every cached resource, disposing of the database engines."""
+        with self._lock:
+            handlers = list(self._db_handlers.values())
+            self._db_handlers.clear()
+            self._schemas.clear()
+            self._schema_tables.clear()
+            self._vectorstores.clear()
+        for handler in handlers:
+            handler.close()
+
+
+RESOURCES = ResourceRegistry()
+
 
 @dataclass(kw_only=True)
 class Configuration:
@@ -310,7 +494,7 @@ class Configuration:
             "description": "The system prompt used for explaining the results of SQL queries."
         },
     )
-    database_url: str = field(
+    database_url: Optional[str] = field(
         default=DATABASE_URL,
         metadata={"description": "The URL for the SQLite database."}
     )
@@ -318,13 +502,103 @@ class Configuration:
         default=VECTORSTORE_PATH,
         metadata={"description": "The path to the vectorstore."}
     )
+    vectorstore_reload_interval: Optional[float] = field(
+        default=60.0,
+        metadata={"description": "Seconds between checks, by the thread that warmup starts, for a new vectorstore build saved by the updater process (python -m agent.vectorstore_updates --listen); None disables reloading."}
+    )
+    query_timeout: float = field(
+        default=30.0,
+        metadata={"description": "Seconds a generated SQL query may run before it is cancelled."}
+    )
+    speculative_retrieval: bool = field(
+        default=False,
+        metadata={"description": "Retrieve relevant values in parallel with intent detection; the result is only used if the query is routed to the database."}
+    )
+    sql_max_retries: int = field(
+        default=2,
+        metadata={"description": "Times a query that fails schema validation is sent back to the model with the errors; 0 disables the repair loop."}
+    )
+    max_query_cost: Optional[float] = field(
+        default=1_000_000,
+        metadata={"description": "Generated queries whose EXPLAIN total cost exceeds this are not run; None disables the check."}
+    )
+    max_query_rows: Optional[float] = field(
+        default=100_000,
+        metadata={"description": "Generated queries whose EXPLAIN row estimate exceeds this are not run; None disables the check."}
+    )
+    result_limit: Optional[int] = field(
+        default=1000,
+        metadata={"description": "LIMIT added to generated queries without one (larger limits are lowered); None leaves queries as generated."}
+    )
+    max_result_rows: int = field(
+        default=500,
+        metadata={"description": "Maximum number of result rows kept for the explanation; the true row count is still reported."}
+    )
+    max_result_bytes: int = field(
+        default=200_000,
+        metadata={"description": "Maximum size, in bytes of formatted text, of the result rows kept for the explanation."}
+    )
+    summary_row_threshold: Optional[int] = field(
+        default=30,
+        metadata={"description": "Results with more rows than this are summarized before the explanation; None always sends the full table."}
+    )
+    summary_top_n: int = field(
+        default=5,
+        metadata={"description": "Rows kept at each end of the ranking and of the monthly variations in a result summary."}
+    )
+    schema_pruning: bool = field(
+        default=True,
+        metadata={"description": "Give the SQL model only the DDL of the tables closest to the question (plus foreign-key references) instead of the whole schema."}
+    )
+    schema_top_k: int = field(
+        default=2,
+        metadata={"description": "Tables selected by similarity when schema_pruning is enabled, before adding referenced tables."}
+    )
+    sql_fast_path_threshold: Optional[float] = field(
+        default=0.95,
+        metadata={"description": "Cosine similarity above which the SQL of the nearest known question is reused instead of calling the LLM. None disables the fast path."}
+    )
+    entity_threshold: Optional[float] = field(
+        default=0.6,
+        metadata={"description": "Cosine similarity above which a column value matched by a span of the question is given to the SQL model. None disables entity linking."}
+    )
+    entity_columns: Optional[List[str]] = field(
+        default=None,
+        metadata={"description": "Columns of the name vectorstore searched for entity linking; every indexed column if None."}
+    )
+    sql_cache_enabled: bool = field(
+        default=True,
+        metadata={"description": "Whether to reuse results of identical SQL queries until the data changes."}
+    )
+    data_version_query: Optional[str] = field(
+        default=rollup_data_version_query(),
+        metadata={"description": "Query whose result changes when new data is loaded or the rollups are refreshed; cached SQL results are invalidated when it does."}
+    )
+    data_version_fallback_query: Optional[str] = field(
+        default=RAW_DATA_VERSION_QUERY,
+        metadata={"description": "Query used as data version when data_version_query fails, e.g. before the rollup tables are created."}
+    )
 
   
-    def __post_init__(self):
-        """Initialize the database handler and load the schema."""
-        self.db_handler = DatabaseHandler(self.database_url)
-        self.database_schema = self.db_handler.read_schema_to_string("src/agent/schema.sql")
-        self.vectorstore_handler = VectorStoreHandler(VECTORSTORE_PATH)
+    @property
+    def db_handler(self) -> DatabaseHandler:
+        """The shared database handler; the engine is created on first use."""
+        return RESOURCES.get_db_handler(self.database_url)
+
+    @property
+    def database_schema(self) -> str:
+        """The SQL schema given to the SQL generation prompt."""
+        return RESOURCES.get_schema(SQL_SCHEMA_PATH)
+
+    @property
+    def schema_tables(self) -> Dict[str, TableSchema]:
+        """Tables and columns of the SQL schema, parsed once."""
+        return RESOURCES.get_schema_tables(SQL_SCHEMA_PATH)
+
+    @property
+    def vectorstore_handler(self) -> VectorStoreHandler:
+        """The shared vectorstores; loaded on first use."""
+        return RESOURCES.get_vectorstore_handler(self.vectorstore_path)
  
     
  
@@ -0,0 +1,144 @@
+"""Sentence embedding model and batched async encoding shared by the whole process.
+
+Functions:
+    get_embedding_model: Return the SentenceTransformer for a model name, loading it once.
+    get_embedding_batcher: Return the EmbeddingBatcher of the running event loop.
+
+Classes:
+    EmbeddingBatcher: Coalesce concurrent encode requests into batched encode calls.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from agent.configuration import EMBEDDING_MODEL_NAME
+
+if TYPE_CHECKING:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+EMBEDDING_BATCH_WAIT = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', 5)) / 1000
+
+_models: Dict[str, "SentenceTransformer"] = {}
+_lock = threading.Lock()
+# Encodes run one batch at a time; a single worker keeps them off the event loop
+# without letting batches compete for the same CPU cores.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EmbeddingBatcher]" = weakref.WeakKeyDictionary()
+
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL_NAME) -> "SentenceTransformer":
+    """Return the embedding model, importing sentence_transformers and loading it on first use.
+
+    Args:
+        model_name (str): Name of the SentenceTransformer model.
+    """
+    model = _models.get(model_name)
+    if model is None:
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+
+                model = SentenceTransformer(model_name)
+                _models[model_name] = model
+    return model
+
+
+class EmbeddingBatcher:
+    """Coalesce encode requests from concurrent graph runs into batched encode calls.
+
+    Requests are queued until ``max_batch_size`` texts are waiting or ``max_wait``
+    seconds have passed since the first one, then encoded together in the embedding
+    worker thread. Each caller gets back the rows for its own texts.
+
+    A batcher belongs to the event loop it was first used on.
+
+    Args:
+        model (Optional[SentenceTransformer]): Model to use; the shared model by default.
+        max_batch_size (int): Number of texts that triggers an immediate flush.
+        max_wait (float): Seconds to wait for more requests before flushing.
+    """
+
+    def __init__(
+        self,
+        model: Optional["SentenceTransformer"] = None,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_wait: float = EMBEDDING_BATCH_WAIT,
+    ):
+        self._model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_texts = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # The loop only keeps weak references to tasks; these keep running batches alive.
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+
+    async def encode(self, texts: List[str]) -> "np.ndarray":
+        """Encode ``texts`` as part of the next batch and return their embeddings."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(texts), future))
+        self._pending_texts += len(texts)
+
+        if self._pending_texts >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_texts = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[List[str], asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        self.batches += 1
+
+        def encode():
+            # The first call loads the model; doing it here keeps the event loop free.
+            model = self._model or get_embedding_model()
+            return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+        try:
+            embeddings = await loop.run_in_executor(_executor, encode)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for request_texts, future in batch:
+            end = start + len(request_texts)
+            if not future.done():
+                future.set_result(embeddings[start:end])
+            start = end
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Return the batcher for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = EmbeddingBatcher()
+        _batchers[loop] = batcher
+    return batcher
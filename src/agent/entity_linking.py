@@ -0,0 +1,122 @@
+"""Link the literal mentions of a question to the values of every indexed column.
+
+Candidate mentions are the word n-grams of the question that neither start nor end
+with a Spanish stopword ("la biblioteca de Gràcia" yields "biblioteca", "biblioteca de
+gràcia", "gràcia"...). They are embedded in the same batch as the whole question, and
+each column index of the name vectorstore (``name``, ``type``, and any other column
+built by ``build_key_values_vectorstore``) is searched once with all of them. The
+result is a short list of typed, scored values that the SQL prompt can use verbatim.
+
+Functions:
+    candidate_ngrams: Extract the candidate mentions of a question.
+    link_entities: Match candidate embeddings against the column indexes.
+    format_entity_matches: Render matches for the SQL prompt.
+
+Classes:
+    EntityMatch: A column value matched by a span of the question.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from agent import ann_index
+from agent.utils import normalize_query
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MAX_NGRAM = 4
+MAX_CANDIDATES = 64
+
+# Accent-folded, as compared against normalize_query output.
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi cada como con contra cual cuales
+cuando cuanto cuanta cuantos cuantas de del desde donde durante e el ella ellas ellos en entre era es
+esa esas ese eso esos esta estas este esto estos fue ha han hasta hay la las le les lo los mas me mi
+mis mucho muy nada ni no nos nuestro o os otra otro para pero poco por porque que quien se sea segun
+ser si sin sobre son su sus tambien tan tanto te tiene tienen toda todas todo todos tu un una unas uno
+unos y ya dame dime muestra muestrame quiero mes meses ano anos dia dias semana semanas
+consumo consumos consume consumen consumio consumieron gasto kwh edificio edificios total media
+enero febrero marzo abril mayo junio julio agosto septiembre octubre noviembre diciembre
+""".split())
+
+_WORD = re.compile(r"[^\W_]+(?:[-'’/.][^\W_]+)*", re.UNICODE)
+
+
+@dataclass
+class EntityMatch:
+    """A value of ``column`` matched by ``text``, a span of the question."""
+
+    column: str
+    value: str
+    score: float
+    text: str
+
+
+def candidate_ngrams(question: str, max_n: int = MAX_NGRAM, limit: int = MAX_CANDIDATES) -> List[str]:
+    """Return the n-grams of ``question`` (up to ``max_n`` words) worth looking up.
+
+    N-grams that start or end with a stopword (which here include words that every
+    question about consumption uses, and month names) are skipped, as are bare numbers
+    and duplicates after case and accent folding. Longer n-grams come first and at most ``limit`` are kept.
+    """
+    words = _WORD.findall(question)
+    folded = [normalize_query(word) for word in words]
+    seen, candidates = set(), []
+    for n in range(min(max_n, len(words)), 0, -1):
+        for start in range(len(words) - n + 1):
+            end = start + n - 1
+            if folded[start] in SPANISH_STOPWORDS or folded[end] in SPANISH_STOPWORDS:
+                continue
+            key = " ".join(folded[start:end + 1])
+            if key in seen or (n == 1 and (len(key) < 3 or key.isdigit())):
+                continue
+            seen.add(key)
+            candidates.append(" ".join(words[start:end + 1]))
+    return candidates[:limit]
+
+
+def link_entities(
+    candidates: List[str],
+    candidate_embeddings: "np.ndarray",
+    name_vectorstore: Dict[str, dict],
+    columns: Optional[Iterable[str]] = None,
+    threshold: float = 0.6,
+    top_k: int = 3,
+) -> List[EntityMatch]:
+    """Match the candidate mentions against every column index in one search per column.
+
+    Args:
+        candidates (List[str]): Mentions, as returned by ``candidate_ngrams``.
+        candidate_embeddings (np.ndarray): One embedding row per candidate.
+        name_vectorstore (Dict[str, dict]): Per-column vectorstore entries.
+        columns (Optional[Iterable[str]]): Columns to search; every entry if None.
+        threshold (float): Minimum cosine similarity of a match.
+        top_k (int): Maximum number of values kept per column.
+
+    Returns:
+        List[EntityMatch]: The best ``top_k`` values per column above ``threshold``,
+        each with the span that matched it best, by descending score.
+    """
+    if not candidates:
+        return []
+    columns = list(name_vectorstore) if columns is None else [c for c in columns if c in name_vectorstore]
+    matches = []
+    for column in columns:
+        entry = name_vectorstore[column]
+        best: Dict[int, EntityMatch] = {}
+        for text, (scores, ids) in zip(candidates, ann_index.search_batch(entry, candidate_embeddings, top_k)):
+            for score, i in zip(scores, ids):
+                if score >= threshold and (i not in best or score > best[i].score):
+                    best[i] = EntityMatch(column=column, value=str(entry["values"][i]), score=score, text=text)
+        matches.extend(sorted(best.values(), key=lambda match: match.score, reverse=True)[:top_k])
+    return sorted(matches, key=lambda match: match.score, reverse=True)
+
+
+def format_entity_matches(matches: Iterable[dict]) -> str:
+    """Render matches (as dicts, the way they are kept in the state) one per line."""
+    return "\n".join(
+        f"- {match['column']}: '{match['value']}' (similarity {match['score']:.2f}, from \"{match['text']}\")"
+        for match in matches
+    )
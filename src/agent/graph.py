@@ -10,23 +10,34 @@ from langchain_core.messages import SystemMessage,AIMessage,HumanMessage
 from langgraph.graph import END, START, StateGraph
 
 from agent.configuration import Configuration
-from agent.state import State, InputState, Router, RelevantInfoResponse, QueryOutput, Response
-from agent.utils import load_chat_model, execute_sql_query
-import numpy as np
-import sqlparse
-from sentence_transformers import SentenceTransformer
+from agent.prompts import ENTITY_MATCHES_PROMPT, PREFERRED_SOURCES, PREFERRED_SOURCES_PROMPT, SQL_REPAIR_PROMPT
+from agent import ann_index
+from agent.embeddings import get_embedding_batcher
+from agent.entity_linking import candidate_ngrams, format_entity_matches, link_entities
+from agent.metrics import instrument
+from agent.schema_pruning import get_schema_index, prune_schema
+from agent.sql_fast_path import reuse_known_sql
+from agent.sql_guard import guard_query
+from agent.sql_validation import validate_sql
+from agent.state import State, InputState, Router, RelevantInfoResponse, QueryOutput
+from agent.summarize import summarize_result
+from agent.utils import get_chat_model, get_structured_chat_model, execute_sql_query_async, normalize_query, probe_data_version
+import asyncio
+import time
+from dataclasses import asdict
 from datetime import datetime
+from functools import partial
 
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 DATE = datetime.today().strftime("%Y-%m-01")
-embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
 
 
 async def detect_intent(state: State, *, config: RunnableConfig) -> dict[str, Router]:
     """Analyze the user's query and determine the appropriate routing.
 
     This function uses a language model to classify the user's query and decide how to route it
-    within the conversation flow.
+    within the conversation flow. With ``speculative_retrieval`` the relevant values are
+    retrieved while the model runs; they are awaited only if the query goes to the
+    database, and cancelled otherwise, so the other routes never wait for them.
 
     Args:
         state (State): The current state of the agent, including conversation history.
@@ -36,25 +47,53 @@ async def detect_intent(state: State, *, config: RunnableConfig) -> dict[str, Ro
         dict[str, Router]: A dictionary containing the 'router' key with the classification result (classification type and logic).
     """
     configuration = Configuration.from_runnable_config(config)
+    start = time.perf_counter()
     
-    model = load_chat_model(configuration.query_model)
+    model = get_structured_chat_model(configuration.query_model, Router)
     
     messages = [SystemMessage(content=configuration.router_system_prompt)] + state.recent_messages
-    
-    response = cast(
-        Router, await model.with_structured_output(Router).ainvoke(messages)
-    )
-    return {"router": {"type":response.type, "logic":response.logic}}
-
 
-def route_query(state: State) -> Literal["retrieve_relevant_values", "ask_for_more_info", "respond_to_general_query"]:
+    speculation = None
+    if configuration.speculative_retrieval:
+        speculation = asyncio.ensure_future(speculative_retrieval(state, config=config))
+    try:
+        response = cast(
+            Router, await model.ainvoke(messages)
+        )
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    update = {"router": {"type":response.type, "logic":response.logic},
+              "node_timings": {"intent_detection": time.perf_counter() - start}}
+
+    if speculation is not None:
+        if response.type != "database":
+            speculation.cancel()
+            return update
+        try:
+            speculated = await speculation
+        except Exception as e:
+            # route_query falls back to the retrieve_relevant_values node.
+            print(f"Error en la recuperación especulativa: {e}")
+            return update
+        update.update(relevant_values=speculated["relevant_values"],
+                      relevant_tables=speculated["relevant_tables"],
+                      node_timings={**update["node_timings"], **speculated["node_timings"]})
+    return update
+
+
+def route_query(state: State) -> Literal["retrieve_relevant_values", "sql_generation", "ask_for_more_info", "respond_to_general_query"]:
     """Determine the next step based on the query classification.
 
+    Database queries skip retrieval when ``speculative_retrieval`` already retrieved the
+    values for the current question; for other routes the speculative result is unused.
+
     Args:
         state (State): The current state of the agent, including the router's classification.
 
     Returns:
-        Literal["retrieve_relevant_values", "ask_for_more_info", "respond_to_general_query"]: The next step to take.
+        Literal["retrieve_relevant_values", "sql_generation", "ask_for_more_info", "respond_to_general_query"]: The next step to take.
 
     Raises:
         ValueError: If an unknown router type is encountered.
@@ -65,17 +104,24 @@ def route_query(state: State) -> Literal["retrieve_relevant_values", "ask_for_mo
     "general": "respond_to_general_query"
     }
     try:
-        return ROUTE_MAP[state.router["type"]]
+        route = ROUTE_MAP[state.router["type"]]
     except KeyError:
         raise ValueError(f"Unknown router type {state.router['type']}")
+    if (route == "retrieve_relevant_values" and state.relevant_values
+            and state.relevant_values.get("query") == state.messages[-1].content):
+        return "sql_generation"
+    return route
 
 async def extract_relevant_info(state: State, *, config: RunnableConfig) -> State:
     """Extract relevant tables and columns from the database schema based on the user query."""
     configuration = Configuration.from_runnable_config(config)
 
-    model = load_chat_model(configuration.query_model)
+    model = get_structured_chat_model(configuration.query_model, RelevantInfoResponse)
 
-    database_schema = configuration.database_schema
+    if configuration.schema_pruning and state.relevant_tables:
+        database_schema = prune_schema(state.relevant_tables, configuration.schema_tables)
+    else:
+        database_schema = configuration.database_schema
 
     prompt = configuration.relevant_info_system_prompt.format(
         schema_description=database_schema
@@ -83,100 +129,273 @@ async def extract_relevant_info(state: State, *, config: RunnableConfig) -> Stat
 
     messages = [SystemMessage(content=prompt)] + state.recent_messages
 
-    model_response = cast(RelevantInfoResponse, await model.with_structured_output(RelevantInfoResponse).ainvoke(messages))
+    model_response = cast(RelevantInfoResponse, await model.ainvoke(messages))
 
     return {"relevant_tables": model_response["relevant_tables"],"relevant_columns": model_response["relevant_columns"]}
 
 
-def retrieve_relevant_values(state: State, config: RunnableConfig) -> State:
+async def retrieve_relevant_values(state: State, *, config: RunnableConfig) -> State:
     """Retrieve relevant values from the database based on the user's query."""
 
     configuration = Configuration.from_runnable_config(config)
-    name_vectorstore = configuration.vectorstore_handler.name_vectorstore
-    sql_vectorstore = configuration.vectorstore_handler.sql_vectorstore
+    start = time.perf_counter()
+    vectorstore_handler = configuration.vectorstore_handler
+    name_vectorstore = vectorstore_handler.name_vectorstore
+    sql_vectorstore = vectorstore_handler.sql_vectorstore
 
     user_query = state.messages[-1].content
 
-    query_embedding = embedding_model.encode([user_query], convert_to_numpy=True)
-
-    # Buscar nombre más similar
-    D1, I1 = name_vectorstore["name"]["index"].search(query_embedding, 2)
-    matched_names = [name_vectorstore["name"]["values"][i] for i in I1[0]]
+    entity_columns = tuple(configuration.entity_columns) if configuration.entity_columns is not None else None
+    cache_key = (normalize_query(user_query), configuration.entity_threshold, entity_columns)
+    hits = vectorstore_handler.query_cache.get(cache_key)
+    if hits is None:
+        # The question and its candidate mentions go to the model in a single encode.
+        candidates = candidate_ngrams(user_query) if configuration.entity_threshold is not None else []
+        embeddings = await get_embedding_batcher().encode([user_query] + candidates)
+        query_embedding = embeddings[:1]
+
+        # Buscar nombre más similar
+        names_scores, names_ids = ann_index.search(name_vectorstore["name"], query_embedding, 2)
+        matched_names = [name_vectorstore["name"]["values"][i] for i in names_ids]
+
+        # Buscar pregunta-SQL más similar
+        sql_scores, sql_ids = ann_index.search(sql_vectorstore, query_embedding, 2)
+        matched_sql = [sql_vectorstore["values"][i] for i in sql_ids]
+
+        # Values of every indexed column (name, type...) mentioned in the question
+        entities = link_entities(candidates, embeddings[1:], name_vectorstore, entity_columns,
+                                 configuration.entity_threshold or 0.0)
+
+        hits = {"embedding": query_embedding,
+                "matched_names": matched_names,
+                "matched_names_scores": names_scores,
+                "matched_sql": matched_sql,
+                "matched_sql_scores": sql_scores,
+                "entities": [asdict(entity) for entity in entities]}
+        vectorstore_handler.query_cache.set(cache_key, hits)
+
+    relevant_tables = []
+    if configuration.schema_pruning:
+        schema_index = await asyncio.get_running_loop().run_in_executor(None, get_schema_index)
+        relevant_tables = schema_index.select_tables(hits["embedding"], configuration.schema_top_k,
+                                                     configuration.schema_tables)
+
+    return {"relevant_values": {"query": user_query,
+                                "matched_names":list(hits["matched_names"]),
+                                "matched_names_scores":list(hits["matched_names_scores"]),
+                                "matched_sql":list(hits["matched_sql"]),
+                                "matched_sql_scores":list(hits["matched_sql_scores"]),
+                                "entities":list(hits["entities"]),
+                                },
+            "relevant_tables": relevant_tables,
+            "node_timings": {"retrieve_relevant_values": time.perf_counter() - start}}
+
+
+async def speculative_retrieval(state: State, *, config: RunnableConfig) -> State:
+    """Run ``retrieve_relevant_values`` while intent detection is still running.
+
+    Started by ``detect_intent`` when ``Configuration.speculative_retrieval`` is set. The
+    timing is recorded under its own key so the latency saved on the database route can
+    be compared with ``intent_detection``.
+    """
+    start = time.perf_counter()
+    update = await retrieve_relevant_values(state, config=config)
+    return {"relevant_values": update["relevant_values"],
+            "relevant_tables": update["relevant_tables"],
+            "node_timings": {"speculative_retrieval": time.perf_counter() - start}}
 
-    # Buscar pregunta-SQL más similar
-    D2, I2 = sql_vectorstore["index"].search(query_embedding, 2)
-    matched_sql = [sql_vectorstore["values"][i] for i in I2[0]]
 
+def _preferred_sources(tables) -> str:
+    """The preferred rollup tables among ``tables``, the ones given to the SQL model."""
+    lines = [line for table, line in PREFERRED_SOURCES.items() if table in tables]
+    return PREFERRED_SOURCES_PROMPT.format(sources="\n".join(lines)) if lines else ""
 
 
-    return {"relevant_values": {"matched_names":matched_names,
-                                "matched_sql":matched_sql,
-                                }}
+def _sql_system_prompt(configuration: Configuration, database_schema: str, relevant_values, tables) -> str:
+    """The SQL generation prompt, followed by the database values linked to the question."""
+    prompt = configuration.generate_sql_prompt.format(schema=database_schema,
+                                                      preferred_sources=_preferred_sources(tables))
+    entities = (relevant_values or {}).get("entities")
+    if entities:
+        prompt += ENTITY_MATCHES_PROMPT.format(entities=format_entity_matches(entities))
+    return prompt
 
 
 async def sql_generation(state: State, *, config: RunnableConfig) -> State:
     """SQL generation with schema validation"""
     configuration = Configuration.from_runnable_config(config)
-    model = load_chat_model(configuration.query_model)
     #database_handler = configuration.db_handler
-    database_schema = configuration.database_schema
+    if configuration.schema_pruning and state.relevant_tables:
+        database_schema = prune_schema(state.relevant_tables, configuration.schema_tables)
+        tables = state.relevant_tables
+    else:
+        database_schema = configuration.database_schema
+        tables = configuration.schema_tables
 
     #formatted_sql = ""
     #for question,sql in state.relevant_values["matched_sql"]:
     #    formatted_sql += f"Pregunta: {question}\nSQL:\n{sql}\n\n"
 
+    if state.sql_validation_error is not None and state.sql_retries < configuration.sql_max_retries:
+        # Repair: show the model why its last query was rejected.
+        feedback = HumanMessage(content=SQL_REPAIR_PROMPT.format(errors=state.sql_validation_error))
+        messages = [SystemMessage(content=_sql_system_prompt(configuration, database_schema, state.relevant_values, tables))]
+        messages += state.sql_messages[-2:] + [feedback]
+        response = await get_chat_model(configuration.query_model).ainvoke(messages)
+        sql_query = response.content.strip()
+        return {"sql_messages": [feedback, AIMessage(sql_query)], "sql_query": sql_query, "sql_path": "llm",
+                "sql_retries": state.sql_retries + 1}
+
     state.sql_messages.append(state.messages[-1])
+    reset = {"sql_retries": 0, "sql_validation_error": None}
 
+    if configuration.sql_fast_path_threshold is not None and state.relevant_values:
+        name_vectorstore = configuration.vectorstore_handler.name_vectorstore
+        sql_query = reuse_known_sql(
+            question=state.messages[-1].content,
+            matched_sql=state.relevant_values["matched_sql"],
+            sql_scores=state.relevant_values["matched_sql_scores"],
+            matched_names=state.relevant_values["matched_names"],
+            building_types=name_vectorstore["type"]["values"] if "type" in name_vectorstore else [],
+            threshold=configuration.sql_fast_path_threshold,
+        )
+        if sql_query is not None:
+            return {"sql_messages":[AIMessage(sql_query)], "sql_query": sql_query, "sql_path": "retrieval", **reset}
 
-    prompt = configuration.generate_sql_prompt.format(
-        schema=database_schema,
-        #question = user_query.content
-        #matched_names = state.relevant_values["matched_names"],
-        #matched_sql =formatted_sql,
-        #building_types = state.relevant_values["building_types"],
-        #dialect = database_handler.dialect,
-    )
+
+    prompt = _sql_system_prompt(configuration, database_schema, state.relevant_values, tables)
 
     
     #adding last messages
     messages = [SystemMessage(content=prompt)] + state.sql_messages[-3:]
     
     
+    model = get_chat_model(configuration.query_model)
     response = await model.ainvoke(messages)
     sql_query = response.content.strip()
     #response = await model.with_structured_output(QueryOutput).ainvoke(messages)
     
-    return {"sql_messages":[AIMessage(sql_query)], "sql_query": sql_query}
+    return {"sql_messages":[AIMessage(sql_query)], "sql_query": sql_query, "sql_path": "llm", **reset}
 
 
 
-async def validate_sql_query(state: State) -> State:
-    sql_query = state.sql_query
-    try:
-        sqlparse.parse(sql_query)
-        return {"is_sql_valid": True}
-    except Exception as e:
-        print(f"Error de validación SQL: {e}")
-        return {"is_sql_valid": False, "sql_validation_error": str(e)}
-    
-    
+async def validate_sql_query(state: State, *, config: RunnableConfig) -> State:
+    """Check the generated SQL against the tables and columns of the schema."""
+    configuration = Configuration.from_runnable_config(config)
+    errors = validate_sql(state.sql_query, configuration.schema_tables)
+    if not errors:
+        return {"sql_validation_error": None}
+
+    error = "\n".join(errors)
+    print(f"Error de validación SQL (reintento {state.sql_retries}): {error}")
+    return {"sql_validation_error": error}
+
+
+def route_validated_query(state: State, *, config: RunnableConfig) -> Literal["sql_generation", "query_guard"]:
+    """Send invalid SQL back to the model until the retries run out; the database decides after that."""
+    configuration = Configuration.from_runnable_config(config)
+    if state.sql_validation_error is not None and state.sql_retries < configuration.sql_max_retries:
+        return "sql_generation"
+    return "query_guard"
+
+
+async def guard_sql_query(state: State, *, config: RunnableConfig) -> State:
+    """Rewrite or reject the generated SQL before it runs (read-only, LIMIT, plan cost)."""
+
+    configuration = Configuration.from_runnable_config(config)
+    db_handler = configuration.db_handler
+    result = await asyncio.get_running_loop().run_in_executor(
+        db_handler.query_executor,
+        partial(guard_query,
+                state.sql_query,
+                db_handler.engine,
+                schema=db_handler.schema_name,
+                max_cost=configuration.max_query_cost,
+                max_rows=configuration.max_query_rows,
+                limit=configuration.result_limit,
+                statement_timeout=configuration.query_timeout),
+    )
+    return {'sql_query': result.sql,
+            'sql_rejection': result.rejection,
+            'query_result': result.error}
+
+
+def route_guarded_query(state: State) -> Literal["query_execution", "explanation_generation"]:
+    """Skip execution when the guard rejected the query or the database could not plan it."""
+    if state.sql_rejection is not None or state.query_result is not None:
+        return "explanation_generation"
+    return "query_execution"
+
+
 async def get_database_results(state: State, *, config: RunnableConfig) -> State:
     """Ejecuta una consulta SQL y maneja errores."""
 
     configuration = Configuration.from_runnable_config(config)
     db_handler = configuration.db_handler
+    result_cache = db_handler.result_cache
+    limits = (configuration.max_result_rows, configuration.max_result_bytes)
+
+    if configuration.sql_cache_enabled:
+        data_version = await asyncio.get_running_loop().run_in_executor(
+            db_handler.query_executor,
+            result_cache.current_version,
+            partial(probe_data_version, db_handler.engine, configuration.data_version_query,
+                    configuration.data_version_fallback_query),
+        )
+        sql_result = result_cache.get(state.sql_query, db_handler.schema_name, data_version, limits)
+    else:
+        sql_result = None
+
+    if sql_result is None:
+        sql_result = await execute_sql_query_async(query=state.sql_query,
+                                                   schema=db_handler.schema_name,
+                                                   engine=db_handler.engine,
+                                                   executor=db_handler.query_executor,
+                                                   timeout=configuration.query_timeout,
+                                                   max_rows=configuration.max_result_rows,
+                                                   max_bytes=configuration.max_result_bytes,
+                                                   read_only=True)
+        if configuration.sql_cache_enabled and sql_result.error is None:
+            result_cache.set(state.sql_query, db_handler.schema_name, data_version, sql_result, limits)
+
+    return {'query_result': sql_result.to_markdown(),
+            'query_data': {'columns': sql_result.columns, 'rows': sql_result.rows},
+            'query_row_count': sql_result.row_count,
+            'query_truncated': sql_result.truncated,
+            'query_summary': None}
+
+
+async def summarize_results(state: State, *, config: RunnableConfig) -> State:
+    """Reduce long results to a digest so the explanation prompt stays small."""
 
-    query_result = execute_sql_query(query=state.sql_query,
-                                     schema=db_handler.schema_name, 
-                                     engine=db_handler.engine)
+    configuration = Configuration.from_runnable_config(config)
+    threshold = configuration.summary_row_threshold
+    if threshold is None or not state.query_data or (state.query_row_count or 0) <= threshold:
+        return {}
 
-    return {'query_result': query_result}
+    try:
+        summary = await asyncio.get_running_loop().run_in_executor(
+            None,
+            partial(summarize_result,
+                    state.query_data['columns'],
+                    state.query_data['rows'],
+                    row_count=state.query_row_count,
+                    top_n=configuration.summary_top_n),
+        )
+    except Exception as e:
+        # The explanation falls back to the markdown table of the result.
+        print(f"Error al resumir el resultado: {e}")
+        return {}
+    return {'query_summary': summary}
 
 
 
 
 async def generate_explanation(state: State,config:RunnableConfig) -> State:
    
+    if state.sql_rejection is not None:
+        return {"messages": [AIMessage(content=state.sql_rejection)]}
+
     if "ERROR SQL" in state.query_result:
             return (
             {"messages": [AIMessage(content= "No pudimos obtener los datos en este momento. Intenta de nuevo o revisa que la información proporcionada sea correcta.")]}
@@ -186,10 +405,10 @@ async def generate_explanation(state: State,config:RunnableConfig) -> State:
     user_query = state.messages[-1].content
     prompt = configuration.explain_results_prompt.format(
         sql = state.sql_query,
-        sql_results=state.query_result,
+        sql_results=state.query_summary or state.query_result,
         question = user_query)
 
-    model = load_chat_model(configuration.query_model)
+    model = get_chat_model(configuration.query_model)
 
     messages = [
     SystemMessage(content=prompt)
@@ -214,7 +433,7 @@ async def respond_to_general_query(state: State, *, config: RunnableConfig) -> S
         dict[str, list[str]]: A dictionary with a 'messages' key containing the generated response.
     """
     configuration = Configuration.from_runnable_config(config)
-    model = load_chat_model(configuration.query_model)
+    model = get_chat_model(configuration.query_model)
     system_prompt = configuration.general_system_prompt.format(
         logic=state.router["logic"]
     )
@@ -235,7 +454,7 @@ async def ask_for_more_info(state: State, *, config: RunnableConfig) -> State:
         dict[str, list[str]]: A dictionary with a 'messages' key containing the generated response.
     """
     configuration = Configuration.from_runnable_config(config)
-    model = load_chat_model(configuration.query_model)
+    model = get_chat_model(configuration.query_model)
     system_prompt = configuration.more_info_system_prompt.format(
         logic=state.router["logic"]
     )
@@ -247,22 +466,27 @@ async def ask_for_more_info(state: State, *, config: RunnableConfig) -> State:
 workflow = StateGraph(State,input=InputState, config_schema=Configuration)
 
 # Define the nodes and edges of the graph
-workflow.add_node("intent_detection", detect_intent)
-workflow.add_node(ask_for_more_info)
-workflow.add_node(respond_to_general_query)
+workflow.add_node("intent_detection", instrument("intent_detection", detect_intent))
+workflow.add_node("ask_for_more_info", instrument("ask_for_more_info", ask_for_more_info))
+workflow.add_node("respond_to_general_query", instrument("respond_to_general_query", respond_to_general_query))
 #workflow.add_node("extract_relevant_info", extract_relevant_info)
-workflow.add_node("retrieve_relevant_values", retrieve_relevant_values)
-workflow.add_node("sql_generation", sql_generation)
-#workflow.add_node("sql_validation", validate_sql_query)
-workflow.add_node("query_execution", get_database_results)
-workflow.add_node("explanation_generation", generate_explanation)
+workflow.add_node("retrieve_relevant_values", instrument("retrieve_relevant_values", retrieve_relevant_values))
+workflow.add_node("sql_generation", instrument("sql_generation", sql_generation))
+workflow.add_node("sql_validation", instrument("sql_validation", validate_sql_query))
+workflow.add_node("query_guard", instrument("query_guard", guard_sql_query))
+workflow.add_node("query_execution", instrument("query_execution", get_database_results))
+workflow.add_node("result_summarization", instrument("result_summarization", summarize_results))
+workflow.add_node("explanation_generation", instrument("explanation_generation", generate_explanation))
 
 workflow.add_edge(START, "intent_detection")
 workflow.add_conditional_edges("intent_detection", route_query)
 # workflow.add_edge("extract_relevant_info", "retrieve_relevant_values")
 workflow.add_edge("retrieve_relevant_values", "sql_generation")
-workflow.add_edge("sql_generation", "query_execution")
-workflow.add_edge("query_execution", "explanation_generation")
+workflow.add_edge("sql_generation", "sql_validation")
+workflow.add_conditional_edges("sql_validation", route_validated_query)
+workflow.add_conditional_edges("query_guard", route_guarded_query)
+workflow.add_edge("query_execution", "result_summarization")
+workflow.add_edge("result_summarization", "explanation_generation")
 workflow.add_edge("ask_for_more_info", END)
 workflow.add_edge("respond_to_general_query", END)
 workflow.add_edge("explanation_generation", END)
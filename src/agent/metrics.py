@@ -0,0 +1,284 @@
+"""Per-node metrics for the graph: wall time, LLM tokens, result size and route.
+
+Every node of ``agent.graph`` is registered through ``instrument``. While no backend is
+configured the wrapper calls the node directly, so the cost is one attribute check.
+Backends are chosen with ``configure_metrics`` or the ``AGENT_METRICS`` environment
+variable (comma separated, e.g. ``prometheus,otel``):
+
+* ``prometheus``: counters and histograms in the ``prometheus_client`` registry, served
+  on ``AGENT_METRICS_PORT`` if it is set;
+* ``otel``: one OpenTelemetry span per node, with the same values as attributes.
+
+Both libraries are optional and imported only when their backend is enabled.
+
+Functions:
+    instrument: Wrap a node function so each call is recorded.
+    configure_metrics: Enable the Prometheus and/or OpenTelemetry backends.
+    get_recorder: Return the recorder used by instrumented nodes.
+    set_recorder: Replace the recorder, e.g. with a custom one or a no-op.
+
+Classes:
+    NodeMetrics: What was measured in one node call.
+    MetricsRecorder: Records NodeMetrics; does nothing unless given backends.
+"""
+
+import asyncio
+import functools
+import os
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+AGENT_METRICS = os.getenv('AGENT_METRICS', '')
+AGENT_METRICS_PORT = os.getenv('AGENT_METRICS_PORT')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (100, 1_000, 10_000, 50_000, 100_000, 200_000, 500_000, 1_000_000)
+ROWS_BUCKETS = (0, 1, 5, 10, 30, 100, 500, 1_000, 10_000)
+
+
+@dataclass
+class NodeMetrics:
+    """What was measured in one node call."""
+
+    node: str
+    seconds: float
+    error: bool = False
+    input_tokens: int = 0
+    output_tokens: int = 0
+    result_bytes: Optional[int] = None
+    """Size of ``query_result`` (UTF-8), when the node set it."""
+    result_rows: Optional[int] = None
+    route: Optional[str] = None
+    """Router decision or SQL path ("retrieval" / "llm") chosen by the node."""
+
+
+class TokenCounter(BaseCallbackHandler):
+    """Sum the ``usage_metadata`` of every chat model call made inside a node."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.input_tokens += usage.get("input_tokens", 0)
+                    self.output_tokens += usage.get("output_tokens", 0)
+
+
+# Callback managers created while this is set (the model calls of the current node)
+# include the counter, without passing callbacks through every ``ainvoke``.
+_token_counter: ContextVar[Optional[TokenCounter]] = ContextVar("agent_token_counter", default=None)
+register_configure_hook(_token_counter, inheritable=True)
+
+
+class _Prometheus:
+    def __init__(self, registry=None):
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        self.duration = Histogram("agent_node_duration_seconds", "Wall time of a graph node.", ["node"],
+                                  buckets=DURATION_BUCKETS, registry=registry)
+        self.errors = Counter("agent_node_errors_total", "Graph node calls that raised.", ["node"], registry=registry)
+        self.tokens = Counter("agent_llm_tokens_total", "LLM tokens used by graph nodes.", ["node", "kind"],
+                              registry=registry)
+        self.result_bytes = Histogram("agent_query_result_bytes", "Size of the formatted SQL result.",
+                                      buckets=BYTES_BUCKETS, registry=registry)
+        self.result_rows = Histogram("agent_query_result_rows", "Rows returned by the generated SQL.",
+                                     buckets=ROWS_BUCKETS, registry=registry)
+        self.routes = Counter("agent_route_total", "Routes taken by graph nodes.", ["node", "route"],
+                              registry=registry)
+
+    def record(self, metrics: NodeMetrics) -> None:
+        self.duration.labels(metrics.node).observe(metrics.seconds)
+        if metrics.error:
+            self.errors.labels(metrics.node).inc()
+        if metrics.input_tokens:
+            self.tokens.labels(metrics.node, "prompt").inc(metrics.input_tokens)
+        if metrics.output_tokens:
+            self.tokens.labels(metrics.node, "completion").inc(metrics.output_tokens)
+        if metrics.result_bytes is not None:
+            self.result_bytes.observe(metrics.result_bytes)
+        if metrics.result_rows is not None:
+            self.result_rows.observe(metrics.result_rows)
+        if metrics.route is not None:
+            self.routes.labels(metrics.node, metrics.route).inc()
+
+
+class _OpenTelemetry:
+    def __init__(self):
+        from opentelemetry import trace
+
+        self.tracer = trace.get_tracer("agent.graph")
+
+    def span(self, node: str):
+        return self.tracer.start_as_current_span(f"agent.{node}")
+
+    @staticmethod
+    def annotate(span, metrics: NodeMetrics) -> None:
+        span.set_attribute("agent.node", metrics.node)
+        span.set_attribute("agent.llm.prompt_tokens", metrics.input_tokens)
+        span.set_attribute("agent.llm.completion_tokens", metrics.output_tokens)
+        for name in ("result_bytes", "result_rows", "route"):
+            value = getattr(metrics, name)
+            if value is not None:
+                span.set_attribute(f"agent.{name}", value)
+
+
+class MetricsRecorder:
+    """Send node metrics to the configured backends.
+
+    Without backends ``enabled`` is False and instrumented nodes skip measuring. Subclass
+    and override ``record`` to collect the metrics elsewhere.
+
+    Args:
+        prometheus: Prometheus backend, or None.
+        tracer: OpenTelemetry backend, or None.
+    """
+
+    def __init__(self, prometheus: Optional[_Prometheus] = None, tracer: Optional[_OpenTelemetry] = None):
+        self.prometheus = prometheus
+        self.tracer = tracer
+
+    @property
+    def enabled(self) -> bool:
+        return self.prometheus is not None or self.tracer is not None
+
+    def span(self, node: str):
+        """Context manager around one node call; yields the span, if any."""
+        return self.tracer.span(node) if self.tracer is not None else nullcontext()
+
+    def record(self, metrics: NodeMetrics, span=None) -> None:
+        """Record one node call."""
+        if self.prometheus is not None:
+            self.prometheus.record(metrics)
+        if span is not None and self.tracer is not None:
+            self.tracer.annotate(span, metrics)
+
+
+_recorder = MetricsRecorder()
+
+
+def get_recorder() -> MetricsRecorder:
+    """Return the recorder used by instrumented nodes."""
+    return _recorder
+
+
+def set_recorder(recorder: MetricsRecorder) -> None:
+    """Replace the recorder used by instrumented nodes."""
+    global _recorder
+    _recorder = recorder
+
+
+def configure_metrics(prometheus: bool = True, opentelemetry: bool = False, registry=None,
+                      port: Optional[int] = None) -> MetricsRecorder:
+    """Enable the metric backends and install the recorder.
+
+    Args:
+        prometheus (bool): Record counters and histograms with ``prometheus_client``.
+        opentelemetry (bool): Open a span per node with the OpenTelemetry tracer.
+        registry: Prometheus registry; the default registry if None.
+        port (Optional[int]): Serve the Prometheus metrics over HTTP on this port.
+
+    Returns:
+        MetricsRecorder: The installed recorder.
+
+    Raises:
+        ImportError: If the library of an enabled backend is not installed.
+    """
+    recorder = MetricsRecorder(prometheus=_Prometheus(registry) if prometheus else None,
+                               tracer=_OpenTelemetry() if opentelemetry else None)
+    if prometheus and port is not None:
+        from prometheus_client import start_http_server
+
+        start_http_server(port, **({"registry": registry} if registry is not None else {}))
+    set_recorder(recorder)
+    return recorder
+
+
+def _measure(node: str, update: Any, seconds: float, error: bool, tokens: TokenCounter) -> NodeMetrics:
+    metrics = NodeMetrics(node=node, seconds=seconds, error=error,
+                          input_tokens=tokens.input_tokens, output_tokens=tokens.output_tokens)
+    if isinstance(update, dict):
+        if isinstance(update.get("query_result"), str):
+            metrics.result_bytes = len(update["query_result"].encode("utf-8"))
+        metrics.result_rows = update.get("query_row_count")
+        router = update.get("router")
+        if isinstance(router, dict):
+            metrics.route = router.get("type")
+        elif update.get("sql_path") is not None:
+            metrics.route = update["sql_path"]
+    return metrics
+
+
+def instrument(node: str, func: Callable) -> Callable:
+    """Wrap the node function ``func`` so each call is recorded under ``node``.
+
+    The wrapper keeps the signature of ``func`` (LangGraph reads it to decide whether to
+    pass ``config``) and works for sync and async nodes.
+    """
+
+    def start():
+        recorder = get_recorder()
+        span = recorder.span(node)
+        tokens = TokenCounter()
+        return recorder, span, tokens, _token_counter.set(tokens)
+
+    def finish(recorder, active_span, tokens, reset, update, started, error):
+        _token_counter.reset(reset)
+        recorder.record(_measure(node, update, time.perf_counter() - started, error, tokens), active_span)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not _recorder.enabled:
+                return await func(*args, **kwargs)
+            recorder, span, tokens, reset = start()
+            with span as active_span:
+                started, update, error = time.perf_counter(), None, True
+                try:
+                    update = await func(*args, **kwargs)
+                    error = False
+                    return update
+                finally:
+                    finish(recorder, active_span, tokens, reset, update, started, error)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _recorder.enabled:
+                return func(*args, **kwargs)
+            recorder, span, tokens, reset = start()
+            with span as active_span:
+                started, update, error = time.perf_counter(), None, True
+                try:
+                    update = func(*args, **kwargs)
+                    error = False
+                    return update
+                finally:
+                    finish(recorder, active_span, tokens, reset, update, started, error)
+    return wrapper
+
+
+def _configure_from_env() -> None:
+    backends: List[str] = [b.strip().lower() for b in AGENT_METRICS.split(",") if b.strip()]
+    if not backends:
+        return
+    try:
+        configure_metrics(prometheus="prometheus" in backends,
+                          opentelemetry=bool({"otel", "opentelemetry"} & set(backends)),
+                          port=int(AGENT_METRICS_PORT) if AGENT_METRICS_PORT else None)
+    except ImportError as e:
+        print(f"No se pudieron activar las métricas ({AGENT_METRICS}): {e}")
+
+
+_configure_from_env()
@@ -170,11 +170,34 @@ DATABASE SCHEMA:
 
 Building types:
 ['Administración', 'Educación', 'Comercio', 'Punto Limpio', 'Casal/Centro Cívico', 'Cultura y Ocio', 'Restauración', 'Salud y Servicios Sociales', 'Bienestar Social', 'Mercado', 'Parque', 'Industrial', 'Centros Deportivos', 'Parking', 'Policia', 'Cementerio', 'Protección Civil']
-
+{preferred_sources}
 Return **only** the SQL query—no additional explanation or formatting:
 
 """
 
+# Filled into {preferred_sources} with the lines of the tables left in the schema after pruning.
+PREFERRED_SOURCES_PROMPT = """
+Preferred sources, depending on the requested granularity:
+{sources}
+"""
+
+PREFERRED_SOURCES = {
+    "daily_consumption": "• Daily data → use smart_buildings.daily_consumption; do not aggregate the raw readings.",
+    "energy_consumption_weekly_metrics": "• Weekly data → use smart_buildings.energy_consumption_weekly_metrics.",
+    "energy_consumption_monthly_metrics": "• Monthly data → use smart_buildings.energy_consumption_monthly_metrics.",
+}
+
+SQL_REPAIR_PROMPT = """The previous SQL query is not valid for the database schema:
+{errors}
+
+Fix the query using only the tables and columns in the schema. Return **only** the corrected SQL query—no additional explanation or formatting:
+"""
+
+ENTITY_MATCHES_PROMPT = """
+Database values that the question may refer to (column: value, with their similarity to the words of the question). When one is clearly meant, filter on that exact value; ignore the others:
+{entities}
+"""
+
 
 RELEVANT_INFO_SYSTEM_PROMPT = """You are a smart database assistant. Analyze the user's query and extract the most relevant tables and columns from the provided database schema.
 
@@ -0,0 +1,124 @@
+"""Refresh the materialized rollups that generated SQL reads instead of raw data.
+
+Two rollups are maintained from ``raw.energy_consumption`` (see ``.sql``):
+
+* ``smart_buildings.daily_consumption``: daily totals per ``cups``, extended
+  incrementally from a watermark on ``date`` by ``refresh_daily_consumption``.
+* ``smart_buildings.energy_consumption_monthly_metrics``: monthly metrics recomputed from
+  the daily rollup for the last months by ``refresh_energy_consumption_monthly_metrics``.
+
+Run after new raw readings are loaded:
+
+    python -m agent.rollups                      # new days, then previous and current month
+    python -m agent.rollups --if-new-data        # only if raw has readings past the watermark
+    python -m agent.rollups --from-month 2024-01-01
+    python -m agent.rollups --full               # rebuild every day and month
+
+Functions:
+    refresh_daily_consumption: Aggregate raw readings past the watermark into daily totals.
+    refresh_monthly_metrics: Recompute the monthly metrics from a given month on.
+    has_new_data: Whether raw has readings newer than the rollup watermark.
+"""
+
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+DAILY_CONSUMPTION_ROLLUP = "daily_consumption"
+MONTHLY_METRICS_ROLLUP = "energy_consumption_monthly_metrics"
+FULL_REFRESH_FROM = date(1900, 1, 1)
+
+
+def refresh_daily_consumption(engine: Engine, since: Optional[date] = None) -> int:
+    """Aggregate raw readings into daily totals, from the watermark day or from ``since``.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the energy database.
+        since (Optional[date]): Recompute from this day instead of the watermark, for
+            readings that arrived late.
+
+    Returns:
+        int: Number of daily rows written.
+    """
+    with engine.begin() as connection:
+        return connection.execute(
+            text("SELECT smart_buildings.refresh_daily_consumption(CAST(:since AS TIMESTAMP))"),
+            {"since": since},
+        ).scalar()
+
+
+def refresh_monthly_metrics(engine: Engine, from_month: Optional[date] = None) -> int:
+    """Recompute the monthly metrics from ``from_month`` on, in a single transaction.
+
+    The metrics are computed from ``daily_consumption``; refresh it first.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the energy database.
+        from_month (Optional[date]): First month to recompute; the previous month if None.
+
+    Returns:
+        int: Number of monthly rows written.
+    """
+    with engine.begin() as connection:
+        if from_month is None:
+            return connection.execute(
+                text("SELECT smart_buildings.refresh_energy_consumption_monthly_metrics()")
+            ).scalar()
+        return connection.execute(
+            text("SELECT smart_buildings.refresh_energy_consumption_monthly_metrics(:from_month)"),
+            {"from_month": from_month},
+        ).scalar()
+
+
+def has_new_data(engine: Engine, rollup: str = DAILY_CONSUMPTION_ROLLUP) -> bool:
+    """Return True if raw has readings newer than the watermark of ``rollup``."""
+    with engine.connect() as connection:
+        return bool(connection.execute(
+            text(
+                "SELECT (SELECT MAX(date) FROM raw.energy_consumption) IS DISTINCT FROM "
+                "(SELECT watermark FROM smart_buildings.rollup_state WHERE rollup_name = :rollup)"
+            ),
+            {"rollup": rollup},
+        ).scalar())
+
+
+def main(argv: Optional[list] = None) -> None:
+    """Refresh the daily and monthly rollups from the command line."""
+    import argparse
+    import time
+
+    from sqlalchemy import create_engine
+
+    from agent.configuration import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Refresh the daily consumption and monthly metrics rollups.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--from-month", type=date.fromisoformat, help="First month to recompute (YYYY-MM-DD).")
+    group.add_argument("--full", action="store_true", help="Recompute every day and month.")
+    parser.add_argument("--if-new-data", action="store_true", help="Skip the refresh if raw has no new readings.")
+    args = parser.parse_args(argv)
+
+    if DATABASE_URL is None:
+        raise ValueError("DB_USER environment variable is required.")
+    engine = create_engine(DATABASE_URL)
+    try:
+        if args.if_new_data and not has_new_data(engine):
+            print("Sin datos nuevos en raw.energy_consumption; no se actualiza.")
+            return
+        from_month = FULL_REFRESH_FROM if args.full else args.from_month
+
+        start = time.perf_counter()
+        rows = refresh_daily_consumption(engine, from_month)
+        print(f"{DAILY_CONSUMPTION_ROLLUP}: {rows} filas actualizadas en {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        rows = refresh_monthly_metrics(engine, from_month)
+        print(f"{MONTHLY_METRICS_ROLLUP}: {rows} filas actualizadas en {time.perf_counter() - start:.1f}s")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,18 @@ CREATE TABLE smart_buildings.building (
     type TEXT                      -- Type of building ( Administración, Comercio, etc.)
 );
 
+CREATE TABLE smart_buildings.daily_consumption (
+    -- Daily totals per building. Use this table for questions about specific days or daily series
+    -- (last N days, day with the highest consumption...); never aggregate raw readings.
+    cups TEXT NOT NULL,                                       -- cups of the building
+    day DATE NOT NULL,                                        -- Day of the readings (yyyy-MM-dd)
+    consumption_kwh NUMERIC NOT NULL,                         -- Total consumption of the day in kWh
+    readings INTEGER NOT NULL,                                -- Number of meter readings in the day
+    date_insert TIMESTAMPTZ NOT NULL,                         -- Timestamp when the row was last refreshed
+    PRIMARY KEY (cups, day),                                  -- Composite primary key. CUPS and day
+    FOREIGN KEY (cups) REFERENCES smart_buildings.building(cups)  -- Foreign key linking to the buildings table
+);
+
 CREATE TABLE smart_buildings.energy_consumption_monthly_metrics (
     cups TEXT NULL,                                           -- cups of the building
     year_month DATE NULL,                                     -- Year and month of the record, first day of month (yyyy-MM-01)
@@ -20,6 +32,7 @@ CREATE TABLE smart_buildings.energy_consumption_monthly_metrics (
     diff_pct_consumption_prev_year_same_month numeric(38, 13) NULL     -- Percentage difference from the same month last year
     diff_consumo_grupo numeric(25, 6) NULL,                    -- Difference in consumption compared to the group average      
 	avg_group_consumption_kwh numeric(24, 6) NULL,              -- Average consumption of the group
+    FOREIGN KEY (cups) REFERENCES smart_buildings.building(cups)  -- Foreign key linking to the buildings table
 
 );
 
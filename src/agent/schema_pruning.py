@@ -0,0 +1,122 @@
+"""Pick the tables a question needs so the SQL prompt only carries their DDL.
+
+The table and column descriptions of ``schema_context.yaml`` are embedded once with the
+same model as the questions. For each question, every table is scored by its best
+matching description; the ``top_k`` tables are kept and completed with the tables they
+reference through foreign keys (so ``building`` comes along for name lookups). No LLM
+call is involved: the question embedding computed for value retrieval is reused.
+
+Functions:
+    build_schema_index: Embed the descriptions of a schema context.
+    get_schema_index: Return the shared index for the configured schema context.
+    prune_schema: Render the DDL of the selected tables.
+
+Classes:
+    SchemaIndex: Description embeddings and the table each one belongs to.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Sequence, Tuple
+
+from agent.configuration import EMBEDDING_MODEL_NAME, SCHEMA_PATH
+from agent.sql_validation import TableSchema
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_indexes: Dict[Tuple[str, str], "SchemaIndex"] = {}
+_lock = threading.Lock()
+
+
+@dataclass
+class SchemaIndex:
+    """Unit-length embeddings of table and column descriptions."""
+
+    tables: List[str]
+    """Table of each embedding row."""
+    embeddings: "np.ndarray"
+
+    def select_tables(self, query_embedding: "np.ndarray", top_k: int,
+                      schema_tables: Dict[str, TableSchema]) -> List[str]:
+        """Return the ``top_k`` best matching tables plus their foreign-key closure.
+
+        Args:
+            query_embedding (np.ndarray): Embedding of the question, shape (d,) or (1, d).
+            top_k (int): Number of tables selected by similarity.
+            schema_tables (Dict[str, TableSchema]): Parsed schema, for foreign keys.
+
+        Returns:
+            List[str]: Selected table names, best match first, then referenced tables.
+        """
+        import numpy as np
+
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.embeddings @ query
+
+        best: Dict[str, float] = {}
+        for table, score in zip(self.tables, scores):
+            if table in schema_tables:
+                best[table] = max(best.get(table, -1.0), float(score))
+        selected = sorted(best, key=best.get, reverse=True)[:top_k]
+
+        pending = list(selected)
+        while pending:
+            for _, referenced, _ in schema_tables[pending.pop()].foreign_keys:
+                if referenced in schema_tables and referenced not in selected:
+                    selected.append(referenced)
+                    pending.append(referenced)
+        return selected
+
+
+def _descriptions(schema_context: dict) -> Tuple[List[str], List[str]]:
+    tables, texts = [], []
+    for table in schema_context.get("tables", []):
+        name = table["name"]
+        tables.append(name)
+        texts.append(f"{name}: {table.get('description', '')}")
+        for column in table.get("columns", []):
+            tables.append(name)
+            texts.append(f"{name}.{column['name']}: {column.get('description', '')}")
+    return tables, texts
+
+
+def build_schema_index(schema_context: dict, encode: Callable[[List[str]], "np.ndarray"]) -> SchemaIndex:
+    """Embed the table and column descriptions of a parsed ``schema_context.yaml``.
+
+    Args:
+        schema_context (dict): The parsed YAML, with ``tables`` and their ``columns``.
+        encode (Callable): Function returning one embedding row per text.
+    """
+    import numpy as np
+
+    tables, texts = _descriptions(schema_context)
+    embeddings = np.asarray(encode(texts), dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return SchemaIndex(tables=tables, embeddings=embeddings)
+
+
+def get_schema_index(context_path: str = SCHEMA_PATH, model_name: str = EMBEDDING_MODEL_NAME) -> SchemaIndex:
+    """Return the index of ``context_path``, embedding its descriptions on first use."""
+    key = (context_path, model_name)
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                import yaml
+
+                from agent.embeddings import get_embedding_model
+
+                with open(context_path, encoding="utf-8") as f:
+                    schema_context = yaml.safe_load(f)
+                model = get_embedding_model(model_name)
+                index = build_schema_index(schema_context, lambda texts: model.encode(texts, convert_to_numpy=True))
+                _indexes[key] = index
+    return index
+
+
+def prune_schema(selected: Sequence[str], schema_tables: Dict[str, TableSchema]) -> str:
+    """Return the DDL of the ``selected`` tables, in schema file order."""
+    return "\n\n".join(table.ddl for name, table in schema_tables.items() if name in selected)
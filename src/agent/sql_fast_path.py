@@ -0,0 +1,86 @@
+"""Reuse the SQL of a known question when the user asks a close paraphrase of it.
+
+The SQL vectorstore holds curated question/SQL pairs. When the nearest pair is similar
+enough, its SQL is adapted to the user's question instead of asking the LLM for a new
+query:
+
+* Building names (``b.name = '...'``) and building types (``b.type = '...'``) that the
+  known question mentions are replaced with the ones the user mentions.
+* The reuse is refused if the questions differ in months, years or other numbers, or if
+  the known SQL depends on an entity the user does not name (follow-up questions).
+
+Functions:
+    reuse_known_sql: Return adapted SQL for the user's question, or None to use the LLM.
+"""
+
+import re
+from typing import Iterable, Optional, Sequence, Tuple
+
+from agent.utils import clean_sql, normalize_query
+
+MONTHS = (
+    "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+    "agosto", "septiembre", "setiembre", "octubre", "noviembre", "diciembre",
+)
+
+_ENTITY_SLOT = re.compile(r"""(\b\w+\.\s*"?(name|type)"?\s*=\s*)'((?:[^']|'')*)'""", re.IGNORECASE)
+
+
+def _specifics(normalized_question: str) -> Tuple[set, set]:
+    months = {m for m in MONTHS if re.search(rf"\b{m}\b", normalized_question)}
+    numbers = set(re.findall(r"\d+", normalized_question))
+    return months, numbers
+
+
+def _mentioned(candidates: Iterable[str], normalized_question: str) -> Optional[str]:
+    """Return the longest candidate that appears in the question, if any."""
+    found = [c for c in candidates if c and re.search(rf"\b{re.escape(normalize_query(c))}\b", normalized_question)]
+    return max(found, key=len) if found else None
+
+
+def reuse_known_sql(
+    question: str,
+    matched_sql: Sequence[Tuple[str, str]],
+    sql_scores: Sequence[float],
+    matched_names: Sequence[str],
+    building_types: Sequence[str],
+    threshold: float,
+) -> Optional[str]:
+    """Adapt the SQL of the nearest known question to ``question``.
+
+    Args:
+        question (str): The user's question.
+        matched_sql (Sequence[Tuple[str, str]]): Nearest (question, SQL) pairs, best first.
+        sql_scores (Sequence[float]): Cosine similarity of each pair to ``question``.
+        matched_names (Sequence[str]): Building names retrieved for ``question``.
+        building_types (Sequence[str]): Known building types.
+        threshold (float): Minimum similarity for reusing the nearest pair.
+
+    Returns:
+        Optional[str]: The SQL to run, or None if the LLM should generate it.
+    """
+    if not matched_sql or not sql_scores or sql_scores[0] < threshold:
+        return None
+
+    known_question, known_sql = matched_sql[0]
+    user_normalized = normalize_query(question)
+    known_normalized = normalize_query(known_question)
+    if _specifics(user_normalized) != _specifics(known_normalized):
+        return None
+
+    unresolved = False
+
+    def substitute(match: re.Match) -> str:
+        nonlocal unresolved
+        column, literal = match.group(2).lower(), match.group(3).replace("''", "'")
+        replacement = None
+        # Skip entities the known question only implies (follow-ups such as "¿y ese YTD?").
+        if re.search(rf"\b{re.escape(normalize_query(literal))}\b", known_normalized):
+            replacement = _mentioned(matched_names if column == "name" else building_types, user_normalized)
+        if replacement is None:
+            unresolved = True
+            return match.group(0)
+        return match.group(1) + "'" + replacement.replace("'", "''") + "'"
+
+    sql = _ENTITY_SLOT.sub(substitute, clean_sql(known_sql))
+    return None if unresolved else sql
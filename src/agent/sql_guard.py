@@ -0,0 +1,172 @@
+"""Check generated SQL before it runs on the shared database.
+
+``guard_query`` applies, in order:
+
+* only a single read statement (``SELECT`` / ``WITH ... SELECT``) without row locks
+  (``FOR UPDATE``, ``FOR SHARE``...) is accepted;
+* a ``LIMIT`` is added when the outer query has none, and a larger literal ``LIMIT`` or
+  ``FETCH FIRST`` count is lowered to the configured one;
+* on PostgreSQL the plan is estimated with ``EXPLAIN (FORMAT JSON)`` in a read-only
+  transaction, and queries whose estimated cost or rows exceed the limits are rejected.
+
+Rejections carry a message for the user.
+
+Functions:
+    has_locking_clause: Whether the outer query locks rows.
+    ensure_limit: Add or lower the outer ``LIMIT`` of a query.
+    explain_estimate: Return the planner's total cost and row estimate for a query.
+    guard_query: Validate, rewrite and estimate a generated query.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import sqlparse
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlparse import sql as S
+from sqlparse import tokens as T
+
+from agent.utils import clean_sql, query_connection
+
+READ_ONLY_MESSAGE = "Solo puedo ejecutar consultas de lectura sobre los datos de consumo."
+TOO_EXPENSIVE_MESSAGE = (
+    "La consulta necesaria para responder es demasiado costosa para ejecutarla ahora "
+    "(coste estimado {cost:,.0f}, filas estimadas {rows:,.0f}). Prueba a acotar la pregunta a un edificio, "
+    "un tipo de edificio o un periodo más corto."
+)
+
+
+@dataclass
+class GuardResult:
+    """Outcome of ``guard_query``.
+
+    ``sql`` is the query to execute (possibly rewritten). ``rejection`` is a message for
+    the user when the query must not run; ``error`` is set when the database could not
+    plan it (for example an unknown column).
+    """
+
+    sql: str
+    cost: Optional[float] = None
+    rows: Optional[float] = None
+    rejection: Optional[str] = None
+    error: Optional[str] = None
+
+
+LOCK_STRENGTHS = frozenset({"UPDATE", "SHARE", "NO", "KEY"})
+
+
+def _outer_words(token_list) -> list:
+    """Non-whitespace leaf tokens of the outer query; parenthesized parts are skipped."""
+    words = []
+    for token in token_list.tokens:
+        if isinstance(token, S.Parenthesis) or token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.is_group:
+            words.extend(_outer_words(token))
+        else:
+            words.append(token)
+    return words
+
+
+def _locking_clause(words: list) -> Optional[int]:
+    """Position of the ``FOR`` that starts a row-locking clause in ``words``, if any."""
+    for i, token in enumerate(words[:-1]):
+        if token.ttype is T.Keyword and token.normalized == "FOR" and words[i + 1].normalized in LOCK_STRENGTHS:
+            return i
+    return None
+
+
+def has_locking_clause(sql: str) -> bool:
+    """Return True if the outer query of ``sql`` locks rows (``FOR UPDATE``, ``FOR SHARE``...)."""
+    statement = sqlparse.parse(clean_sql(sql).rstrip().rstrip(";"))[0]
+    return _locking_clause(_outer_words(statement)) is not None
+
+
+def ensure_limit(sql: str, limit: int) -> str:
+    """Return ``sql`` with an outer ``LIMIT`` no larger than ``limit``.
+
+    Subqueries are left untouched. Limits that are not integer literals (placeholders,
+    ``ALL``) are replaced as well, and so is a larger ``FETCH FIRST n ROWS ONLY`` count.
+    A missing ``LIMIT`` goes at the end, or before a locking clause, which must come last.
+    """
+    statement = sqlparse.parse(clean_sql(sql).rstrip().rstrip(";"))[0]
+    words = _outer_words(statement)
+    for i, token in enumerate(words):
+        if token.ttype is T.Keyword and token.normalized == "LIMIT":
+            value = words[i + 1] if i + 1 < len(words) else None
+            if value is not None and value.ttype in T.Literal.Number.Integer and int(value.value) <= limit:
+                return str(statement)
+            if value is not None:
+                value.value = str(limit)
+                return str(statement)
+        if token.ttype is T.Keyword and token.normalized == "FETCH":
+            # FETCH FIRST|NEXT [n] ROW|ROWS ONLY; without a count it returns one row.
+            value = words[i + 2] if i + 2 < len(words) else None
+            if value is not None and value.ttype in T.Literal.Number.Integer and int(value.value) > limit:
+                value.value = str(limit)
+            return str(statement)
+    lock = _locking_clause(words)
+    if lock is not None:
+        words[lock].value = f"LIMIT {limit}\n{words[lock].value}"
+        return str(statement)
+    return f"{str(statement).rstrip()}\nLIMIT {limit}"
+
+
+def explain_estimate(connection, sql: str) -> Tuple[float, float]:
+    """Return the total cost and row estimate of the top plan node of ``sql``."""
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    top = plan[0]["Plan"]
+    return float(top["Total Cost"]), float(top["Plan Rows"])
+
+
+def _is_single_read(sql: str) -> bool:
+    statements = [s for s in sqlparse.parse(sql) if s.token_first(skip_cm=True) is not None]
+    return len(statements) == 1 and statements[0].get_type() == "SELECT"
+
+
+def guard_query(
+    sql: str,
+    engine,
+    schema: Optional[str] = None,
+    max_cost: Optional[float] = None,
+    max_rows: Optional[float] = None,
+    limit: Optional[int] = None,
+    statement_timeout: Optional[float] = None,
+) -> GuardResult:
+    """Validate, rewrite and estimate a generated query.
+
+    Args:
+        sql (str): The generated SQL, possibly in a markdown code block.
+        engine: SQLAlchemy engine.
+        schema (Optional[str]): Schema to set before planning.
+        max_cost (Optional[float]): Maximum planner total cost; None disables the check.
+        max_rows (Optional[float]): Maximum planner row estimate; None disables the check.
+        limit (Optional[int]): Outer ``LIMIT`` to enforce; None leaves the query as is.
+        statement_timeout (Optional[float]): Server-side timeout in seconds for ``EXPLAIN``.
+
+    Returns:
+        GuardResult: The query to run, or why it must not run.
+    """
+    sql = clean_sql(sql).rstrip().rstrip(";")
+    if not _is_single_read(sql) or has_locking_clause(sql):
+        return GuardResult(sql=sql, rejection=READ_ONLY_MESSAGE)
+    if limit is not None:
+        sql = ensure_limit(sql, limit)
+    if engine.dialect.name != "postgresql" or (max_cost is None and max_rows is None):
+        return GuardResult(sql=sql)
+
+    try:
+        with query_connection(engine, schema, statement_timeout, read_only=True) as connection:
+            cost, rows = explain_estimate(connection, sql)
+    except SQLAlchemyError as e:
+        print(f"Error al estimar la consulta SQL: {e}")
+        return GuardResult(sql=sql, error="ERROR SQL")
+
+    if (max_cost is not None and cost > max_cost) or (max_rows is not None and rows > max_rows):
+        print(f"Consulta SQL rechazada: coste {cost:.0f}, filas {rows:.0f}")
+        return GuardResult(sql=sql, cost=cost, rows=rows, rejection=TOO_EXPENSIVE_MESSAGE.format(cost=cost, rows=rows))
+    return GuardResult(sql=sql, cost=cost, rows=rows)
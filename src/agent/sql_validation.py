@@ -0,0 +1,205 @@
+"""Validate generated SQL against the tables and columns of ``schema.sql`` without a database.
+
+``parse_schema_sql`` reads the ``CREATE TABLE`` blocks of the schema file. It is lenient
+on purpose: the file is written for the LLM, so it has comments everywhere and the odd
+missing comma. ``validate_sql`` then checks a query against it:
+
+* tables after ``FROM`` / ``JOIN`` must exist (CTE names are allowed);
+* ``alias.column`` references must name a column of the aliased table;
+* bare column names must exist in one of the referenced tables, unless they are an
+  alias defined in the query.
+
+Derived tables and CTEs are not typed, so references through them are not checked.
+The errors are written for the SQL model, which gets them back in the repair loop.
+
+Functions:
+    parse_schema_sql: Parse the tables, columns, foreign keys and DDL of a schema file.
+    validate_sql: Return the schema errors of a query, empty if it looks valid.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from agent.utils import clean_sql
+
+_CREATE_TABLE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)\s*\(", re.IGNORECASE)
+_FOREIGN_KEY = re.compile(
+    r"FOREIGN\s+KEY\s*\(\s*(\w+)\s*\)\s*REFERENCES\s+([\w.\"]+)\s*\(\s*(\w+)\s*\)", re.IGNORECASE
+)
+_CONSTRAINT_WORDS = {"primary", "foreign", "constraint", "unique", "check", "exclude"}
+_FROM_FUNCTIONS = {"EXTRACT", "SUBSTRING", "TRIM", "OVERLAY", "POSITION"}
+
+
+@dataclass
+class TableSchema:
+    """A table parsed from ``schema.sql``."""
+
+    name: str
+    schema: Optional[str]
+    columns: List[str]
+    foreign_keys: List[Tuple[str, str, str]] = field(default_factory=list)
+    """(column, referenced table, referenced column) triples."""
+    ddl: str = ""
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.replace('"', "").lower()
+
+
+def parse_schema_sql(ddl: str) -> Dict[str, TableSchema]:
+    """Parse the ``CREATE TABLE`` statements of ``ddl``.
+
+    Returns:
+        Dict[str, TableSchema]: Tables keyed by lower-case name without schema.
+    """
+    tables = {}
+    for match in _CREATE_TABLE.finditer(ddl):
+        depth, end = 1, match.end()
+        while end < len(ddl) and depth:
+            depth += {"(": 1, ")": -1}.get(ddl[end], 0)
+            end += 1
+        body = ddl[match.end():end - 1]
+        statement_end = ddl.find(";", end)
+        block = ddl[match.start():statement_end + 1 if statement_end != -1 else end]
+
+        columns = []
+        for line in body.splitlines():
+            line = line.split("--", 1)[0].strip()
+            first = re.match(r'"?(\w+)"?', line)
+            if first and first.group(1).lower() not in _CONSTRAINT_WORDS:
+                columns.append(first.group(1).lower())
+
+        *schema, name = _unquote(match.group(1)).split(".")
+        foreign_keys = [
+            (column.lower(), _unquote(table).split(".")[-1], ref_column.lower())
+            for column, table, ref_column in _FOREIGN_KEY.findall(body)
+        ]
+        tables[name] = TableSchema(
+            name=name,
+            schema=schema[0] if schema else None,
+            columns=columns,
+            foreign_keys=foreign_keys,
+            ddl=block.strip(),
+        )
+    return tables
+
+
+def _leaves(sql: str) -> List[Tuple[object, str]]:
+    """Flatten ``sql`` into (ttype, value) pairs without whitespace and comments."""
+    leaves = []
+    for token in sqlparse.parse(sql)[0].flatten():
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.ttype in T.Literal.String.Symbol:  # "quoted" identifier
+            leaves.append((T.Name, token.value.strip('"')))
+        else:
+            leaves.append((token.ttype, token.value))
+    return leaves
+
+
+def _is_name(leaf: Tuple[object, str]) -> bool:
+    return leaf[0] in T.Name and leaf[0] not in T.Name.Builtin
+
+
+def _is_keyword(leaf: Tuple[object, str], *words: str) -> bool:
+    return leaf[0] in T.Keyword and " ".join(leaf[1].upper().split()) in words
+
+
+def validate_sql(sql: str, tables: Dict[str, TableSchema]) -> List[str]:
+    """Return the schema errors of ``sql``; an empty list means it looks valid.
+
+    Args:
+        sql (str): The generated SQL, possibly in a markdown code block.
+        tables (Dict[str, TableSchema]): Tables from ``parse_schema_sql``.
+
+    Returns:
+        List[str]: One message per unknown table, alias or column.
+    """
+    sql = clean_sql(sql)
+    if not sql:
+        return ["The query is empty."]
+    leaves = _leaves(sql)
+
+    # Names the query defines itself: CTEs, aliases of expressions and derived tables.
+    defined: Set[str] = set()
+    for i, leaf in enumerate(leaves):
+        following = leaves[i + 1] if i + 1 < len(leaves) else None
+        if _is_keyword(leaf, "AS") and following and (_is_name(following) or following[0] in T.Keyword):
+            defined.add(following[1].lower())
+        elif leaf[1] == ")" and following and _is_name(following):
+            defined.add(following[1].lower())
+        elif _is_name(leaf) and following and _is_keyword(following, "AS") and i + 2 < len(leaves) and leaves[i + 2][1] == "(":
+            defined.add(leaf[1].lower())  # WITH name AS (...)
+
+    errors: List[str] = []
+    aliases: Dict[str, str] = {}
+    referenced: List[str] = []
+    table_positions: Set[int] = set()
+
+    # Tables after FROM / JOIN, including comma-separated FROM lists. FROM inside
+    # EXTRACT(field FROM ...), SUBSTRING(... FROM ...) and TRIM(... FROM ...) is not a table.
+    calls: List[str] = []
+    i = 0
+    while i < len(leaves):
+        leaf = leaves[i]
+        if leaf[1] == "(":
+            calls.append(leaves[i - 1][1].upper() if i else "")
+        elif leaf[1] == ")" and calls:
+            calls.pop()
+        if calls and calls[-1] in _FROM_FUNCTIONS:
+            pass
+        elif _is_keyword(leaf, "FROM") or (leaf[0] in T.Keyword and leaf[1].upper().endswith("JOIN")):
+            j = i + 1
+            while j < len(leaves) and _is_name(leaves[j]):
+                parts, start = [leaves[j][1]], j
+                while j + 2 < len(leaves) and leaves[j + 1][1] == "." and _is_name(leaves[j + 2]):
+                    parts.append(leaves[j + 2][1])
+                    j += 2
+                table_positions.update(range(start, j + 1))
+                if j + 1 < len(leaves) and leaves[j + 1][1] == "(":
+                    break  # set-returning function such as generate_series(...)
+                table = parts[-1].lower()
+                if table in tables:
+                    referenced.append(table)
+                elif table not in defined:
+                    errors.append(f"Unknown table `{'.'.join(parts)}`.")
+                aliases[table] = table
+                k = j + 1
+                if k < len(leaves) and _is_keyword(leaves[k], "AS"):
+                    k += 1
+                if k < len(leaves) and _is_name(leaves[k]):
+                    aliases[leaves[k][1].lower()] = table
+                    table_positions.add(k)
+                    k += 1
+                if k < len(leaves) and leaves[k][1] == "," and _is_keyword(leaf, "FROM"):
+                    j = k + 1
+                    continue
+                break
+        i += 1
+
+    known_columns = {column for table in referenced for column in tables[table].columns}
+    for i, leaf in enumerate(leaves):
+        if i in table_positions or not _is_name(leaf):
+            continue
+        name = leaf[1].lower()
+        following = leaves[i + 1] if i + 1 < len(leaves) else None
+        if following and following[1] == "(":
+            continue  # function call
+        if following and following[1] == "." and i + 2 < len(leaves) and _is_name(leaves[i + 2]):
+            column = leaves[i + 2][1].lower()
+            table = aliases.get(name)
+            if table in tables and column not in tables[table].columns:
+                errors.append(f"Column `{column}` does not exist in table `{table}` (alias `{name}`).")
+            elif table is None and name not in defined:
+                errors.append(f"Unknown table or alias `{name}` in `{name}.{column}`.")
+            continue
+        if i > 0 and leaves[i - 1][1] == ".":
+            continue  # already checked as alias.column
+        if name not in known_columns and name not in defined and name not in aliases and referenced:
+            errors.append(f"Column `{name}` does not exist in tables {', '.join(f'`{t}`' for t in referenced)}.")
+
+    return list(dict.fromkeys(errors))
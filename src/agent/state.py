@@ -41,6 +41,11 @@ class Response(BaseModel):
     answer: Annotated[str, ..., "Response to the user question"]
 
 
+def merge_timings(left: Dict[str, float], right: Dict[str, float]) -> Dict[str, float]:
+    """Merge per-node timings written by nodes that may run in parallel."""
+    return {**(left or {}), **(right or {})}
+
+
 @dataclass(kw_only=True)
 class State(InputState):
     """Defines the input state for the agent."""
@@ -51,8 +56,25 @@ class State(InputState):
     sql_query: Optional[str] = None
     sql_messages: Annotated[list[AnyMessage], add_messages] = Field(default_factory=list)
     #is_sql_valid: Optional[bool] = None
+    sql_validation_error: Optional[str] = None
+    """Schema errors of ``sql_query``, fed back to the model in the repair loop."""
+    sql_retries: int = 0
+    """Repair attempts the current ``sql_query`` needed."""
+    sql_rejection: Optional[str] = None
+    """Message for the user when the guard refused to run ``sql_query``."""
     query_result: Optional[str] = None
-    relevant_values: Optional[List[str]] = None
+    query_row_count: Optional[int] = None
+    """Number of rows the query returned; ``query_result`` may show fewer."""
+    query_truncated: bool = False
+    query_data: Optional[Dict[str, Any]] = None
+    """Columns and fetched rows of the result, for summarization."""
+    query_summary: Optional[str] = None
+    """Digest sent to the explanation prompt instead of ``query_result`` for long results."""
+    relevant_values: Optional[Dict[str, Any]] = None
+    sql_path: Optional[Literal["retrieval", "llm"]] = None
+    """Whether ``sql_query`` was reused from a known question or generated by the LLM."""
+    node_timings: Annotated[Dict[str, float], merge_timings] = field(default_factory=dict)
+    """Seconds spent in intent detection and retrieval, keyed by node name."""
 
     @property
     def recent_messages(self, n=2):
@@ -0,0 +1,41 @@
+"""Stream a conversation turn through the compiled graph.
+
+Front ends use ``astream_turn`` to render the answer token by token instead of
+waiting for ``graph.ainvoke`` to finish.
+"""
+
+from typing import Any, AsyncIterator, Optional, Tuple
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableConfig
+
+from agent.graph import graph
+from agent.state import State
+
+# Nodes whose LLM output is the answer shown to the user.
+ANSWER_NODES = frozenset({"explanation_generation", "respond_to_general_query", "ask_for_more_info"})
+
+
+async def astream_turn(state: State, config: Optional[RunnableConfig] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Run one turn of the graph and yield events as they happen.
+
+    Yields:
+        ("token", str): A chunk of the answer, as the model produces it.
+        ("sql", str): The SQL that will run, once ``query_guard`` has accepted it.
+        ("final", dict): The final graph state, always last.
+    """
+    final = None
+    async for mode, chunk in graph.astream(state, config, stream_mode=["messages", "updates", "values"]):
+        if mode == "messages":
+            message, metadata = chunk
+            if (metadata.get("langgraph_node") in ANSWER_NODES
+                    and isinstance(message, AIMessageChunk) and message.content):
+                yield "token", message.content
+        elif mode == "updates":
+            sql_update = chunk.get("query_guard") or {}
+            # Rejected queries never run, so they are not shown as the SQL of the answer.
+            if sql_update.get("sql_query") and not sql_update.get("sql_rejection"):
+                yield "sql", sql_update["sql_query"]
+        else:
+            final = chunk
+    yield "final", final
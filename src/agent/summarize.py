@@ -0,0 +1,166 @@
+"""Summarize large SQL results before they are sent to the explanation prompt.
+
+The explanation model only needs the shape of a long result, not every row. For results
+above a threshold the rows are reduced to a compact digest with pandas:
+
+* count, sum, mean, min and max of each numeric column;
+* the top and bottom N rows by the main value column: the first numeric column whose
+  name looks like a measure (kWh, consumption, value...), skipping integer columns that
+  look like years, months or ids;
+* month-over-month deltas when the result has a date column, per entity if the
+  result has one (for example per building).
+
+Functions:
+    summarize_result: Build the markdown digest of a result.
+"""
+
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional, Sequence, TYPE_CHECKING
+
+from agent.utils import format_value
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MEASURE_NAME = re.compile(r"kwh|consum|energ|value|valor|amount|importe|total|sum|avg|mean|media|pct|diff", re.IGNORECASE)
+KEY_NAME = re.compile(r"(^|_)(id|year|anio|ano|month|mes|week|semana|day|dia|quarter|code|codigo)($|_)", re.IGNORECASE)
+
+
+def _unique_names(columns: Sequence[str]) -> list:
+    """Suffix repeated column names (``cups``, ``cups_2``), as joins with ``SELECT *`` produce."""
+    names, seen = [], set()
+    for column in map(str, columns):
+        name, n = column, 1
+        while name in seen:
+            n += 1
+            name = f"{column}_{n}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _to_frame(columns: Sequence[str], rows: Sequence[Sequence]) -> "pd.DataFrame":
+    import pandas as pd
+
+    df = pd.DataFrame([list(row) for row in rows], columns=_unique_names(columns))
+    for column in df.columns:
+        values = df[column].dropna()
+        if values.empty:
+            continue
+        if values.map(lambda v: isinstance(v, (int, float, Decimal)) and not isinstance(v, bool)).all():
+            df[column] = pd.to_numeric(df[column].map(lambda v: float(v) if isinstance(v, Decimal) else v))
+        elif values.map(lambda v: isinstance(v, (date, datetime))).all():
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def _format_cell(value) -> str:
+    import pandas as pd
+
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    if pd.isna(value):
+        return "-"
+    return format_value(value)
+
+
+def _markdown(df: "pd.DataFrame") -> str:
+    lines = ["| " + " | ".join(map(str, df.columns)) + " |", "| " + " | ".join(["---"] * len(df.columns)) + " |"]
+    for row in df.itertuples(index=False):
+        lines.append("| " + " | ".join(_format_cell(value) for value in row) + " |")
+    return "\n".join(lines)
+
+
+def _is_key_like(series: "pd.Series") -> bool:
+    """Whether a numeric column holds integers that look like years, periods or ids."""
+    values = series.dropna()
+    if values.empty or not (values == values.round()).all():
+        return False
+    if KEY_NAME.search(str(series.name)):
+        return True
+    return bool(values.between(1900, 2100).all())
+
+
+def _value_column(df: "pd.DataFrame", numeric: Sequence[str]) -> str:
+    """The numeric column to rank rows and compute deltas by.
+
+    Columns named like measures come first; integer columns that look like years or ids
+    are only used when nothing else is numeric.
+    """
+    candidates = [c for c in numeric if not _is_key_like(df[c])]
+    measures = [c for c in candidates if MEASURE_NAME.search(str(c))]
+    return (measures or candidates or list(numeric))[0]
+
+
+def _monthly_deltas(df: "pd.DataFrame", date_column: str, value_column: str, entity_column: Optional[str]) -> "pd.DataFrame":
+    """Month-over-month change of ``value_column``, per entity when there is one."""
+    keys = [entity_column] if entity_column else []
+    monthly = (
+        df.assign(mes=df[date_column].dt.to_period("M").dt.to_timestamp())
+        .groupby(keys + ["mes"], sort=True)[value_column]
+        .sum()
+        .reset_index()
+    )
+    previous = monthly.groupby(keys)[value_column].shift(1) if keys else monthly[value_column].shift(1)
+    monthly["variacion"] = monthly[value_column] - previous
+    monthly["variacion_pct"] = monthly["variacion"] / previous.where(previous != 0) * 100
+    return monthly.dropna(subset=["variacion"])
+
+
+def summarize_result(
+    columns: Sequence[str],
+    rows: Sequence[Sequence],
+    row_count: Optional[int] = None,
+    top_n: int = 5,
+) -> str:
+    """Return a markdown digest of a query result.
+
+    Args:
+        columns (Sequence[str]): Column names.
+        rows (Sequence[Sequence]): Fetched rows; may be a preview of a larger result.
+        row_count (Optional[int]): Rows the query returned, if more than were fetched.
+        top_n (int): Number of rows kept at each end of the ranking and of the deltas.
+
+    Returns:
+        str: The digest, meant to replace the full table in the explanation prompt.
+    """
+    df = _to_frame(columns, rows)
+    total = row_count if row_count is not None else len(df)
+    numeric = [c for c in df.columns if df[c].dtype.kind in "if"]
+    dates = [c for c in df.columns if df[c].dtype.kind == "M"]
+    labels = [c for c in df.columns if c not in numeric and c not in dates]
+
+    sections = [f"Resumen de {total} filas (columnas: {', '.join(map(str, df.columns))})."]
+    if total > len(df):
+        sections.append(f"Las estadísticas se calculan sobre las primeras {len(df)} filas.")
+
+    if dates:
+        start, end = df[dates[0]].min(), df[dates[0]].max()
+        sections.append(f"Periodo: {start.date().isoformat()} a {end.date().isoformat()}.")
+
+    if numeric:
+        stats = df[numeric].agg(["count", "sum", "mean", "min", "max"]).T.reset_index()
+        stats.columns = ["columna", "n", "suma", "media", "minimo", "maximo"]
+        sections.append("**Estadísticas por columna:**\n\n" + _markdown(stats))
+
+        value_column = _value_column(df, numeric)
+        ranked = df.sort_values(value_column, ascending=False)
+        if len(df) > 2 * top_n:
+            sections.append(f"**{top_n} filas con mayor {value_column}:**\n\n" + _markdown(ranked.head(top_n)))
+            sections.append(f"**{top_n} filas con menor {value_column}:**\n\n" + _markdown(ranked.tail(top_n)))
+        else:
+            sections.append("**Filas:**\n\n" + _markdown(ranked))
+
+        if dates:
+            deltas = _monthly_deltas(df, dates[0], value_column, labels[0] if labels else None)
+            if not deltas.empty:
+                largest = deltas.reindex(deltas["variacion"].abs().sort_values(ascending=False).index).head(top_n)
+                sections.append(
+                    f"**Mayores variaciones mensuales de {value_column}:**\n\n" + _markdown(largest)
+                )
+    else:
+        sections.append("**Primeras filas:**\n\n" + _markdown(df.head(2 * top_n)))
+
+    return "\n\n".join(sections)
@@ -6,27 +6,59 @@ load_dotenv(override=True)
 Functions:
     format_docs: Convert documents to an xml-formatted string.
     load_chat_model: Load a chat model from a model name.
+    get_chat_model: Return the shared chat model client for a model name.
+    get_structured_chat_model: Return the shared structured-output wrapper of a chat model.
+    normalize_query: Fold case, accents and whitespace of a user question.
 """
 
-from typing import Optional
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import List, Optional, TYPE_CHECKING
 
 from langchain.chat_models import init_chat_model
 from langchain_core.documents import Document
 from langchain_core.language_models import BaseChatModel
-from sentence_transformers import SentenceTransformer
-import faiss
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
-import numpy as np
+from concurrent.futures import Executor
 from datetime import date
 from decimal import Decimal
+import asyncio
 import os
+import threading
+import weakref
+import re
+import unicodedata
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 BASE_URL = os.getenv('BASE_URL')
+CHAT_MAX_CONNECTIONS = int(os.getenv('CHAT_MAX_CONNECTIONS', 20))
+CHAT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('CHAT_MAX_KEEPALIVE_CONNECTIONS', 10))
+CHAT_KEEPALIVE_EXPIRY = float(os.getenv('CHAT_KEEPALIVE_EXPIRY', 30))
+
+def _http_pool_kwargs(model_provider: str, kwargs: dict) -> dict:
+    """Connection pool limits for the HTTP clients of the Ollama and OpenAI chat models."""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=CHAT_MAX_CONNECTIONS,
+        max_keepalive_connections=CHAT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=CHAT_KEEPALIVE_EXPIRY,
+    )
+    if model_provider == "ollama" and "client_kwargs" not in kwargs:
+        return {"client_kwargs": {"limits": limits}}
+    if model_provider == "openai" and "http_client" not in kwargs and "http_async_client" not in kwargs:
+        return {"http_client": httpx.Client(limits=limits), "http_async_client": httpx.AsyncClient(limits=limits)}
+    return {}
 
 def load_chat_model(fully_specified_name: str, **kwargs) -> BaseChatModel:
     """Load a chat model from a fully specified name.
 
+    Creates a new client every time; nodes should use ``get_chat_model`` instead.
+
     Args:
         fully_specified_name (str): String in the format 'provider/model'.
         **kwargs: Additional keyword arguments to pass to init_chat_model.
@@ -39,16 +71,68 @@ def load_chat_model(fully_specified_name: str, **kwargs) -> BaseChatModel:
         model = fully_specified_name
 
     if provider == "ollama-nexus":
-            return init_chat_model(model, model_provider='ollama',base_url=BASE_URL, **kwargs)
+        return init_chat_model(model, model_provider='ollama',base_url=BASE_URL, **_http_pool_kwargs('ollama', kwargs), **kwargs)
     elif provider == "openai-nexus":
-        return init_chat_model(model, model_provider='openai',base_url=BASE_URL, **kwargs)
+        return init_chat_model(model, model_provider='openai',base_url=BASE_URL, **_http_pool_kwargs('openai', kwargs), **kwargs)
     
-    return init_chat_model(model, model_provider=provider, **kwargs)
+    return init_chat_model(model, model_provider=provider, **_http_pool_kwargs(provider, kwargs), **kwargs)
+
+
+_chat_models_lock = threading.RLock()
+_chat_models_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+_chat_models_without_loop: dict = {}
+
+def _chat_model_registry() -> dict:
+    # Async HTTP clients are bound to the event loop they were first used on, so each
+    # loop gets its own clients. Servers run a single loop and share them across requests.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _chat_models_without_loop
+    registry = _chat_models_by_loop.get(loop)
+    if registry is None:
+        registry = _chat_models_by_loop.setdefault(loop, {})
+    return registry
+
+def _cached_chat_model(key: tuple, factory):
+    registry = _chat_model_registry()
+    model = registry.get(key)
+    if model is None:
+        with _chat_models_lock:
+            model = registry.get(key)
+            if model is None:
+                model = factory()
+                registry[key] = model
+    return model
+
+def get_chat_model(fully_specified_name: str, **kwargs) -> BaseChatModel:
+    """Return the shared chat model for a name and kwargs, creating it on first use.
+
+    Clients keep their HTTP connection pools alive between calls, so nodes reuse
+    connections instead of opening new ones for each LLM call.
+
+    Args:
+        fully_specified_name (str): String in the format 'provider/model'.
+        **kwargs: Additional keyword arguments to pass to init_chat_model.
+    """
+    key = ("chat", fully_specified_name, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+    return _cached_chat_model(key, lambda: load_chat_model(fully_specified_name, **kwargs))
+
+def get_structured_chat_model(fully_specified_name: str, schema, **kwargs):
+    """Return the shared ``with_structured_output(schema)`` wrapper of ``get_chat_model``."""
+    key = ("structured", fully_specified_name, schema, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+    return _cached_chat_model(key, lambda: get_chat_model(fully_specified_name, **kwargs).with_structured_output(schema))
 
 
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
+def normalize_query(query: str) -> str:
+    """Fold case, accents and whitespace so that equivalent questions share a cache key."""
+    decomposed = unicodedata.normalize("NFKD", query)
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", without_accents).strip().casefold()
+
 def clean_sql(sql_str):
     # Remove first line if it starts with ```sql
     lines = sql_str.strip().splitlines()
@@ -61,7 +145,172 @@ def clean_sql(sql_str):
     cleaned = "\n".join(lines)
     return cleaned.strip()
 
-def execute_sql_query(query: str, schema: str, engine) -> str:
+class QueryCancelHandle:
+    """Lets another thread cancel the statement running on a connection.
+
+    ``execute_sql_query`` attaches its connection while the query runs; ``cancel`` sends
+    a cancel request through the DBAPI connection (``cancel`` in psycopg2, ``interrupt``
+    in sqlite3).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dbapi_connection = None
+        self.cancelled = False
+
+    def attach(self, connection) -> None:
+        with self._lock:
+            self._dbapi_connection = connection.connection.dbapi_connection
+            cancelled = self.cancelled
+        if cancelled:
+            self.cancel()
+
+    def detach(self) -> None:
+        with self._lock:
+            self._dbapi_connection = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            dbapi_connection = self._dbapi_connection
+        if dbapi_connection is None:
+            return
+        cancel = getattr(dbapi_connection, "cancel", None) or getattr(dbapi_connection, "interrupt", None)
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception as e:
+                print(f"Error al cancelar la consulta SQL: {e}")
+
+MAX_RESULT_ROWS = 500
+MAX_RESULT_BYTES = 200_000
+FETCH_CHUNK_SIZE = 1000
+
+def format_value(value) -> str:
+    """Format a result cell for the markdown table."""
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    elif isinstance(value, Decimal):
+        return f"{float(value):.2f}"
+    elif isinstance(value, date):
+        return value.isoformat()  # YYYY-MM-DD
+    else:
+        return str(value)
+
+@dataclass
+class SqlResult:
+    """Bounded result of a SQL query.
+
+    ``rows`` holds at most the configured number of rows and bytes; ``row_count`` is the
+    number of rows the query actually returned.
+    """
+
+    columns: List[str] = field(default_factory=list)
+    rows: List[tuple] = field(default_factory=list)
+    row_count: int = 0
+    truncated: bool = False
+    error: Optional[str] = None
+
+    def to_markdown(self) -> str:
+        """Render the preview as a markdown table, or the error / empty-result message."""
+        if self.error is not None:
+            return self.error
+        if not self.rows:
+            return "La consulta no devolvió resultados."
+
+        markdown_table = []
+        markdown_table.append("| " + " | ".join(self.columns) + " |")
+        markdown_table.append("| " + " | ".join(["---"] * len(self.columns)) + " |")
+
+        for row in self.rows:
+            formatted_row = [format_value(cell) for cell in row]
+            markdown_table.append("| " + " | ".join(formatted_row) + " |")
+
+        if self.truncated:
+            markdown_table.append("")
+            markdown_table.append(f"(Se muestran {len(self.rows)} de {self.row_count} filas.)")
+        return "\n".join(markdown_table)
+
+def fetch_sql_result(connection, sql: str, max_rows: int = MAX_RESULT_ROWS, max_bytes: int = MAX_RESULT_BYTES,
+                     chunk_size: int = FETCH_CHUNK_SIZE) -> SqlResult:
+    """Run ``sql`` with a server-side cursor, keeping a bounded preview of the rows.
+
+    Rows are streamed in chunks of ``chunk_size``. Only the first rows that fit in
+    ``max_rows`` and ``max_bytes`` (of formatted cell text) are kept; the rest are only
+    counted, so memory stays bounded whatever the query returns.
+    """
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql))
+    sql_result = SqlResult(columns=list(result.keys()))
+    preview_bytes = 0
+    for partition in result.partitions(chunk_size):
+        for row in partition:
+            sql_result.row_count += 1
+            if sql_result.truncated:
+                continue
+            row_bytes = sum(len(format_value(cell)) for cell in row)
+            if len(sql_result.rows) >= max_rows or preview_bytes + row_bytes > max_bytes:
+                sql_result.truncated = True
+                continue
+            sql_result.rows.append(tuple(row))
+            preview_bytes += row_bytes
+    return sql_result
+
+@contextmanager
+def query_connection(engine, schema: Optional[str] = None, statement_timeout: Optional[float] = None,
+                     read_only: bool = False):
+    """Open a connection for running generated SQL.
+
+    On PostgreSQL the transaction can be made read-only and given a ``statement_timeout``
+    (seconds), so the server stops runaway queries even if the client goes away. Both
+    settings end with the transaction.
+    """
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            if read_only:
+                connection.execute(text("SET TRANSACTION READ ONLY"))
+            if statement_timeout:
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(statement_timeout * 1000)}"))
+        if schema:
+            connection.execute(text(f"SET search_path TO {schema}"))
+        yield connection
+
+def run_sql_query(query: str, schema: str, engine, cancel_handle: Optional[QueryCancelHandle] = None,
+                  max_rows: int = MAX_RESULT_ROWS, max_bytes: int = MAX_RESULT_BYTES,
+                  statement_timeout: Optional[float] = None, read_only: bool = False) -> SqlResult:
+    """
+    Execute a SQL query on the database and return a bounded ``SqlResult``.
+
+    Args:
+        query (str): The SQL query to execute.
+        schema (str): Schema to set before execution.
+        engine: SQLAlchemy engine.
+        cancel_handle (Optional[QueryCancelHandle]): Handle other threads can use to cancel the query.
+        max_rows (int): Maximum number of rows kept in the result.
+        max_bytes (int): Maximum size of the kept rows, as formatted text.
+        statement_timeout (Optional[float]): Server-side timeout in seconds (PostgreSQL).
+        read_only (bool): Run the query in a read-only transaction (PostgreSQL).
+
+    Returns:
+        SqlResult: The result preview and true row count, or the error message.
+    """
+    cleaned_sql = clean_sql(query)
+    try:
+        with query_connection(engine, schema, statement_timeout, read_only) as connection:
+            if cancel_handle is not None:
+                cancel_handle.attach(connection)
+            try:
+                return fetch_sql_result(connection, cleaned_sql, max_rows=max_rows, max_bytes=max_bytes)
+            finally:
+                if cancel_handle is not None:
+                    cancel_handle.detach()
+    except SQLAlchemyError as e:
+        print(f"Error al ejecutar la consulta SQL: {e}")
+        
+        return SqlResult(error="ERROR SQL")
+    except Exception as e:
+        return SqlResult(error=f"Ocurrió un error inesperado: {e}")
+
+def execute_sql_query(query: str, schema: str, engine, cancel_handle: Optional[QueryCancelHandle] = None) -> str:
     """
     Execute a SQL query on the database and return results formatted as a Markdown table.
     
@@ -69,57 +318,94 @@ def execute_sql_query(query: str, schema: str, engine) -> str:
         query (str): The SQL query to execute.
         schema (str): Schema to set before execution.
         engine: SQLAlchemy engine.
+        cancel_handle (Optional[QueryCancelHandle]): Handle other threads can use to cancel the query.
         
     Returns:
         str: Markdown-formatted results or a custom message if no results.
     """
-    cleaned_sql = clean_sql(query)
+    return run_sql_query(query, schema, engine, cancel_handle).to_markdown()
+
+
+def probe_data_version(engine, query: Optional[str], fallback_query: Optional[str] = None):
+    """Run the data version query and return its single value.
+
+    Without a query the version is a constant, so cached results only expire by TTL.
+
+    If the query fails (e.g. the rollup tables do not exist yet) and ``fallback_query`` is set,
+    the fallback is run instead so the result cache keeps being invalidated.
+    """
+    if not query:
+        return ""
     try:
         with engine.connect() as connection:
-            if schema:
-                connection.execute(text(f"SET search_path TO {schema}"))
-            result = connection.execute(text(cleaned_sql))
-            rows = result.fetchall()
-            columns = result.keys()
+            return connection.execute(text(query)).scalar()
+    except SQLAlchemyError as e:
+        if not fallback_query:
+            raise
+        print(f"No se pudo consultar la versión de los datos, se usa la consulta alternativa: {e}")
+    with engine.connect() as connection:
+        return connection.execute(text(fallback_query)).scalar()
 
-            if not rows:
-                return "La consulta no devolvió resultados."
 
-            # Build markdown table
+async def execute_sql_query_async(
+    query: str,
+    schema: str,
+    engine,
+    executor: Optional[Executor] = None,
+    timeout: Optional[float] = None,
+    max_rows: int = MAX_RESULT_ROWS,
+    max_bytes: int = MAX_RESULT_BYTES,
+    read_only: bool = False,
+) -> SqlResult:
+    """
+    Run ``run_sql_query`` in ``executor`` without blocking the event loop.
 
+    If the query exceeds ``timeout`` seconds, or the awaiting task is cancelled (for
+    example because the client disconnected), the statement is cancelled on the server.
+    ``timeout`` is also set as the server-side ``statement_timeout``.
 
-        def format_value(value):
-            if isinstance(value, float):
-                return f"{value:.2f}"
-            elif isinstance(value, Decimal):
-                return f"{float(value):.2f}"
-            elif isinstance(value, date):
-                return value.isoformat()  # YYYY-MM-DD
-            else:
-                return str(value)
+    Args:
+        query (str): The SQL query to execute.
+        schema (str): Schema to set before execution.
+        engine: SQLAlchemy engine.
+        executor (Optional[Executor]): Executor for the blocking call; the loop default if None.
+        timeout (Optional[float]): Seconds before the query is cancelled.
+        max_rows (int): Maximum number of rows kept in the result.
+        max_bytes (int): Maximum size of the kept rows, as formatted text.
+        read_only (bool): Run the query in a read-only transaction (PostgreSQL).
 
-        markdown_table = []
-        markdown_table.append("| " + " | ".join(columns) + " |")
-        markdown_table.append("| " + " | ".join(["---"] * len(columns)) + " |")
+    Returns:
+        SqlResult: Same as ``run_sql_query``; the "ERROR SQL" error on timeout.
+    """
+    loop = asyncio.get_running_loop()
+    cancel_handle = QueryCancelHandle()
+    future = loop.run_in_executor(
+        executor, partial(run_sql_query, query, schema, engine, cancel_handle, max_rows=max_rows, max_bytes=max_bytes,
+                          statement_timeout=timeout, read_only=read_only)
+    )
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        cancel_handle.cancel()
+        print(f"Consulta SQL cancelada tras {timeout}s")
+        return SqlResult(error="ERROR SQL")
+    except asyncio.CancelledError:
+        cancel_handle.cancel()
+        raise
 
-        for row in rows:
-            formatted_row = [format_value(cell) for cell in row]
-            markdown_table.append("| " + " | ".join(formatted_row) + " |")
 
-        markdown_result = "\n".join(markdown_table)
-        return markdown_result
-    except SQLAlchemyError as e:
-        print(f"Error al ejecutar la consulta SQL: {e}")
-        
-        return "ERROR SQL"
-    except Exception as e:
-        return f"Ocurrió un error inesperado: {e}"
+def search_in_columns(vectorstore: dict, model: "SentenceTransformer", columns: list[str], query: str,
+                      top_k: int = 3) -> dict[str, list[str]]:
+    """Return the ``top_k`` closest values of each column, encoding ``query`` once."""
+    from agent import ann_index
 
+    query_embedding = model.encode([query], convert_to_numpy=True)
+    matches = {}
+    for column in columns:
+        _, ids = ann_index.search(vectorstore[column], query_embedding, top_k)
+        matches[column] = [vectorstore[column]["values"][i] for i in ids]
+    return matches
 
-def search_in_column(vectorstore: dict, model: SentenceTransformer, column: str, query: str, top_k: int = 3) -> list[str]:
-    query_embedding = model.encode([query])
-    index = vectorstore[column]["index"]
-    values = vectorstore[column]["values"]
 
-    D, I = index.search(np.array(query_embedding), top_k)
-    return [values[i] for i in I[0]]
\ No newline at end of file
+def search_in_column(vectorstore: dict, model: "SentenceTransformer", column: str, query: str, top_k: int = 3) -> list[str]:
+    return search_in_columns(vectorstore, model, [column], query, top_k)[column]
@@ -0,0 +1,326 @@
+"""Versioned on-disk format for the name and SQL vectorstores.
+
+A vectorstore directory contains:
+
+    manifest.json        format version, embedding model, dimension, build hash and entries
+    <version>/           files of the build the manifest points to (``data_dir``):
+        <entry>.faiss    FAISS index, opened with mmap so workers share the page cache
+        <entry>.values   UTF-8 string table with every value concatenated
+        <entry>.offsets  uint64 offsets into the string table (one more than the values)
+
+Each save writes a new version directory and then replaces ``manifest.json`` with
+``os.replace``, so the store is switched atomically and never missing. Writers hold a
+lock on ``.lock`` in the directory. Stores written before versioning keep their files
+next to the manifest (no ``data_dir``) and are still readable.
+
+Single-index stores (``{"index", "values"}``, as built by ``build_df_values_vectorstore``)
+are written as one entry named ``default``; per-column stores (``{column: {"index",
+"values"}}``) get one entry per column. Non-string values are stored as JSON, as are
+the ``None`` tombstones left by incremental updates (see ``agent.ann_index``).
+
+Functions:
+    save_vectorstore: Write a vectorstore dict in the native format.
+    update_metadata: Change the manifest metadata of a native vectorstore in place.
+    load_vectorstore: Open a native vectorstore, memory-mapping indexes and values.
+    read_manifest: Read the manifest of a native vectorstore.
+    load_pickle_vectorstore: Load a legacy ``.pkl`` vectorstore.
+    convert_pickle_vectorstore: Convert a legacy ``.pkl`` vectorstore.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import faiss
+import numpy as np
+
+from agent.ann_index import apply_search_params
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized
+    fcntl = None
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+DEFAULT_ENTRY = "default"
+VERSION_PREFIX = "v-"
+
+PathLike = Union[str, Path]
+
+
+class MappedValues(Sequence):
+    """Read-only sequence of values backed by a memory-mapped string table."""
+
+    def __init__(self, values_path: PathLike, offsets_path: PathLike, encoding: str = "text"):
+        self._offsets = np.memmap(offsets_path, dtype=np.uint64, mode="r")
+        if os.path.getsize(values_path):
+            self._data = np.memmap(values_path, dtype=np.uint8, mode="r")
+        else:
+            self._data = np.empty(0, dtype=np.uint8)
+        self._encoding = encoding
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("vectorstore value index out of range")
+        raw = self._data[int(self._offsets[i]):int(self._offsets[i + 1])].tobytes().decode("utf-8")
+        if self._encoding == "text":
+            return raw
+        value = json.loads(raw)
+        # Records such as (question, sql) pairs were tuples before serialization.
+        return tuple(value) if isinstance(value, list) else value
+
+
+def is_native_vectorstore(path: PathLike) -> bool:
+    """Return True if ``path`` is a directory written by ``save_vectorstore``."""
+    return (Path(path) / MANIFEST_FILE).is_file()
+
+
+def read_manifest(path: PathLike) -> Dict[str, Any]:
+    """Read and check the manifest of a native vectorstore."""
+    with open(Path(path) / MANIFEST_FILE, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported vectorstore format {manifest.get('format_version')} at {path}; expected {FORMAT_VERSION}"
+        )
+    return manifest
+
+
+def _write_values(values, values_path: Path, offsets_path: Path) -> str:
+    encoding = "text" if all(isinstance(v, str) for v in values) else "json"
+    offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+    with open(values_path, "wb") as f:
+        position = 0
+        for i, value in enumerate(values):
+            raw = (value if encoding == "text" else json.dumps(value, ensure_ascii=False)).encode("utf-8")
+            f.write(raw)
+            position += len(raw)
+            offsets[i + 1] = position
+    offsets.tofile(offsets_path)
+    return encoding
+
+
+def _hash_files(digest, *paths: Path) -> None:
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+
+@contextmanager
+def _write_lock(path: Path):
+    """Hold an exclusive lock on ``path/.lock`` so concurrent writers do not interleave."""
+    with open(path / LOCK_FILE, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _remove_stale_versions(path: Path, keep: set, legacy_manifest: Optional[Dict[str, Any]]) -> None:
+    """Delete version directories not in ``keep`` and the files of a pre-versioning store.
+
+    The previous version is kept so readers that just read the old manifest can still open it.
+    """
+    for child in path.iterdir():
+        if child.is_dir() and child.name.startswith(VERSION_PREFIX) and child.name not in keep:
+            shutil.rmtree(child, ignore_errors=True)
+    if legacy_manifest is not None:
+        for entry in legacy_manifest.get("entries", {}).values():
+            for key in ("index", "values", "offsets"):
+                try:
+                    (path / entry[key]).unlink()
+                except (KeyError, OSError):
+                    pass
+
+
+def _write_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+    """Replace ``path/manifest.json`` atomically."""
+    fd, tmp_manifest = tempfile.mkstemp(prefix=f".{MANIFEST_FILE}-", dir=path)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_manifest, 0o644)
+        os.replace(tmp_manifest, path / MANIFEST_FILE)
+    except Exception:
+        if os.path.exists(tmp_manifest):
+            os.unlink(tmp_manifest)
+        raise
+
+
+def save_vectorstore(
+    vectorstore: dict,
+    path: PathLike,
+    embedding_model: str,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Write ``vectorstore`` to the directory ``path`` and return its manifest.
+
+    The files go to a new version directory inside ``path``; the manifest pointing to it
+    then replaces the current one atomically, so readers see either the old or the new
+    store. Concurrent writers are serialized with a file lock.
+    """
+    path = Path(path)
+    layout = "single" if "index" in vectorstore else "columns"
+    entries = {DEFAULT_ENTRY: vectorstore} if layout == "single" else vectorstore
+
+    path.mkdir(parents=True, exist_ok=True)
+    with _write_lock(path):
+        previous = read_manifest(path) if is_native_vectorstore(path) else None
+        data_dir = Path(tempfile.mkdtemp(prefix=VERSION_PREFIX, dir=path))
+        os.chmod(data_dir, 0o755)
+        try:
+            digest = hashlib.sha256()
+            manifest_entries = {}
+            dimension = None
+            for name, entry in entries.items():
+                index_path = data_dir / f"{name}.faiss"
+                values_path = data_dir / f"{name}.values"
+                offsets_path = data_dir / f"{name}.offsets"
+
+                faiss.write_index(entry["index"], str(index_path))
+                encoding = _write_values(list(entry["values"]), values_path, offsets_path)
+                _hash_files(digest, index_path, values_path)
+
+                dimension = entry["index"].d
+                manifest_entries[name] = {
+                    "index": index_path.name,
+                    "values": values_path.name,
+                    "offsets": offsets_path.name,
+                    "encoding": encoding,
+                    "count": int(entry["index"].ntotal),
+                    "dimension": int(entry["index"].d),
+                    "build_params": entry.get("build_params", {}),
+                    "tombstones": int(entry.get("tombstones", 0)),
+                }
+
+            manifest = {
+                "format_version": FORMAT_VERSION,
+                "layout": layout,
+                "embedding_model": embedding_model,
+                "dimension": dimension,
+                "build_hash": digest.hexdigest(),
+                "data_dir": data_dir.name,
+                "entries": manifest_entries,
+                "metadata": metadata or {},
+            }
+            _write_manifest(path, manifest)
+        except Exception:
+            shutil.rmtree(data_dir, ignore_errors=True)
+            raise
+
+        keep = {data_dir.name}
+        if previous is not None and previous.get("data_dir"):
+            keep.add(previous["data_dir"])
+        legacy = previous if previous is not None and not previous.get("data_dir") else None
+        _remove_stale_versions(path, keep, legacy)
+    return manifest
+
+
+def update_metadata(path: PathLike, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge ``metadata`` into the manifest at ``path`` without rewriting the store.
+
+    The build hash and files are unchanged, so readers do not need to reload.
+    """
+    path = Path(path)
+    with _write_lock(path):
+        manifest = read_manifest(path)
+        manifest["metadata"] = {**manifest.get("metadata", {}), **metadata}
+        _write_manifest(path, manifest)
+    return manifest
+
+
+def _read_index(index_path: Path, mmap: bool):
+    if not mmap:
+        return faiss.read_index(str(index_path))
+    # IO_FLAG_MMAP_IFC maps flat codes in place; older FAISS builds only have IO_FLAG_MMAP.
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(str(index_path), flag | faiss.IO_FLAG_READ_ONLY)
+
+
+def load_vectorstore(path: PathLike, mmap: bool = True) -> dict:
+    """Open the native vectorstore at ``path``.
+
+    Returns a dict with the same shape as the legacy pickles. With ``mmap`` the indexes
+    and values are memory-mapped, so they are read-only and shared across processes.
+    """
+    manifest = read_manifest(path)
+    path = Path(path) / manifest.get("data_dir", "")
+    entries = {}
+    for name, entry in manifest["entries"].items():
+        entries[name] = {
+            "index": apply_search_params(_read_index(path / entry["index"], mmap), entry.get("build_params")),
+            "values": MappedValues(path / entry["values"], path / entry["offsets"], entry["encoding"]),
+            "build_params": entry.get("build_params", {}),
+            "tombstones": entry.get("tombstones", 0),
+        }
+    if manifest["layout"] == "single":
+        return entries[DEFAULT_ENTRY]
+    return entries
+
+
+class _PortableUnpickler(pickle.Unpickler):
+    """Unpickler that resolves FAISS classes saved by a build with other SIMD extensions.
+
+    Pickles reference the exact extension module (``faiss.swigfaiss_avx2``...) of the
+    machine that wrote them, which is not importable everywhere.
+    """
+
+    def find_class(self, module, name):
+        if module.startswith("faiss.swigfaiss"):
+            module = "faiss"
+        return super().find_class(module, name)
+
+
+def load_pickle_vectorstore(pkl_path: PathLike) -> dict:
+    """Load a legacy pickled vectorstore."""
+    with open(pkl_path, "rb") as f:
+        return _PortableUnpickler(f).load()
+
+
+def convert_pickle_vectorstore(pkl_path: PathLike, out_path: PathLike, embedding_model: str) -> Dict[str, Any]:
+    """Convert a legacy pickled vectorstore to the native format."""
+    vectorstore = load_pickle_vectorstore(pkl_path)
+    return save_vectorstore(vectorstore, out_path, embedding_model, metadata={"converted_from": Path(pkl_path).name})
+
+
+def main(argv: Optional[list] = None) -> None:
+    """Convert ``.pkl`` vectorstores given on the command line to the native format."""
+    import argparse
+
+    from agent.configuration import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Convert pickled vectorstores to the native format.")
+    parser.add_argument("pickles", nargs="+", help="Paths to .pkl vectorstores; each is written next to it without the suffix.")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    args = parser.parse_args(argv)
+
+    for pkl_path in args.pickles:
+        out_path = Path(pkl_path).with_suffix("")
+        manifest = convert_pickle_vectorstore(pkl_path, out_path, args.embedding_model)
+        print(f"{pkl_path} -> {out_path} ({manifest['build_hash'][:12]})")
+
+
+if __name__ == "__main__":
+    main()
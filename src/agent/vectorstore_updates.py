@@ -0,0 +1,471 @@
+"""Apply building value changes to the name vectorstore without rebuilding it.
+
+``.sql`` installs a trigger that logs every insert, update or delete of the ``name`` and
+``type`` of ``smart_buildings.building`` in ``smart_buildings.building_value_changes``
+and sends a ``building_value_changes`` notification. The updater reads the log rows past
+its watermark (the last change id applied, kept in the vectorstore manifest), checks
+which of the old and new values are still in the table, embeds only the new ones and
+adds or removes them in a copy of the live index (see ``ann_index.writable_copy``). The
+copy is swapped into ``RESOURCES``, so requests already running keep the version they
+started with, and saved to disk. Before each update the updater compares the build hash
+of the manifest with the last one it saw and reloads the store if another process saved
+a newer build.
+
+Only one process should write: run the updater on its own. Serving processes never
+write; ``agent.warmup`` starts a ``VectorstoreReloader`` in each of them that loads
+every new build the updater saves.
+
+    python -m agent.vectorstore_updates              # apply the pending changes once
+    python -m agent.vectorstore_updates --listen     # keep applying them as they arrive
+
+Functions:
+    fetch_value_changes: Read the logged value changes past a watermark.
+    existing_values: Return which of some values are still present in a column.
+    apply_value_delta: Add and remove values in a copy of a vectorstore entry.
+    start_reloader: Start the reloader thread of a vectorstore once per process.
+
+Classes:
+    ValueDelta: Values to add to and remove from one column index.
+    VectorstoreUpdater: Keep the name vectorstore of a process in sync with the database.
+    VectorstoreReloader: Load the builds saved by the updater into a serving process.
+"""
+
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+
+from agent import ann_index
+from agent.configuration import EMBEDDING_MODEL_NAME, RESOURCES, VECTORSTORE_PATH, ResourceRegistry, VectorStoreHandler
+
+BUILDING_TABLE = "smart_buildings.building"
+VALUE_CHANGES_TABLE = "smart_buildings.building_value_changes"
+VALUE_CHANGES_CHANNEL = "building_value_changes"
+NAME_VECTORSTORE = "name_vectorstore"
+WATERMARK_KEY = "change_log_id"
+_IN_BATCH = 1000
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+@dataclass
+class ValueDelta:
+    """Values to add to and remove from one column index."""
+
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+def fetch_value_changes(connection: Connection, since_id: int,
+                        changes_table: str = VALUE_CHANGES_TABLE) -> Tuple[Dict[str, Tuple[List[str], List[str]]], int]:
+    """Read the value changes logged after ``since_id``.
+
+    Args:
+        connection (Connection): Connection to the energy database.
+        since_id (int): Watermark; only log rows with a larger id are read.
+        changes_table (str): Table written by the ``log_building_value_changes`` trigger.
+
+    Returns:
+        Tuple[Dict[str, Tuple[List[str], List[str]]], int]: Per column, the old values
+        (candidates for removal) and the new values (candidates for addition), and the
+        id of the last row read.
+    """
+    rows = connection.execute(
+        text(f"SELECT id, column_name, old_value, new_value FROM {changes_table} WHERE id > :since ORDER BY id"),
+        {"since": since_id},
+    ).fetchall()
+    candidates: Dict[str, Tuple[Dict[str, None], Dict[str, None]]] = {}
+    last_id = since_id
+    for change_id, column, old_value, new_value in rows:
+        old_values, new_values = candidates.setdefault(column, ({}, {}))
+        if old_value is not None:
+            old_values[old_value] = None
+        if new_value is not None:
+            new_values[new_value] = None
+        last_id = change_id
+    return {column: (list(old), list(new)) for column, (old, new) in candidates.items()}, last_id
+
+
+def existing_values(connection: Connection, table: str, column: str, values: Iterable[str]) -> Set[str]:
+    """Return the subset of ``values`` that some row of ``table`` still has in ``column``."""
+    values = list(dict.fromkeys(values))
+    query = text(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IN :values").bindparams(
+        bindparam("values", expanding=True)
+    )
+    found = set()
+    for start in range(0, len(values), _IN_BATCH):
+        found.update(str(row[0]) for row in connection.execute(query, {"values": values[start:start + _IN_BATCH]}))
+    return found
+
+
+def apply_value_delta(entry: dict, added: Iterable[str], removed: Iterable[str],
+                      encode: Callable[[List[str]], "np.ndarray"]) -> dict:
+    """Return a copy of the vectorstore ``entry`` with ``added`` and without ``removed``.
+
+    Value positions never change, so ids already handed out stay valid: removed values
+    become ``None`` and new ones are appended. ``entry`` itself is not modified.
+
+    Args:
+        entry (dict): ``{"index", "values", "build_params"}`` entry of one column.
+        added (Iterable[str]): Values to add, as stored; those already present or blank
+            are skipped. Only their stripped text is embedded.
+        removed (Iterable[str]): Values to remove; those not present are skipped.
+        encode (Callable): Returns the embeddings of a list of values.
+
+    Returns:
+        dict: The updated entry, or ``entry`` if nothing changes.
+    """
+    values = list(entry["values"])
+    positions = {value: i for i, value in enumerate(values) if value is not None}
+    removed_ids = [positions[value] for value in dict.fromkeys(removed) if value in positions]
+    added = [value for value in dict.fromkeys(added) if value.strip() and value not in positions]
+    if not removed_ids and not added:
+        return entry
+
+    build_params = entry.get("build_params") or {}
+    index = ann_index.writable_copy(entry["index"], build_params)
+    tombstones = entry.get("tombstones", 0)
+    if removed_ids:
+        if not ann_index.remove_vectors(index, removed_ids):
+            tombstones += len(removed_ids)
+        for i in removed_ids:
+            values[i] = None
+    if added:
+        ann_index.add_vectors(index, encode([value.strip() for value in added]), range(len(values), len(values) + len(added)), build_params)
+        values.extend(added)
+    return {"index": index, "values": values, "build_params": build_params, "tombstones": tombstones}
+
+
+def _close_quietly(raw_connection) -> None:
+    try:
+        raw_connection.close()
+    except Exception:
+        pass
+
+
+class VectorstoreUpdater:
+    """Keep the name vectorstore served by ``registry`` in sync with the building table.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the energy database.
+        vectorstore_path (str): Directory of the vectorstores, as in ``Configuration``.
+        registry (ResourceRegistry): Registry whose vectorstores are updated.
+        encode (Optional[Callable]): Returns the embeddings of a list of values; the
+            shared embedding model by default.
+        persist (bool): Save every update to ``<vectorstore_path>/name_vectorstore``.
+        values_table (str): Table whose columns the vectorstore indexes.
+        changes_table (str): Change log written by the trigger of ``.sql``.
+    """
+
+    def __init__(self, engine: Engine, vectorstore_path: str = VECTORSTORE_PATH,
+                 registry: ResourceRegistry = RESOURCES, encode: Optional[Callable] = None,
+                 persist: bool = True, values_table: str = BUILDING_TABLE,
+                 changes_table: str = VALUE_CHANGES_TABLE):
+        self.engine = engine
+        self.vectorstore_path = vectorstore_path
+        self.registry = registry
+        self.persist = persist
+        self.values_table = values_table
+        self.changes_table = changes_table
+        self._encode = encode
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.watermark = int(self._manifest().get("metadata", {}).get(WATERMARK_KEY, 0))
+        # Unknown until the first update, which reloads the store from disk, so that
+        # a registry entry loaded before the manifest was read is never updated.
+        self.build_hash: Optional[str] = None
+
+    @property
+    def native_path(self) -> str:
+        return os.path.join(self.vectorstore_path, NAME_VECTORSTORE)
+
+    def _manifest(self) -> dict:
+        from agent import vectorstore_io
+
+        if not vectorstore_io.is_native_vectorstore(self.native_path):
+            return {}
+        return vectorstore_io.read_manifest(self.native_path)
+
+    def _follow_disk(self) -> None:
+        """Reload the vectorstores if the saved build is not the one being updated."""
+        manifest = self._manifest()
+        build_hash = manifest.get("build_hash")
+        if build_hash is None or build_hash == self.build_hash:
+            return
+        self.registry.reload_vectorstores(self.vectorstore_path)
+        self.build_hash = build_hash
+        self.watermark = int(manifest.get("metadata", {}).get(WATERMARK_KEY, 0))
+
+    def encode(self, values: List[str]) -> "np.ndarray":
+        if self._encode is not None:
+            return self._encode(values)
+        from agent.embeddings import get_embedding_model
+
+        return get_embedding_model().encode(values, convert_to_numpy=True)
+
+    def update(self) -> Dict[str, ValueDelta]:
+        """Apply the changes logged since the watermark and swap the result in.
+
+        Returns:
+            Dict[str, ValueDelta]: The values added and removed per indexed column.
+        """
+        with self._lock:
+            self._follow_disk()
+            handler = self.registry.get_vectorstore_handler(self.vectorstore_path)
+            deltas = {}
+            with self.engine.connect() as connection:
+                candidates, last_id = fetch_value_changes(connection, self.watermark, self.changes_table)
+                for column, (old_values, new_values) in candidates.items():
+                    if column not in handler.name_vectorstore:
+                        continue
+                    present = existing_values(connection, self.values_table, column, old_values + new_values)
+                    deltas[column] = ValueDelta(
+                        added=[value for value in new_values if value in present],
+                        removed=[value for value in old_values if value not in present],
+                    )
+
+            name_vectorstore = dict(handler.name_vectorstore)
+            changed = {}
+            for column, delta in deltas.items():
+                entry = name_vectorstore[column]
+                name_vectorstore[column] = apply_value_delta(entry, delta.added, delta.removed, self.encode)
+                if name_vectorstore[column] is not entry:
+                    changed[column] = delta
+
+            if changed:
+                self.registry.swap_vectorstores(
+                    self.vectorstore_path,
+                    VectorStoreHandler.from_vectorstores(name_vectorstore, handler.sql_vectorstore),
+                )
+                if self.persist:
+                    self._save(name_vectorstore, last_id)
+            elif self.persist and last_id != self.watermark and self.build_hash is not None:
+                # Changes that leave the index as it is (other columns, values already
+                # gone) still advance the saved watermark, so they are not read again.
+                from agent import vectorstore_io
+
+                vectorstore_io.update_metadata(self.native_path, {WATERMARK_KEY: last_id})
+            self.watermark = last_id
+            return changed
+
+    def _save(self, name_vectorstore: dict, watermark: int) -> None:
+        from agent import vectorstore_io
+
+        metadata = {**self._manifest().get("metadata", {}), WATERMARK_KEY: watermark}
+        manifest = vectorstore_io.save_vectorstore(name_vectorstore, self.native_path, EMBEDDING_MODEL_NAME,
+                                                   metadata=metadata)
+        self.build_hash = manifest["build_hash"]
+
+    def _update_logging_errors(self) -> None:
+        try:
+            deltas = self.update()
+        except Exception as e:
+            print(f"Error al actualizar el vectorstore de nombres: {e}")
+            return
+        for column, delta in deltas.items():
+            print(f"{column}: {len(delta.added)} valores añadidos, {len(delta.removed)} eliminados")
+
+    def _listen_connection(self):
+        """Open a raw connection subscribed to the change notifications."""
+        raw_connection = self.engine.raw_connection()
+        try:
+            driver_connection = raw_connection.driver_connection
+            driver_connection.autocommit = True
+            with driver_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {VALUE_CHANGES_CHANNEL}")
+        except Exception:
+            _close_quietly(raw_connection)
+            raise
+        return raw_connection, driver_connection
+
+    def listen(self, poll_interval: float = 60.0, max_backoff: float = 60.0) -> None:
+        """Apply changes when a notification arrives, and every ``poll_interval`` seconds.
+
+        The periodic update covers notifications missed while disconnected. On databases
+        without LISTEN/NOTIFY (anything but PostgreSQL) it is the only one. If the
+        listening connection cannot be opened or drops, it is reopened with exponential
+        backoff (up to ``max_backoff`` seconds) while the periodic update goes on, and the
+        changes are read once it is back. Runs until ``stop`` is called.
+        """
+        listens = self.engine.dialect.name == "postgresql"
+        raw_connection = driver_connection = None
+        backoff, reconnect_at = 1.0, 0.0
+        next_poll = 0.0
+        notified = False
+        try:
+            while not self._stop.is_set():
+                if listens and raw_connection is None and time.monotonic() >= reconnect_at:
+                    try:
+                        raw_connection, driver_connection = self._listen_connection()
+                        backoff = 1.0
+                        notified = True
+                    except Exception as e:
+                        print(f"No se pudo escuchar {VALUE_CHANGES_CHANNEL}, reintento en {backoff:.0f}s: {e}")
+                        reconnect_at = time.monotonic() + backoff
+                        backoff = min(2 * backoff, max_backoff)
+                if notified or time.monotonic() >= next_poll:
+                    self._update_logging_errors()
+                    next_poll = time.monotonic() + poll_interval
+                    notified = False
+                # Short waits so that stop() takes effect within a second.
+                timeout = min(1.0, max(0.0, next_poll - time.monotonic()))
+                if raw_connection is None:
+                    self._stop.wait(timeout)
+                    continue
+                try:
+                    notified = bool(select.select([driver_connection], [], [], timeout)[0])
+                    if notified:
+                        driver_connection.poll()
+                        driver_connection.notifies.clear()
+                except Exception as e:
+                    print(f"Se perdió la conexión de {VALUE_CHANGES_CHANNEL}, reintento en {backoff:.0f}s: {e}")
+                    _close_quietly(raw_connection)
+                    raw_connection = driver_connection = None
+                    notified = False
+                    reconnect_at = time.monotonic() + backoff
+                    backoff = min(2 * backoff, max_backoff)
+        finally:
+            if raw_connection is not None:
+                _close_quietly(raw_connection)
+
+    def start(self, poll_interval: float = 60.0) -> threading.Thread:
+        """Run ``listen`` in a daemon thread of this process."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.listen, args=(poll_interval,),
+                                        name="vectorstore-updater", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop ``listen`` and wait for the thread started by ``start``."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class VectorstoreReloader:
+    """Reload the vectorstores of a serving process when a new build is saved.
+
+    Only reads the manifest of ``<vectorstore_path>/name_vectorstore``; the builds come
+    from the updater process or from ``agent.build_vectorstores``.
+
+    Args:
+        vectorstore_path (str): Directory of the vectorstores, as in ``Configuration``.
+        registry (ResourceRegistry): Registry whose vectorstores are reloaded.
+    """
+
+    def __init__(self, vectorstore_path: str = VECTORSTORE_PATH, registry: ResourceRegistry = RESOURCES):
+        self.vectorstore_path = vectorstore_path
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.build_hash = self._saved_build_hash()
+
+    def _saved_build_hash(self) -> Optional[str]:
+        from agent import vectorstore_io
+
+        native_path = os.path.join(self.vectorstore_path, NAME_VECTORSTORE)
+        if not vectorstore_io.is_native_vectorstore(native_path):
+            return None
+        return vectorstore_io.read_manifest(native_path).get("build_hash")
+
+    def check(self) -> bool:
+        """Reload the vectorstores if the saved build changed; return True if it did."""
+        build_hash = self._saved_build_hash()
+        if build_hash is None or build_hash == self.build_hash:
+            return False
+        self.registry.reload_vectorstores(self.vectorstore_path)
+        self.build_hash = build_hash
+        return True
+
+    def run(self, interval: float = 60.0) -> None:
+        """Call ``check`` every ``interval`` seconds until ``stop`` is called."""
+        while not self._stop.wait(interval):
+            try:
+                if self.check():
+                    print(f"Vectorstores recargados (build {self.build_hash[:12]})")
+            except Exception as e:
+                print(f"Error al recargar los vectorstores: {e}")
+
+    def start(self, interval: float = 60.0) -> threading.Thread:
+        """Run ``run`` in a daemon thread of this process."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(interval,),
+                                        name="vectorstore-reloader", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop ``run`` and wait for the thread started by ``start``."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_reloaders: Dict[str, VectorstoreReloader] = {}
+_reloaders_lock = threading.Lock()
+
+
+def start_reloader(vectorstore_path: str = VECTORSTORE_PATH, interval: float = 60.0) -> VectorstoreReloader:
+    """Start the reloader thread for ``vectorstore_path`` unless this process already runs one.
+
+    Args:
+        vectorstore_path (str): Directory of the vectorstores served by ``RESOURCES``.
+        interval (float): Seconds between checks of the manifest.
+
+    Returns:
+        VectorstoreReloader: The running reloader.
+    """
+    with _reloaders_lock:
+        reloader = _reloaders.get(vectorstore_path)
+        if reloader is None or reloader._thread is None or not reloader._thread.is_alive():
+            reloader = VectorstoreReloader(vectorstore_path)
+            reloader.start(interval)
+            _reloaders[vectorstore_path] = reloader
+        return reloader
+
+
+def main(argv: Optional[list] = None) -> None:
+    """Apply the logged building value changes to the name vectorstore from the command line."""
+    import argparse
+
+    from agent.configuration import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Update the name vectorstore with the building value changes.")
+    parser.add_argument("--vectorstore-path", default=VECTORSTORE_PATH)
+    parser.add_argument("--listen", action="store_true", help="Keep running and apply changes as they are notified.")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between polls while listening.")
+    args = parser.parse_args(argv)
+
+    if DATABASE_URL is None:
+        raise ValueError("DB_USER environment variable is required.")
+    updater = VectorstoreUpdater(RESOURCES.get_db_handler(DATABASE_URL).engine, args.vectorstore_path)
+    try:
+        if args.listen:
+            updater.listen(args.interval)
+            return
+        start = time.perf_counter()
+        deltas = updater.update()
+        for column, delta in deltas.items():
+            print(f"{column}: {len(delta.added)} valores añadidos, {len(delta.removed)} eliminados")
+        print(f"Watermark {updater.watermark}, {time.perf_counter() - start:.1f}s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        RESOURCES.clear()
+
+
+if __name__ == "__main__":
+    main()
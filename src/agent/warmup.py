@@ -0,0 +1,57 @@
+"""Readiness warm-up for servers running the agent.
+
+Importing the agent no longer loads the embedding model, the vectorstores or the
+database engine. ``warmup`` loads them and exercises each once, so a server can
+report itself ready only after the first request would be fast. It also starts the
+thread that loads new vectorstore builds saved by the updater process
+(``agent.vectorstore_updates``) unless ``vectorstore_reload_interval`` is None.
+"""
+
+import time
+from typing import Dict, Optional
+
+from langchain_core.runnables import RunnableConfig
+from sqlalchemy import text
+
+from agent.configuration import Configuration
+from agent.embeddings import get_embedding_model
+from agent.schema_pruning import get_schema_index
+from agent.vectorstore_updates import start_reloader
+
+
+def warmup(config: Optional[RunnableConfig] = None) -> Dict[str, float]:
+    """Run one encode, one FAISS search per index, the schema index build and one database ping.
+
+    Args:
+        config (Optional[RunnableConfig]): Configuration selecting the database and vectorstores.
+
+    Returns:
+        Dict[str, float]: Seconds spent in each step.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    timings = {}
+
+    start = time.perf_counter()
+    query_embedding = get_embedding_model().encode(["warmup"], convert_to_numpy=True)
+    timings["encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorstore_handler = configuration.vectorstore_handler
+    vectorstore_handler.name_vectorstore["name"]["index"].search(query_embedding, 1)
+    vectorstore_handler.sql_vectorstore["index"].search(query_embedding, 1)
+    timings["faiss_search"] = time.perf_counter() - start
+
+    if configuration.schema_pruning:
+        start = time.perf_counter()
+        get_schema_index().select_tables(query_embedding, configuration.schema_top_k, configuration.schema_tables)
+        timings["schema_index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with configuration.db_handler.engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    timings["db_ping"] = time.perf_counter() - start
+
+    if configuration.vectorstore_reload_interval:
+        start_reloader(configuration.vectorstore_path, configuration.vectorstore_reload_interval)
+
+    return timings
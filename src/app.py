@@ -1,11 +1,14 @@
 import streamlit as st
 import asyncio
+import queue
+import threading
 from langchain_core.messages import HumanMessage, AIMessage
 from sqlalchemy import select, Table, MetaData
 from sqlalchemy.orm import sessionmaker
 from agent.configuration import DatabaseHandler
 from agent.state import State
-from agent.graph import graph
+from agent.streaming import astream_turn
+from agent.warmup import warmup
 
 st.set_page_config(page_title="Smart City Assistant", page_icon="🤖")
 st.title("🤖 Smart City Assistant")
@@ -45,6 +48,20 @@ except Exception as e:
     st.error(f"Error conectando a la base de datos: {e}")
     st.stop()
 
+@st.cache_resource(show_spinner="Cargando modelos...")
+def warm_up_agent():
+    return warmup()
+
+warm_up_agent()
+
+@st.cache_resource
+def agent_event_loop():
+    # Un único event loop para todo el servidor: los clientes del LLM y el batcher de
+    # embeddings están ligados al loop, así que se reutilizan entre turnos y sesiones.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return loop
+
 @st.cache_data
 def load_filter_options():
     session = Session()
@@ -69,19 +86,26 @@ def load_filter_options():
         if session.is_active:
             session.close()
 
-async def run_conversation(user_input, history=None):
+async def run_conversation(user_input, history=None, on_token=None, on_sql=None, on_error=st.error):
     if history is None:
         history = []
     messages_for_state = history + [HumanMessage(content=user_input)]
     state = State(messages=messages_for_state)
     try:
-        result = await graph.ainvoke(state)
+        result = None
+        async for kind, payload in astream_turn(state):
+            if kind == "token" and on_token:
+                on_token(payload)
+            elif kind == "sql" and on_sql:
+                on_sql(payload)
+            elif kind == "final":
+                result = payload
     except Exception as e:
-        st.error(f"Error invocando graph: {e}")
+        on_error(f"Error invocando graph: {e}")
         return f"Ocurrió un error: {e}", history, None
 
     if not isinstance(result, dict):
-        st.error(f"Tipo de resultado inesperado: {type(result)}")
+        on_error(f"Tipo de resultado inesperado: {type(result)}")
         return "Datos inesperados del agente.", history, None
 
     updated_messages = result.get("messages", [])
@@ -93,6 +117,28 @@ async def run_conversation(user_input, history=None):
     )
     return assistant_message, updated_messages, sql_query
 
+def run_turn_on_agent_loop(user_input, history, on_token, on_sql):
+    """Ejecuta un turno en el event loop compartido y aplica los eventos en el hilo del script.
+
+    Los elementos de Streamlit solo pueden actualizarse desde el hilo del script, así que
+    los tokens, el SQL y los errores llegan por una cola.
+    """
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        run_conversation(user_input, history,
+                         on_token=lambda token: events.put((on_token, token)),
+                         on_sql=lambda sql: events.put((on_sql, sql)),
+                         on_error=lambda message: events.put((st.error, message))),
+        agent_event_loop(),
+    )
+    while not (future.done() and events.empty()):
+        try:
+            handler, payload = events.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        handler(payload)
+    return future.result()
+
 # ------------------------------
 # 3. Sidebar: Filtros amigables
 # ------------------------------
@@ -169,15 +215,25 @@ if input_to_process:
         st.markdown(input_to_process)
     current_history_for_call = st.session_state.history[:]
     with st.chat_message("assistant"):
+        sql_placeholder = st.empty()
+        answer_placeholder = st.empty()
+        streamed_answer = []
+
+        def show_token(token):
+            streamed_answer.append(token)
+            answer_placeholder.markdown("".join(streamed_answer) + "▌")
+
+        def show_sql(sql):
+            with sql_placeholder.container():
+                with st.expander("Mostrar SQL generado"):
+                    st.code(sql, language="sql")
+
         with st.spinner("Pensando..."):
             try:
-                response, updated_history, sql_query = asyncio.run(
-                    run_conversation(input_to_process, current_history_for_call)
+                response, updated_history, sql_query = run_turn_on_agent_loop(
+                    input_to_process, current_history_for_call, show_token, show_sql
                 )
-                st.markdown(response)
-                if sql_query:
-                    with st.expander("Mostrar SQL generado"):
-                        st.code(sql_query, language="sql")
+                answer_placeholder.markdown(response)
                 st.session_state.history = updated_history
                 if st.session_state.history and isinstance(st.session_state.history[-1], AIMessage):
                     if not hasattr(st.session_state.history[-1], 'additional_kwargs'):
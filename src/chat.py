@@ -1,6 +1,7 @@
 from agent.state import State
 from langchain_core.messages import HumanMessage, AIMessage
-from agent.graph import graph  # your compiled graph
+from agent.streaming import astream_turn
+from agent.warmup import warmup
 
 async def run_conversation(user_input, history=None):
     if history is None:
@@ -9,22 +10,38 @@ async def run_conversation(user_input, history=None):
     history.append(HumanMessage(content=user_input))
     state = State(messages=history)
 
-    result = await graph.ainvoke(state)
+    print("Bot: ", end="", flush=True)
+    streamed = False
+    result = None
+    async for kind, payload in astream_turn(state):
+        if kind == "token":
+            print(payload, end="", flush=True)
+            streamed = True
+        elif kind == "sql":
+            print(f"\n[SQL]\n{payload}\n", flush=True)
+        else:
+            result = payload
     updated_messages = result["messages"]
 
     assistant_message = next(
         (msg.content for msg in reversed(updated_messages) if isinstance(msg, AIMessage)),
         "Hmm... I didn’t get that."
     )
+    # Answers that skip the LLM (e.g. SQL errors) are not streamed.
+    print("" if streamed else assistant_message)
 
 
     return assistant_message, updated_messages
 
+async def chat_loop():
+    # Un solo event loop para toda la conversación, para reutilizar los clientes del LLM.
+    history = []
+    while True:
+        user_input = await asyncio.to_thread(input, "You: ")
+        response, history = await run_conversation(user_input, history)
+
 if __name__ == "__main__":
     import asyncio
 
-    history = []
-    while True:
-        user_input = input("You: ")
-        response, history = asyncio.run(run_conversation(user_input, history))
-        print("Bot:", response)
\ No newline at end of file
+    warmup()
+    asyncio.run(chat_loop())
@@ -0,0 +1,44 @@
+import faiss
+import numpy as np
+import pytest
+
+from agent import ann_index, vectorstore_io
+
+
+def _embeddings(n: int, d: int = 32) -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(n, d)).astype(np.float32)
+
+
+@pytest.mark.parametrize("index_type", ann_index.INDEX_TYPES)
+def test_build_index_searches_by_cosine(index_type) -> None:
+    embeddings = _embeddings(400)
+    index, build_params = ann_index.build_index(embeddings * 3.0, index_type)
+    entry = {"index": index, "values": list(range(400)), "build_params": build_params}
+
+    scores, ids = ann_index.search(entry, embeddings[7:8], 3)
+
+    assert build_params["metric"] == ann_index.INNER_PRODUCT and build_params["normalized"]
+    assert index.ntotal == 400 and len(ids) == 3
+    if index_type != "ivfpq":  # quantized codes only approximate the vector
+        assert ids[0] == 7 and scores[0] == pytest.approx(1.0, abs=1e-4)
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_ivfpq_parameters_fit_small_stores_and_survive_saving(tmp_path) -> None:
+    index, build_params = ann_index.build_index(_embeddings(300), "ivfpq", m=20, nprobe=4)
+
+    assert (build_params["m"], build_params["nbits"], build_params["nlist"]) == (16, 8, 7)
+    vectorstore_io.save_vectorstore({"index": index, "values": [str(i) for i in range(300)],
+                                     "build_params": build_params}, tmp_path / "sql", "test-model")
+    loaded = vectorstore_io.load_vectorstore(tmp_path / "sql")
+    assert loaded["build_params"]["nprobe"] == 4
+    assert faiss.extract_index_ivf(loaded["index"]).nprobe == 4
+
+
+def test_legacy_l2_scores_are_converted() -> None:
+    assert ann_index.similarities([0.0, 2.0]) == [1.0, 0.0]
+    assert ann_index.similarities([0.25], {"metric": ann_index.INNER_PRODUCT}) == [0.25]
+
+
+def test_similarity_from_distances() -> None:
+    assert ann_index.similarity_from_distances([0.0, 2.0]) == [1.0, 0.0]
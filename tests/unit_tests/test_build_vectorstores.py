@@ -0,0 +1,52 @@
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from agent import ann_index
+from agent.build_vectorstores import ShardStore, assemble_column, build_column_shards
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, values):
+        self.encoded.extend(values)
+        return np.stack([np.random.default_rng(sum(map(ord, v))).normal(size=16) for v in values]).astype(np.float32)
+
+
+def _engine(tmp_path, names):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS building (name TEXT)"))
+        connection.execute(text("INSERT INTO building VALUES (:name)"), [{"name": name} for name in names])
+    return engine
+
+
+def test_shards_are_deduplicated_resumed_and_assembled(tmp_path) -> None:
+    engine = _engine(tmp_path, [f"Edificio {i:02d}" for i in range(10)] + ["Edificio 03 ", None, "Edificio 05"])
+    signature = {"table": "building", "column": "name", "shard_size": 4}
+    encode = CountingEncoder()
+
+    count = build_column_shards(engine, "building", "name", ShardStore(tmp_path / "work", signature),
+                                encode, batch_size=3, shard_size=4, workers=2)
+
+    # "Edificio 03 " is kept as stored, since it is the literal that matches its rows, but embedded stripped.
+    assert count == 11 and len(encode.encoded) == 11 and encode.encoded.count("Edificio 03") == 2
+    store = ShardStore(tmp_path / "work", signature)
+    assert store.completed() == 3
+
+    # A new value sorting into the second shard: only that shard and the following ones are encoded again.
+    _engine(tmp_path, ["Edificio 05b"])
+    encode = CountingEncoder()
+    assert build_column_shards(engine, "building", "name", store, encode, batch_size=3, shard_size=4) == 12
+    assert encode.encoded == ["Edificio 03", "Edificio 04", "Edificio 05", "Edificio 05b", "Edificio 06",
+                              "Edificio 07", "Edificio 08", "Edificio 09"]
+
+    entry = assemble_column(store, "flat")
+    assert entry["values"][:8] == ["Edificio 00", "Edificio 01", "Edificio 02", "Edificio 03",
+                                   "Edificio 03 ", "Edificio 04", "Edificio 05", "Edificio 05b"]
+    _, ids = ann_index.search(entry, encode(["Edificio 05b"]), 1)
+    assert entry["values"][ids[0]] == "Edificio 05b"
+    assert assemble_column(store, "ivfpq", train_size=6, m=4)["index"].ntotal == 12
+
+    assert ShardStore(tmp_path / "work", {**signature, "shard_size": 8}).completed() == 0
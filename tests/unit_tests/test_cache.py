@@ -0,0 +1,82 @@
+from agent.cache import SqlResultCache, TTLCache, sql_fingerprint
+from agent.utils import normalize_query
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries() -> None:
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache.set("a", 1)
+
+    clock.now = 4
+    assert cache.get("a") == 1
+    clock.now = 6
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_normalize_query_folds_case_accents_and_whitespace() -> None:
+    assert normalize_query("  ¿Cuál es el consumo de   la Torre Norte?\n") == normalize_query(
+        "¿cual es el consumo de la torre norte?"
+    )
+
+
+def test_sql_fingerprint_ignores_formatting() -> None:
+    a = sql_fingerprint("SELECT name\nFROM building -- edificios\nWHERE type = 'Mercado';", "smart_buildings")
+    b = sql_fingerprint("```sql\nselect name from building where type = 'Mercado'\n```", "smart_buildings")
+
+    assert a == b
+    assert a != sql_fingerprint("SELECT name FROM building WHERE type = 'mercado'", "smart_buildings")
+    assert a != sql_fingerprint("SELECT name FROM building WHERE type = 'Mercado'", "other_schema")
+
+
+def test_sql_result_cache_follows_data_version() -> None:
+    clock = FakeClock()
+    cache = SqlResultCache(maxsize=10, ttl=None, version_ttl=60, timer=clock)
+    versions = iter(["2025-05-01", "2025-05-02"])
+
+    version = cache.current_version(lambda: next(versions))
+    cache.set("SELECT 1", None, version, "| 1 |")
+    assert cache.current_version(lambda: next(versions)) == "2025-05-01"
+    assert cache.get("SELECT 1", None, version) == "| 1 |"
+
+    clock.now = 61
+    version = cache.current_version(lambda: next(versions))
+    assert version == "2025-05-02"
+    assert cache.get("SELECT 1", None, version) is None
+
+
+def test_sql_result_cache_keys_by_limits_and_skips_unknown_versions() -> None:
+    cache = SqlResultCache(maxsize=10, ttl=None)
+
+    cache.set("SELECT 1", None, "v1", "preview", limits=(100, 1000))
+    assert cache.get("SELECT 1", None, "v1", limits=(100, 1000)) == "preview"
+    assert cache.get("SELECT 1", None, "v1", limits=(5000, 1000)) is None
+
+    def failing_probe():
+        raise RuntimeError("database down")
+
+    version = cache.current_version(failing_probe)
+    cache.set("SELECT 2", None, version, "stale")
+    assert version is None and cache.get("SELECT 2", None, version) is None
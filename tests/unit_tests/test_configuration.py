@@ -1,5 +1,32 @@
-from agent.configuration import Configuration
+"""Define any unit tests you may want in this directory."""
+from agent.configuration import Configuration, ResourceRegistry
 
 
 def test_configuration_empty() -> None:
     Configuration.from_runnable_config({})
+
+
+def test_registry_reads_schema_once(tmp_path) -> None:
+    schema_file = tmp_path / "schema.sql"
+    schema_file.write_text("CREATE TABLE a (id INT);", encoding="utf-8")
+    registry = ResourceRegistry()
+
+    first = registry.get_schema(str(schema_file))
+    schema_file.write_text("CREATE TABLE b (id INT);", encoding="utf-8")
+
+    assert registry.get_schema(str(schema_file)) is first
+    assert registry.reload_schema(str(schema_file)) == "CREATE TABLE b (id INT);"
+    assert registry.get_schema(str(schema_file)) == "CREATE TABLE b (id INT);"
+
+
+def test_registry_shares_db_handler(tmp_path) -> None:
+    url = f"sqlite:///{tmp_path / 'energy.db'}"
+    registry = ResourceRegistry()
+
+    handler = registry.get_db_handler(url)
+    assert registry.get_db_handler(url) is handler
+
+    reloaded = registry.reload_db_handler(url)
+    assert reloaded is not handler
+    assert registry.get_db_handler(url) is reloaded
+    registry.clear()
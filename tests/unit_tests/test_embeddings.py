@@ -0,0 +1,57 @@
+import asyncio
+
+import numpy as np
+
+from agent.embeddings import EmbeddingBatcher
+
+
+class FakeModel:
+    def __init__(self) -> None:
+        self.calls = []
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True):
+        self.calls.append(list(texts))
+        return np.array([[float(len(text))] for text in texts])
+
+
+def test_batcher_coalesces_concurrent_requests() -> None:
+    model = FakeModel()
+    batcher = EmbeddingBatcher(model=model, max_batch_size=10, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(batcher.encode(["a"]), batcher.encode(["bb", "ccc"]))
+
+    first, second = asyncio.run(run())
+
+    assert model.calls == [["a", "bb", "ccc"]]
+    assert first.tolist() == [[1.0]]
+    assert second.tolist() == [[2.0], [3.0]]
+
+
+def test_batcher_flushes_when_full() -> None:
+    model = FakeModel()
+    batcher = EmbeddingBatcher(model=model, max_batch_size=2, max_wait=10)
+
+    async def run():
+        return await asyncio.gather(*(batcher.encode([text]) for text in ["a", "b", "c", "d"]))
+
+    asyncio.run(asyncio.wait_for(run(), timeout=1))
+
+    assert model.calls == [["a", "b"], ["c", "d"]]
+
+
+def test_batcher_reports_model_load_failures_to_every_caller(monkeypatch) -> None:
+    from agent import embeddings
+
+    def failing_load():
+        raise OSError("model not found")
+
+    monkeypatch.setattr(embeddings, "get_embedding_model", failing_load)
+    batcher = EmbeddingBatcher(max_batch_size=10, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(batcher.encode(["a"]), batcher.encode(["b"]), return_exceptions=True)
+
+    results = asyncio.run(asyncio.wait_for(run(), timeout=1))
+
+    assert [type(r) for r in results] == [OSError, OSError]
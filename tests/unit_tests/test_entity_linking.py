@@ -0,0 +1,53 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from agent import ann_index
+from agent.entity_linking import candidate_ngrams, format_entity_matches, link_entities
+from agent.utils import normalize_query
+
+
+def _encode(texts):
+    """Bag of folded words hashed into 64 dimensions: texts sharing words are similar."""
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in normalize_query(text).split():
+            embeddings[row, zlib.crc32(word.encode()) % 64] += 1.0
+    return embeddings
+
+
+def _vectorstore(values_by_column):
+    vectorstore = {}
+    for column, values in values_by_column.items():
+        index, build_params = ann_index.build_index(_encode(values), "flat")
+        vectorstore[column] = {"index": index, "values": values, "build_params": build_params}
+    return vectorstore
+
+
+def test_candidate_ngrams_skip_stopwords_months_and_numbers() -> None:
+    candidates = candidate_ngrams("¿Cuánto consumió la Escuela Antoni Gaudí en marzo de 2024?")
+
+    assert candidates == ["Escuela Antoni Gaudí", "Escuela Antoni", "Antoni Gaudí", "Escuela", "Antoni", "Gaudí"]
+    assert candidate_ngrams("la Escuela y la ESCUELA", max_n=1) == ["Escuela"]
+
+
+def test_link_entities_returns_typed_matches_from_every_column() -> None:
+    vectorstore = _vectorstore({
+        "name": ["Escuela Antoni Gaudí", "Biblioteca Municipal", "Mercado Municipal"],
+        "type": ["Educación", "Mercado", "Parque"],
+    })
+    candidates = candidate_ngrams("consumo de la escuela antoni gaudi y de los mercados")
+
+    matches = link_entities(candidates, _encode(candidates), vectorstore, threshold=0.6)
+
+    assert [(m.column, m.value) for m in matches] == [("name", "Escuela Antoni Gaudí")]
+    assert matches[0].score == pytest.approx(1.0) and matches[0].text == "escuela antoni gaudi"
+
+    candidates = candidate_ngrams("parque y mercado")
+    matches = link_entities(candidates, _encode(candidates), vectorstore, threshold=0.6)
+    assert [(m.column, m.value) for m in matches][2:] == [("name", "Mercado Municipal")]
+    assert {(m.column, m.value) for m in matches[:2]} == {("type", "Parque"), ("type", "Mercado")}
+    only_names = link_entities(candidates, _encode(candidates), vectorstore, columns=["name"], threshold=0.6)
+    assert [m.value for m in only_names] == ["Mercado Municipal"]
+    assert "- type: 'Parque' (similarity 1.00" in format_entity_matches([vars(m) for m in matches])
@@ -0,0 +1,98 @@
+from langchain_core.messages import HumanMessage
+
+from agent.graph import route_query
+from agent.state import State
+
+
+def _state(route: str, relevant_values=None) -> State:
+    return State(
+        messages=[HumanMessage(content="Consumo de Torre Norte en abril")],
+        router={"type": route, "logic": ""},
+        relevant_values=relevant_values,
+    )
+
+
+def test_route_query_uses_speculative_values() -> None:
+    speculated = {"query": "Consumo de Torre Norte en abril", "matched_names": ["Torre Norte"]}
+
+    assert route_query(_state("database")) == "retrieve_relevant_values"
+    assert route_query(_state("database", speculated)) == "sql_generation"
+    assert route_query(_state("database", {**speculated, "query": "otra pregunta"})) == "retrieve_relevant_values"
+    assert route_query(_state("general", speculated)) == "respond_to_general_query"
+
+
+def test_detect_intent_waits_for_speculation_only_on_the_database_route(monkeypatch) -> None:
+    import asyncio
+
+    from langchain_core.runnables import RunnableLambda
+
+    from agent import graph
+    from agent.state import Router
+
+    cancelled = []
+
+    async def slow_retrieval(state, *, config):
+        try:
+            await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return {"relevant_values": {"query": "q"}, "relevant_tables": ["building"],
+                "node_timings": {"speculative_retrieval": 0.2}}
+
+    def router(route):
+        async def classify(messages):
+            return Router(type=route, logic="")
+        return lambda *args, **kwargs: RunnableLambda(classify)
+
+    monkeypatch.setattr(graph, "speculative_retrieval", slow_retrieval)
+    config = {"configurable": {"speculative_retrieval": True}}
+    state = _state("general")
+
+    async def run(route):
+        monkeypatch.setattr(graph, "get_structured_chat_model", router(route))
+        update = await graph.detect_intent(state, config=config)
+        await asyncio.sleep(0)
+        return update
+
+    update = asyncio.run(run("general"))
+    assert "relevant_values" not in update and cancelled == [True]
+
+    update = asyncio.run(run("database"))
+    assert update["relevant_values"] == {"query": "q"} and update["relevant_tables"] == ["building"]
+    assert set(update["node_timings"]) == {"intent_detection", "speculative_retrieval"}
+
+
+def test_astream_turn_hides_rejected_sql(monkeypatch) -> None:
+    import asyncio
+
+    from agent import streaming
+
+    class FakeGraph:
+        def __init__(self, guard_update):
+            self.guard_update = guard_update
+
+        async def astream(self, state, config, stream_mode):
+            yield "updates", {"query_guard": self.guard_update}
+            yield "values", {"messages": []}
+
+    async def events(guard_update):
+        monkeypatch.setattr(streaming, "graph", FakeGraph(guard_update))
+        return [kind async for kind, _ in streaming.astream_turn(_state("database"))]
+
+    assert asyncio.run(events({"sql_query": "SELECT 1", "sql_rejection": None})) == ["sql", "final"]
+    assert asyncio.run(events({"sql_query": "DELETE FROM building", "sql_rejection": "No"})) == ["final"]
+
+
+def test_sql_prompt_only_prefers_tables_left_after_pruning() -> None:
+    from agent.configuration import Configuration
+    from agent.graph import _sql_system_prompt
+
+    configuration = Configuration(database_url=None)
+
+    pruned = _sql_system_prompt(configuration, "CREATE TABLE ...", None, ["building", "daily_consumption"])
+    assert "smart_buildings.daily_consumption" in pruned and "monthly_metrics" not in pruned
+
+    assert "Preferred sources" not in _sql_system_prompt(configuration, "CREATE TABLE ...", None, ["building"])
+    full = _sql_system_prompt(configuration, "CREATE TABLE ...", None, configuration.schema_tables)
+    assert "weekly_metrics" in full and "monthly_metrics" in full
@@ -0,0 +1,56 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agent.metrics import MetricsRecorder, NodeMetrics, get_recorder, instrument, set_recorder
+
+
+class ListRecorder(MetricsRecorder):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def record(self, metrics: NodeMetrics, span=None) -> None:
+        self.records.append(metrics)
+
+
+def test_instrument_records_tokens_rows_and_route() -> None:
+    model = FakeMessagesListChatModel(responses=[
+        AIMessage(content="SELECT 1", usage_metadata={"input_tokens": 120, "output_tokens": 8, "total_tokens": 128}),
+    ])
+
+    async def sql_node(state, *, config):
+        await model.ainvoke([HumanMessage(content=state)])
+        return {"sql_path": "llm", "query_result": "| a |\n| ñ |", "query_row_count": 1}
+
+    previous = get_recorder()
+    recorder = ListRecorder()
+    set_recorder(recorder)
+    try:
+        node = instrument("sql_generation", sql_node)
+        update = asyncio.run(node("Consumo de Torre Norte", config={}))
+        instrument("intent_detection", lambda state: {"router": {"type": "database"}})("hola")
+    finally:
+        set_recorder(previous)
+
+    assert update["sql_path"] == "llm"
+    sql_metrics, intent_metrics = recorder.records
+    assert (sql_metrics.node, sql_metrics.input_tokens, sql_metrics.output_tokens) == ("sql_generation", 120, 8)
+    assert (sql_metrics.result_bytes, sql_metrics.result_rows, sql_metrics.route) == (12, 1, "llm")
+    assert (intent_metrics.route, intent_metrics.input_tokens, intent_metrics.error) == ("database", 0, False)
+
+
+def test_instrument_is_transparent_when_disabled() -> None:
+    async def node(state, *, config):
+        return {"state": state}
+
+    wrapped = instrument("node", node)
+
+    assert not get_recorder().enabled
+    assert asyncio.iscoroutinefunction(wrapped) and wrapped.__wrapped__ is node
+    assert asyncio.run(wrapped("x", config={})) == {"state": "x"}
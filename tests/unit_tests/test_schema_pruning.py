@@ -0,0 +1,51 @@
+import numpy as np
+
+from agent.schema_pruning import build_schema_index, prune_schema
+from agent.sql_validation import parse_schema_sql
+
+SCHEMA = """
+CREATE TABLE smart_buildings.building (
+    cups TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE smart_buildings.daily_consumption (
+    cups TEXT NOT NULL,
+    day DATE NOT NULL,
+    FOREIGN KEY (cups) REFERENCES smart_buildings.building(cups)
+);
+
+CREATE TABLE smart_buildings.energy_consumption_weekly_metrics (
+    cups TEXT NOT NULL,
+    week_start DATE NOT NULL,
+    FOREIGN KEY (cups) REFERENCES smart_buildings.building(cups)
+);
+"""
+
+CONTEXT = {
+    "tables": [
+        {"name": "building", "description": "edificios", "columns": [{"name": "name", "description": "nombre"}]},
+        {"name": "daily_consumption", "description": "consumo diario", "columns": [{"name": "day", "description": "dia"}]},
+        {"name": "energy_consumption_weekly_metrics", "description": "semana",
+         "columns": [{"name": "week_start", "description": "lunes de la semana"}]},
+    ]
+}
+
+VOCABULARY = ["edificios", "nombre", "consumo", "diario", "dia", "semana", "lunes"]
+
+
+def fake_encode(texts):
+    return np.array([[float(word in text) for word in VOCABULARY] for text in texts])
+
+
+def test_select_tables_adds_foreign_key_closure() -> None:
+    tables = parse_schema_sql(SCHEMA)
+    index = build_schema_index(CONTEXT, fake_encode)
+
+    selected = index.select_tables(fake_encode(["consumo diario por dia"])[0], 1, tables)
+
+    assert selected == ["daily_consumption", "building"]
+    pruned = prune_schema(selected, tables)
+    assert pruned.startswith("CREATE TABLE smart_buildings.building")
+    assert "smart_buildings.daily_consumption" in pruned
+    assert "energy_consumption_weekly_metrics" not in pruned
@@ -0,0 +1,29 @@
+from agent.sql_fast_path import reuse_known_sql
+
+KNOWN = (
+    "¿Cuál fue el consumo total de Torre Norte en abril?",
+    "```sql\nSELECT m.total_consumption_kwh FROM smart_buildings.building b "
+    "JOIN smart_buildings.energy_consumption_monthly_metrics m ON b.cups = m.cups "
+    "WHERE b.name = 'Torre Norte' AND m.year_month = DATE '2025-04-01';\n```",
+)
+
+
+def _reuse(question, known=KNOWN, score=0.97, names=("Hospital Central", "Torre Sur")):
+    return reuse_known_sql(question, [known], [score], list(names), ["Mercado", "Parque"], threshold=0.95)
+
+
+def test_reuses_sql_with_the_user_building() -> None:
+    sql = _reuse("Consumo total del Hospital Central en abril")
+
+    assert sql is not None
+    assert "b.name = 'Hospital Central'" in sql
+    assert "```" not in sql
+
+
+def test_falls_back_below_threshold_or_on_other_month() -> None:
+    assert _reuse("Consumo total del Hospital Central en abril", score=0.9) is None
+    assert _reuse("Consumo total del Hospital Central en mayo") is None
+
+
+def test_falls_back_when_no_building_is_named() -> None:
+    assert _reuse("Consumo total en abril", names=("Centro Cívico",)) is None
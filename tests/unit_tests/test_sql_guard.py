@@ -0,0 +1,36 @@
+from sqlalchemy import create_engine
+
+from agent.sql_guard import READ_ONLY_MESSAGE, ensure_limit, guard_query
+
+
+def test_ensure_limit_only_touches_outer_query() -> None:
+    assert ensure_limit("SELECT a FROM t;", 100) == "SELECT a FROM t\nLIMIT 100"
+    assert ensure_limit("SELECT a FROM t LIMIT 10", 100) == "SELECT a FROM t LIMIT 10"
+    assert ensure_limit("SELECT a FROM t LIMIT 5000 OFFSET 3", 100) == "SELECT a FROM t LIMIT 100 OFFSET 3"
+    assert ensure_limit(
+        "WITH x AS (SELECT a FROM t LIMIT 5000) SELECT a FROM x", 100
+    ) == "WITH x AS (SELECT a FROM t LIMIT 5000) SELECT a FROM x\nLIMIT 100"
+
+
+def test_ensure_limit_respects_fetch_and_locking_clauses() -> None:
+    assert ensure_limit("SELECT a FROM t WHERE b = 1 LIMIT 500", 100) == "SELECT a FROM t WHERE b = 1 LIMIT 100"
+    assert ensure_limit("SELECT a FROM t ORDER BY a FETCH FIRST 500 ROWS ONLY", 100) == (
+        "SELECT a FROM t ORDER BY a FETCH FIRST 100 ROWS ONLY"
+    )
+    assert ensure_limit("SELECT a FROM t WHERE b = 1 FETCH FIRST ROW ONLY", 100) == (
+        "SELECT a FROM t WHERE b = 1 FETCH FIRST ROW ONLY"
+    )
+    assert ensure_limit("SELECT a FROM t WHERE b = 1 FOR UPDATE", 100) == "SELECT a FROM t WHERE b = 1 LIMIT 100\nFOR UPDATE"
+    assert ensure_limit("SELECT SUBSTRING(a FROM 1 FOR 3) FROM t", 100) == "SELECT SUBSTRING(a FROM 1 FOR 3) FROM t\nLIMIT 100"
+
+
+def test_guard_query_rejects_writes_and_adds_limit() -> None:
+    engine = create_engine("sqlite://")
+
+    for sql in ("DELETE FROM building", "SELECT 1; DROP TABLE building", "SELECT name FROM building FOR SHARE"):
+        assert guard_query(sql, engine, limit=100).rejection == READ_ONLY_MESSAGE
+
+    result = guard_query("```sql\nSELECT name FROM building;\n```", engine, max_cost=10, limit=100)
+
+    assert result.rejection is None and result.error is None
+    assert result.sql == "SELECT name FROM building\nLIMIT 100"
@@ -0,0 +1,63 @@
+from agent.sql_validation import parse_schema_sql, validate_sql
+
+SCHEMA = """
+CREATE TABLE smart_buildings.building (
+    cups TEXT PRIMARY KEY,         -- building unique identifier
+    name TEXT NOT NULL,
+    type TEXT                      -- Type of building
+);
+
+CREATE TABLE smart_buildings.energy_consumption_monthly_metrics (
+    cups TEXT NULL,
+    year_month DATE NULL,          -- first day of month
+    total_consumption_kwh numeric(20, 2) NULL
+    ytd_consumption_kwh NUMERIC(38, 6) NULL,
+    FOREIGN KEY (cups) REFERENCES smart_buildings.building(cups)
+);
+"""
+
+
+def test_parse_schema_sql_is_lenient() -> None:
+    tables = parse_schema_sql(SCHEMA)
+
+    assert list(tables) == ["building", "energy_consumption_monthly_metrics"]
+    metrics = tables["energy_consumption_monthly_metrics"]
+    assert metrics.schema == "smart_buildings"
+    assert metrics.columns == ["cups", "year_month", "total_consumption_kwh", "ytd_consumption_kwh"]
+    assert metrics.foreign_keys == [("cups", "building", "cups")]
+    assert metrics.ddl.startswith("CREATE TABLE smart_buildings.energy_consumption_monthly_metrics")
+
+
+def test_validate_sql_accepts_valid_queries() -> None:
+    tables = parse_schema_sql(SCHEMA)
+
+    assert validate_sql("""```sql
+SELECT b.name, m.total_consumption_kwh AS total
+FROM smart_buildings.building b
+JOIN smart_buildings.energy_consumption_monthly_metrics m ON b.cups = m.cups
+WHERE EXTRACT(YEAR FROM m.year_month) = 2025
+ORDER BY total DESC;
+```""", tables) == []
+    assert validate_sql("""
+WITH totals AS (
+    SELECT cups, SUM(total_consumption_kwh) AS total
+    FROM smart_buildings.energy_consumption_monthly_metrics
+    GROUP BY cups
+)
+SELECT b."name", t.total FROM totals t, smart_buildings.building AS b WHERE b.cups = t.cups
+""", tables) == []
+
+
+def test_validate_sql_reports_unknown_names() -> None:
+    tables = parse_schema_sql(SCHEMA)
+
+    assert validate_sql("SELECT b.nam FROM smart_buildings.building b", tables) == [
+        "Column `nam` does not exist in table `building` (alias `b`)."
+    ]
+    assert validate_sql("SELECT name FROM smart_buildings.buildings", tables) == [
+        "Unknown table `smart_buildings.buildings`."
+    ]
+    assert validate_sql("SELECT x.name, avg_daily_kwh FROM smart_buildings.building b", tables) == [
+        "Unknown table or alias `x` in `x.name`.",
+        "Column `avg_daily_kwh` does not exist in tables `building`.",
+    ]
@@ -0,0 +1,43 @@
+from datetime import date
+from decimal import Decimal
+
+from agent.summarize import summarize_result
+
+
+def test_summarize_result_digests_long_time_series() -> None:
+    rows = [
+        (name, date(2024, month, 1), Decimal(1000 + month * step))
+        for name, step in (("Torre Norte", 10), ("Biblioteca Central", 40))
+        for month in range(1, 13)
+    ]
+
+    summary = summarize_result(["name", "year_month", "total_consumption_kwh"], rows, row_count=24, top_n=2)
+
+    assert summary.startswith("Resumen de 24 filas")
+    assert "Periodo: 2024-01-01 a 2024-12-01." in summary
+    assert "| total_consumption_kwh | 24.00 | 27900.00 | 1162.50 | 1010.00 | 1480.00 |" in summary
+    assert "| Biblioteca Central | 2024-12-01 | 1480.00 |" in summary
+    assert "| Torre Norte | 2024-01-01 | 1010.00 |" in summary
+    # Largest month-over-month change is +40 kWh for the library, never across buildings.
+    assert "| Biblioteca Central | 2024-02-01 | 1080.00 | 40.00 | 3.85 |" in summary
+
+
+def test_summarize_result_ranks_by_the_measure_not_by_years_or_ids() -> None:
+    rows = [(2020 + i % 4, i, f"Edificio {i}", 10 * (i % 7), Decimal(100 + (i * 37) % 50)) for i in range(20)]
+
+    summary = summarize_result(["year", "building_id", "name", "readings", "avg_daily_kwh"], rows, top_n=2)
+
+    assert "**2 filas con mayor avg_daily_kwh:**" in summary
+    assert "| 2020 | 4 | Edificio 4 | 40 | 148.00 |\n| 2020 | 8 | Edificio 8 | 10 | 146.00 |" in summary
+    # Without a measure-like name, the first column that is not a year or id is used.
+    summary = summarize_result(["year", "building_id", "readings"], [r[:2] + (r[3],) for r in rows], top_n=2)
+    assert "**2 filas con mayor readings:**" in summary
+
+
+def test_summarize_result_handles_duplicate_column_names() -> None:
+    rows = [(f"ES{i}", f"ES{i}", Decimal(100 + i)) for i in range(12)]
+
+    summary = summarize_result(["cups", "cups", "total_consumption_kwh"], rows, top_n=2)
+
+    assert "columnas: cups, cups_2, total_consumption_kwh" in summary
+    assert "| ES11 | ES11 | 111.00 |" in summary
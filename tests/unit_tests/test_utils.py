@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from sqlalchemy import create_engine, text
+
+from agent import utils
+from agent.utils import execute_sql_query_async
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'energy.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE building (name TEXT, type TEXT)"))
+        connection.execute(text("INSERT INTO building VALUES ('Torre Norte', 'Administración')"))
+    return engine
+
+
+def test_execute_sql_query_async_returns_markdown(tmp_path) -> None:
+    engine = _engine(tmp_path)
+
+    result = asyncio.run(execute_sql_query_async("```sql\nSELECT name, type FROM building\n```", None, engine))
+
+    assert result.row_count == 1 and not result.truncated
+    assert result.to_markdown().splitlines() == ["| name | type |", "| --- | --- |", "| Torre Norte | Administración |"]
+
+
+def test_execute_sql_query_async_bounds_result(tmp_path) -> None:
+    engine = _engine(tmp_path)
+    many_rows = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 5000) SELECT i FROM n"
+
+    result = asyncio.run(execute_sql_query_async(many_rows, None, engine, max_rows=10))
+
+    assert result.row_count == 5000
+    assert result.truncated
+    assert len(result.rows) == 10
+    assert result.to_markdown().splitlines()[-1] == "(Se muestran 10 de 5000 filas.)"
+
+    result = asyncio.run(execute_sql_query_async(many_rows, None, engine, max_bytes=20))
+
+    assert [row[0] for row in result.rows] == list(range(1, 15))
+
+
+def test_execute_sql_query_async_cancels_on_timeout(tmp_path) -> None:
+    engine = _engine(tmp_path)
+    slow_query = (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+    )
+
+    start = time.perf_counter()
+    result = asyncio.run(execute_sql_query_async(slow_query, None, engine, timeout=0.2))
+
+    assert result.error == "ERROR SQL"
+    assert time.perf_counter() - start < 5
+
+
+def test_get_chat_model_reuses_clients(monkeypatch) -> None:
+    created = []
+
+    class FakeChatModel:
+        def __init__(self, name):
+            self.name = name
+            created.append(name)
+
+        def with_structured_output(self, schema):
+            return (self, schema)
+
+    monkeypatch.setattr(utils, "load_chat_model", lambda name, **kwargs: FakeChatModel(name))
+
+    async def lookup():
+        model = utils.get_chat_model("ollama-nexus/test-model")
+        assert utils.get_chat_model("ollama-nexus/test-model") is model
+        assert utils.get_structured_chat_model("ollama-nexus/test-model", dict) == (model, dict)
+        assert utils.get_structured_chat_model("ollama-nexus/test-model", dict) is utils.get_structured_chat_model(
+            "ollama-nexus/test-model", dict
+        )
+        assert utils.get_chat_model("ollama-nexus/test-model", temperature=0) is not model
+        return model
+
+    first_loop_model = asyncio.run(lookup())
+    second_loop_model = asyncio.run(lookup())
+
+    assert first_loop_model is not second_loop_model
+    assert created == ["ollama-nexus/test-model"] * 4
+
+
+def test_probe_data_version_falls_back_when_rollup_table_is_missing(tmp_path) -> None:
+    from agent.configuration import rollup_data_version_query
+
+    engine = _engine(tmp_path)
+
+    assert "analytics.rollup_state" in rollup_data_version_query("analytics")
+    assert utils.probe_data_version(engine, "SELECT MAX(name) FROM building") == "Torre Norte"
+    assert utils.probe_data_version(engine, "SELECT MAX(refreshed_at) FROM rollup_state",
+                                    "SELECT COUNT(*) FROM building") == 1
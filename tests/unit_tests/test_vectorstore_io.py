@@ -0,0 +1,58 @@
+import faiss
+import numpy as np
+
+from agent import vectorstore_io
+
+
+def _index(n: int, d: int = 8):
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((n, d), dtype=np.float32)
+    index = faiss.IndexFlatL2(d)
+    index.add(embeddings)
+    return index, embeddings
+
+
+def test_columns_vectorstore_roundtrip(tmp_path) -> None:
+    index, embeddings = _index(3)
+    vectorstore = {"name": {"index": index, "values": ["Torre Norte", "Ayuntamiento", "Escola de Girona"]}}
+
+    manifest = vectorstore_io.save_vectorstore(vectorstore, tmp_path / "names", "all-MiniLM-L6-v2")
+    loaded = vectorstore_io.load_vectorstore(tmp_path / "names")
+
+    assert manifest["layout"] == "columns"
+    assert manifest["dimension"] == 8
+    assert list(loaded["name"]["values"]) == vectorstore["name"]["values"]
+    _, ids = loaded["name"]["index"].search(embeddings[1:2], 1)
+    assert loaded["name"]["values"][ids[0][0]] == "Ayuntamiento"
+
+
+def test_single_vectorstore_keeps_records(tmp_path) -> None:
+    index, _ = _index(2)
+    values = [("¿Consumo de abril?", "SELECT 1;"), ("¿Y en mayo?", "SELECT 2;")]
+
+    vectorstore_io.save_vectorstore({"index": index, "values": values}, tmp_path / "sql", "all-MiniLM-L6-v2")
+    loaded = vectorstore_io.load_vectorstore(tmp_path / "sql")
+
+    assert loaded["index"].ntotal == 2
+    assert loaded["values"][-1] == values[-1]
+    assert vectorstore_io.read_manifest(tmp_path / "sql")["entries"]["default"]["encoding"] == "json"
+
+
+def test_saves_switch_versions_atomically_and_upgrade_legacy_stores(tmp_path) -> None:
+    index, _ = _index(2)
+    path = tmp_path / "names"
+    path.mkdir()
+    for suffix in ("faiss", "values", "offsets"):
+        (path / f"name.{suffix}").write_bytes(b"")
+    (path / "manifest.json").write_text('{"format_version": 1, "entries": {"name": '
+                                        '{"index": "name.faiss", "values": "name.values", "offsets": "name.offsets"}}}')
+
+    first = vectorstore_io.save_vectorstore({"name": {"index": index, "values": ["a", "b"]}}, path, "m")
+    assert not (path / "name.faiss").exists()
+    second = vectorstore_io.save_vectorstore({"name": {"index": index, "values": ["c", "d"]}}, path, "m")
+    third = vectorstore_io.save_vectorstore({"name": {"index": index, "values": ["e", "f"]}}, path, "m")
+
+    versions = {p.name for p in path.iterdir() if p.is_dir()}
+    assert versions == {second["data_dir"], third["data_dir"]} and first["data_dir"] not in versions
+    assert vectorstore_io.read_manifest(path)["data_dir"] == third["data_dir"]
+    assert list(vectorstore_io.load_vectorstore(path)["name"]["values"]) == ["e", "f"]
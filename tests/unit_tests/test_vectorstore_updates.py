@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+
+from agent import ann_index, vectorstore_io
+from agent.configuration import ResourceRegistry
+from agent.vectorstore_updates import VectorstoreUpdater, apply_value_delta
+
+
+def _encode(values):
+    """Deterministic stand-in for the embedding model: one random vector per value."""
+    return np.stack([np.random.default_rng(sum(map(ord, v))).normal(size=16) for v in values]).astype(np.float32)
+
+
+def _entry(values, index_type="flat"):
+    index, build_params = ann_index.build_index(_encode(values), index_type)
+    return {"index": index, "values": values, "build_params": build_params}
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_apply_value_delta_keeps_positions_and_skips_removed(index_type) -> None:
+    entry = _entry(["Ayuntamiento", "Biblioteca", "Colegio"], index_type)
+
+    updated = apply_value_delta(entry, added=["Piscina", "Colegio"], removed=["Biblioteca"], encode=_encode)
+
+    assert updated["values"] == ["Ayuntamiento", None, "Colegio", "Piscina"]
+    assert updated["tombstones"] == (1 if index_type == "hnsw" else 0)
+    assert entry["values"] == ["Ayuntamiento", "Biblioteca", "Colegio"]
+    _, ids = ann_index.search(updated, _encode(["Biblioteca"]), 3)
+    assert 1 not in ids and len(ids) == 3
+    _, ids = ann_index.search(updated, _encode(["Piscina"]), 1)
+    assert ids == [3]
+
+
+def test_updater_applies_logged_changes_and_swaps_them_in(tmp_path) -> None:
+    vectorstore_io.save_vectorstore({"name": _entry(["Ayuntamiento", "Biblioteca"]), "type": _entry(["Oficina"])},
+                                    tmp_path / "name_vectorstore", "test-model")
+    vectorstore_io.save_vectorstore(_entry(["¿Cuánto consume?"]), tmp_path / "sql_vectorstore", "test-model")
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE building (cups TEXT, name TEXT, type TEXT)"))
+        connection.execute(text("CREATE TABLE changes (id INTEGER PRIMARY KEY, column_name TEXT, "
+                                "old_value TEXT, new_value TEXT)"))
+        connection.execute(text("INSERT INTO building VALUES ('ES1', 'Ayuntamiento', 'Oficina'), "
+                                "('ES2', 'Biblioteca Central', 'Oficina'), ('ES3', 'Piscina', 'Deporte')"))
+        connection.execute(text("INSERT INTO changes (column_name, old_value, new_value) VALUES "
+                                "('name', 'Biblioteca', 'Biblioteca Central'), ('name', NULL, 'Piscina'), "
+                                "('type', NULL, 'Deporte'), ('address', NULL, 'Calle Mayor')"))
+    registry = ResourceRegistry()
+    previous = registry.get_vectorstore_handler(str(tmp_path))
+    updater = VectorstoreUpdater(engine, str(tmp_path), registry=registry, encode=_encode,
+                                 values_table="building", changes_table="changes")
+
+    deltas = updater.update()
+
+    assert deltas["name"].added == ["Biblioteca Central", "Piscina"] and deltas["name"].removed == ["Biblioteca"]
+    assert deltas["type"].added == ["Deporte"]
+    handler = registry.get_vectorstore_handler(str(tmp_path))
+    assert handler is not previous and list(previous.name_vectorstore["name"]["values"]) == ["Ayuntamiento", "Biblioteca"]
+    assert handler.name_vectorstore["name"]["values"] == ["Ayuntamiento", None, "Biblioteca Central", "Piscina"]
+    assert updater.watermark == 4 and updater.update() == {}
+
+    reopened = VectorstoreUpdater(engine, str(tmp_path), registry=ResourceRegistry(), encode=_encode,
+                                  values_table="building", changes_table="changes")
+    assert reopened.watermark == 4
+    saved = vectorstore_io.load_vectorstore(tmp_path / "name_vectorstore")
+    assert list(saved["type"]["values"]) == ["Oficina", "Deporte"]
+
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO changes (column_name, old_value, new_value) VALUES "
+                                "('address', 'Calle Mayor', 'Calle Menor')"))
+        connection.execute(text("INSERT INTO building VALUES ('ES4', 'Mercado', 'Mercado')"))
+        connection.execute(text("INSERT INTO changes (column_name, old_value, new_value) VALUES "
+                                "('name', NULL, 'Mercado')"))
+    assert reopened.update()["name"].added == ["Mercado"] and reopened.watermark == 6
+
+    # The first updater sees the build saved by the other one and serves it before going on.
+    assert updater.update() == {} and updater.watermark == 6
+    assert registry.get_vectorstore_handler(str(tmp_path)).name_vectorstore["name"]["values"][-1] == "Mercado"
+
+
+def test_updater_saves_the_watermark_when_nothing_changes(tmp_path) -> None:
+    vectorstore_io.save_vectorstore({"name": _entry(["Ayuntamiento"])}, tmp_path / "name_vectorstore", "test-model")
+    vectorstore_io.save_vectorstore(_entry(["¿Cuánto consume?"]), tmp_path / "sql_vectorstore", "test-model")
+    build_hash = vectorstore_io.read_manifest(tmp_path / "name_vectorstore")["build_hash"]
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE building (name TEXT)"))
+        connection.execute(text("CREATE TABLE changes (id INTEGER PRIMARY KEY, column_name TEXT, "
+                                "old_value TEXT, new_value TEXT)"))
+        connection.execute(text("INSERT INTO changes (column_name, old_value, new_value) VALUES "
+                                "('address', NULL, 'Calle Mayor'), ('name', 'Biblioteca', NULL)"))
+    updater = VectorstoreUpdater(engine, str(tmp_path), registry=ResourceRegistry(), encode=_encode,
+                                 values_table="building", changes_table="changes")
+
+    assert updater.update() == {}
+
+    manifest = vectorstore_io.read_manifest(tmp_path / "name_vectorstore")
+    assert manifest["metadata"]["change_log_id"] == 2 and manifest["build_hash"] == build_hash
+
+
+def test_listen_keeps_polling_while_the_listen_connection_fails(tmp_path) -> None:
+    import time
+    from types import SimpleNamespace
+
+    attempts = []
+
+    def raw_connection():
+        attempts.append(True)
+        raise OSError("server closed the connection")
+
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"), raw_connection=raw_connection)
+    updater = VectorstoreUpdater(engine, str(tmp_path), registry=ResourceRegistry())
+    updates = []
+    updater.update = lambda: updates.append(True) or {}
+
+    thread = updater.start(poll_interval=0.05)
+    time.sleep(0.5)
+    alive = thread.is_alive()
+    updater.stop()
+
+    assert alive and len(updates) > 3 and attempts
+
+
+def test_reloader_loads_new_builds_without_writing(tmp_path) -> None:
+    from agent.vectorstore_updates import VectorstoreReloader
+
+    vectorstore_io.save_vectorstore({"name": _entry(["Ayuntamiento"])}, tmp_path / "name_vectorstore", "test-model")
+    vectorstore_io.save_vectorstore(_entry(["¿Cuánto consume?"]), tmp_path / "sql_vectorstore", "test-model")
+    registry = ResourceRegistry()
+    previous = registry.get_vectorstore_handler(str(tmp_path))
+    reloader = VectorstoreReloader(str(tmp_path), registry=registry)
+
+    assert not reloader.check() and registry.get_vectorstore_handler(str(tmp_path)) is previous
+
+    vectorstore_io.save_vectorstore({"name": _entry(["Ayuntamiento", "Piscina"])}, tmp_path / "name_vectorstore",
+                                    "test-model")
+    assert reloader.check()
+    assert list(registry.get_vectorstore_handler(str(tmp_path)).name_vectorstore["name"]["values"]) == [
+        "Ayuntamiento", "Piscina"]